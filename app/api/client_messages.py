@@ -8,7 +8,8 @@ from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 from datetime import datetime
 import os
-import jwt
+
+from app.auth import get_current_user_id
 
 # Database setup
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -17,7 +18,6 @@ if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 
 @contextmanager
 def get_db():
@@ -31,18 +31,6 @@ def get_db():
     finally:
         db.close()
 
-def get_current_user_id(request: Request) -> str:
-    """Extract user ID from JWT token"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        raise HTTPException(status_code=401, detail="Missing token")
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload['user_id']
-    except:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
 router = APIRouter()
 
 
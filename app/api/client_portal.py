@@ -6,13 +6,17 @@ from datetime import datetime
 import secrets
 import base64
 import json
+import logging
 
 # Use the new auth module instead of inline auth
 from app.auth import get_current_user_id
+from app.services.upload_service import CLIENT_IMAGE_MAX_BYTES, CLIENT_IMAGE_TOO_LARGE, spool_upload
 
 # Import database directly from main (after models are defined)
 from app.main import get_db_context, engine
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 # Dependency function for endpoints that need current user
@@ -64,6 +68,375 @@ async def generate_client_view_link(request: Request, data: dict):
         return {"link": link, "token": token}
 
 
+def build_client_view_lists(protocol, current_week: int) -> dict:
+    """
+    Render a protocol row (name, description, traditions, duration_weeks,
+    supplements, exercises, lifestyle_changes, nutrition, sleep,
+    stress_management, weekly_notes) into the display lists of the client
+    view. Pure - no database access - so it can be benchmarked on its own.
+    """
+    # Build supplements list
+    supplements_list = []
+    
+    # Add supplements
+    if protocol[4]:  # supplements
+        supp_data = protocol[4]
+        # Handle if it's a JSON string
+        if isinstance(supp_data, str):
+            try:
+                supp_data = json.loads(supp_data)
+            except:
+                pass
+        
+        if isinstance(supp_data, dict):
+            for name, instructions in supp_data.items():
+                if instructions and str(instructions).strip():
+                    supplements_list.append(f"{name} - {instructions}")
+                else:
+                    supplements_list.append(name)
+        elif isinstance(supp_data, list):
+            # Handle list of structured objects
+            for item in supp_data:
+                if isinstance(item, dict):
+                    # ✅ WEEK FILTERING: Skip items not yet unlocked
+                    if item.get('start_week', 1) > current_week:
+                        continue
+                    
+                    # Build readable string from structured data
+                    parts = [item.get('name', 'Unknown')]
+                    
+                    if item.get('dosage'):
+                        parts.append(item['dosage'])
+                    if item.get('frequency'):
+                        parts.append(item['frequency'].lower())
+                    if item.get('timing'):
+                        parts.append(f"({item['timing'].lower()})")
+                    if item.get('with_food'):
+                        parts.append(item['with_food'].lower())
+                    if item.get('instructions'):
+                        parts.append(f"- {item['instructions']}")
+                    if item.get('notes') and item['notes'].strip():
+                        parts.append(f"Note: {item['notes']}")
+                    
+                    supplements_list.append(' '.join(parts))
+                elif isinstance(item, str):
+                    supplements_list.append(item)
+    
+    # Build exercises list (separate from supplements)
+    exercises_list = []
+    
+    # Add exercises
+    if protocol[5]:  # exercises
+        ex_data = protocol[5]
+        # Handle if it's a JSON string
+        if isinstance(ex_data, str):
+            try:
+                ex_data = json.loads(ex_data)
+            except:
+                pass
+        
+        if isinstance(ex_data, dict):
+            for name, instructions in ex_data.items():
+                if instructions and str(instructions).strip():
+                    exercises_list.append(f"{name} - {instructions}")
+                else:
+                    exercises_list.append(name)
+        elif isinstance(ex_data, list):
+            # Handle list of structured exercise objects
+            for item in ex_data:
+                if isinstance(item, dict):
+                    # ✅ WEEK FILTERING: Skip items not yet unlocked
+                    if item.get('start_week', 1) > current_week:
+                        continue
+                    
+                    # Build readable string from structured data
+                    parts = [item.get('name', 'Unknown exercise')]
+                    
+                    if item.get('duration'):
+                        parts.append(f"{item['duration']} minutes")
+                    if item.get('frequency'):
+                        freq = item['frequency']
+                        if freq == '1':
+                            parts.append('daily')
+                        else:
+                            parts.append(f"{freq}x per week")
+                    if item.get('intensity'):
+                        parts.append(f"({item['intensity'].lower()} intensity)")
+                    if item.get('instructions') and item['instructions'].strip():
+                        parts.append(f"- {item['instructions']}")
+                    
+                    exercises_list.append(' '.join(parts))
+                elif isinstance(item, str):
+                    exercises_list.append(item)
+    
+    # Build lifestyle changes list (habits only, not nutrition/sleep/stress)
+    lifestyle_changes = []
+    
+    # Add lifestyle_changes field (just the habits)
+    if protocol[6]:  # lifestyle_changes
+        lc_data = protocol[6]
+        # Handle if it's a JSON string
+        if isinstance(lc_data, str):
+            try:
+                lc_data = json.loads(lc_data)
+            except:
+                pass
+        
+        if isinstance(lc_data, dict):
+            for key, value in lc_data.items():
+                if isinstance(value, dict):
+                    # Extract all key-value pairs from nested dict
+                    for k, v in value.items():
+                        if v and str(v).strip():
+                            lifestyle_changes.append(f"{key.title()} - {k}: {v}")
+                elif isinstance(value, list):
+                    if value:  # Only add if list is not empty
+                        lifestyle_changes.append(f"{key.title()}: {', '.join(str(v) for v in value)}")
+                else:
+                    if value and str(value).strip():
+                        lifestyle_changes.append(f"{key.title()}: {value}")
+        elif isinstance(lc_data, list):
+            # Handle list of mixed strings and objects
+            for item in lc_data:
+                if isinstance(item, dict):
+                    # ✅ WEEK FILTERING: Skip items not yet unlocked
+                    if item.get('start_week', 1) > current_week:
+                        continue
+                    
+                    # Build readable string from structured lifestyle change
+                    parts = []
+                    
+                    if item.get('title'):
+                        parts.append(f"🎯 {item['title']}")
+                    if item.get('category'):
+                        parts.append(f"({item['category']})")
+                    if item.get('frequency'):
+                        parts.append(f"- {item['frequency']}")
+                    if item.get('description'):
+                        parts.append(f": {item['description']}")
+                    
+                    if parts:
+                        lifestyle_changes.append(' '.join(parts))
+                elif isinstance(item, str):
+                    # Add emoji to Stress Management if it doesn't have one
+                    if item.startswith('Stress Management') and not item.startswith('🧘'):
+                        lifestyle_changes.append(f"🧘 {item}")
+                    else:
+                        lifestyle_changes.append(item)
+    
+    # Build nutrition list
+    nutrition_list = []
+    
+    # Add nutrition
+    if protocol[7]:  # nutrition
+        nut_data = protocol[7]
+        
+        # Handle if it's a JSON string
+        if isinstance(nut_data, str):
+            try:
+                nut_data = json.loads(nut_data)
+            except:
+                pass
+        
+        if isinstance(nut_data, dict):
+            # Add dietary approach
+            if nut_data.get('dietary_approach') and str(nut_data['dietary_approach']).strip():
+                nutrition_list.append(f"🥗 Dietary Approach: {nut_data['dietary_approach']}")
+        
+                             
+            # Add foods to include (handle both string and array)
+            if nut_data.get('foods_to_include'):
+                foods = nut_data['foods_to_include']
+                if isinstance(foods, list) and foods:
+                    foods_str = ', '.join(str(f).strip() for f in foods if f and str(f).strip())
+                    if foods_str:
+                        nutrition_list.append(f"✅ Foods to Include: {foods_str}")
+                elif isinstance(foods, str) and foods.strip():
+                    # Split by common delimiters if it's a string
+                    foods_list = [f.strip() for f in foods.replace(',', '\n').replace(';', '\n').split('\n') if f.strip()]
+                    if foods_list:
+                        nutrition_list.append(f"✅ Foods to Include: {', '.join(foods_list)}")
+            
+            # Add foods to avoid (handle both string and array)
+            if nut_data.get('foods_to_avoid'):
+                foods = nut_data['foods_to_avoid']
+                if isinstance(foods, list) and foods:
+                    foods_str = ', '.join(str(f).strip() for f in foods if f and str(f).strip())
+                    if foods_str:
+                        nutrition_list.append(f"⛔ Foods to Avoid: {foods_str}")
+                elif isinstance(foods, str) and foods.strip():
+                    # Split by common delimiters if it's a string
+                    foods_list = [f.strip() for f in foods.replace(',', '\n').replace(';', '\n').split('\n') if f.strip()]
+                    if foods_list:
+                        nutrition_list.append(f"⛔ Foods to Avoid: {', '.join(foods_list)}")
+            
+            # Add meal timing/structure
+            if nut_data.get('meal_timing') and str(nut_data['meal_timing']).strip():
+                nutrition_list.append(f"⏰ Meal Timing: {nut_data['meal_timing']}")
+            elif nut_data.get('meal_structure') and str(nut_data['meal_structure']).strip():
+                nutrition_list.append(f"⏰ Meal Structure: {nut_data['meal_structure']}")
+            
+            # Add hydration goals
+            if nut_data.get('hydration') and str(nut_data['hydration']).strip():
+                nutrition_list.append(f"💧 Hydration: {nut_data['hydration']}")
+            elif nut_data.get('hydration_goals') and str(nut_data['hydration_goals']).strip():
+                nutrition_list.append(f"💧 Hydration: {nut_data['hydration_goals']}")
+            
+            # Add daily calories if present
+            if nut_data.get('daily_calories') and str(nut_data['daily_calories']).strip():
+                nutrition_list.append(f"📊 Daily Calories: {nut_data['daily_calories']}")
+                
+        elif isinstance(nut_data, str) and nut_data.strip():
+            nutrition_list.append(f"🥗 Nutrition: {nut_data}")
+    
+    # Add sleep to lifestyle
+    if protocol[8]:  # sleep
+        sleep_data = protocol[8]
+        # Handle if it's a JSON string
+        if isinstance(sleep_data, str):
+            try:
+                sleep_data = json.loads(sleep_data)
+            except:
+                pass
+        
+        if isinstance(sleep_data, dict):
+            sleep_items = []
+            
+            if sleep_data.get('bedtime') and str(sleep_data['bedtime']).strip():
+                sleep_items.append(f"Bedtime: {sleep_data['bedtime']}")
+            if sleep_data.get('target_hours') and str(sleep_data['target_hours']).strip():
+                sleep_items.append(f"Target: {sleep_data['target_hours']} hours")
+            if sleep_data.get('notes') and str(sleep_data['notes']).strip():
+                sleep_items.append(f"{sleep_data['notes']}")
+            
+            # Combine all sleep items into one line
+            if sleep_items:
+                lifestyle_changes.append(f"😴 Sleep: {' | '.join(sleep_items)}")
+                
+        elif isinstance(sleep_data, str) and sleep_data.strip():
+            lifestyle_changes.append(f"😴 Sleep: {sleep_data}")
+    
+    # Add stress management (only if not already in lifestyle_changes)
+    if protocol[9]:  # stress_management
+        stress_text = str(protocol[9]).strip() if protocol[9] else ""
+        if stress_text:
+            # Check if already added via lifestyle_changes
+            already_added = any('Stress Management' in str(item) for item in lifestyle_changes)
+            if not already_added:
+                lifestyle_changes.append(f"🧘 Stress Management: {stress_text}")
+    
+    # Build timeline list - SHOW ONLY CURRENT WEEK
+    timeline_list = []
+    
+    # Add weekly notes - show only current week's focus
+    if protocol[10]:  # weekly_notes
+        notes_data = protocol[10]
+        
+        # Handle if it's a JSON string
+        if isinstance(notes_data, str):
+            try:
+                notes_data = json.loads(notes_data)
+            except:
+                pass
+        
+        if isinstance(notes_data, dict):
+            current_week_num = current_week  # current_week
+            
+            # Try to find current week's notes with flexible key matching
+            current_week_note = None
+            for key, value in notes_data.items():
+                if value and str(value).strip():
+                    key_lower = str(key).lower()
+                    
+                    # Match various key formats for current week
+                    if (f'week {current_week_num}' in key_lower or 
+                        f'week{current_week_num}' in key_lower or 
+                        f'week_{current_week_num}' in key_lower or
+                        key == str(current_week_num)):
+                        current_week_note = str(value).strip()
+                        break
+            
+            # Add current week's focus if found
+            if current_week_note:
+                timeline_list.append(f"⭐ This Week's Focus: {current_week_note}")
+            else:
+                timeline_list.append(f"⭐ Week {current_week_num} - Stay consistent with your protocol!")
+                    
+        elif isinstance(notes_data, str) and notes_data.strip():
+            # If weekly_notes is just a string, use it as the focus
+            timeline_list.append(f"⭐ This Week's Focus: {notes_data}")
+        
+        # Handle if it's a JSON string
+        if isinstance(notes_data, str):
+            try:
+                notes_data = json.loads(notes_data)
+            except:
+                pass
+        
+        if isinstance(notes_data, dict):
+            current_week_num = current_week  # current_week
+            
+            # Try to extract notes for all weeks with flexible key matching
+            week_notes = {}
+            for key, value in notes_data.items():
+                if value and str(value).strip():
+                    week_num = None
+                    key_lower = str(key).lower()
+                    
+                    # Try various key formats
+                    if 'week 1' in key_lower or 'week1' in key_lower or key == '1':
+                        week_num = 1
+                    elif 'week 2' in key_lower or 'week2' in key_lower or key == '2':
+                        week_num = 2
+                    elif 'week 3' in key_lower or 'week3' in key_lower or key == '3':
+                        week_num = 3
+                    elif 'week 4' in key_lower or 'week4' in key_lower or key == '4':
+                        week_num = 4
+                    elif 'week_1' in key_lower:
+                        week_num = 1
+                    elif 'week_2' in key_lower:
+                        week_num = 2
+                    elif 'week_3' in key_lower:
+                        week_num = 3
+                    elif 'week_4' in key_lower:
+                        week_num = 4
+                    elif key.isdigit():
+                        week_num = int(key)
+                    
+                    if week_num:
+                        week_notes[week_num] = str(value).strip()
+            
+            # Add current week's focus at the top
+            if current_week_num in week_notes:
+                timeline_list.append(f"⭐ This Week's Focus: {week_notes[current_week_num]}")
+            
+            # Add full timeline preview
+            if len(week_notes) > 0:
+                timeline_items = []
+                for week_num in sorted(week_notes.keys()):
+                    if week_num == current_week_num:
+                        timeline_items.append(f"→ Week {week_num}: {week_notes[week_num]} ⬅ You are here")
+                    else:
+                        timeline_items.append(f"Week {week_num}: {week_notes[week_num]}")
+                
+                if timeline_items:
+                    # Add as separate items for better readability
+                    timeline_list.append("📅 ─── Protocol Timeline ───")
+                    for item in timeline_items:
+                        timeline_list.append(f"   {item}")
+                    
+        elif isinstance(notes_data, str) and notes_data.strip():
+            # If weekly_notes is just a string, use it as the focus
+            timeline_list.append(f"⭐ This Week's Focus: {notes_data}")
+    
+    return {
+        "supplements": supplements_list,
+        "nutrition": nutrition_list,
+        "exercises": exercises_list,
+        "lifestyle": lifestyle_changes,
+        "timeline": timeline_list
+    }
+
 @router.get("/client-view/{token}")
 async def get_client_view_data(token: str):
     """Load client's protocol data via token (no auth required)"""
@@ -134,359 +507,7 @@ async def get_client_view_data(token: str):
             LIMIT 4
         """), {'id': assignment[0]}).fetchall()
         
-        # Build supplements list
-        supplements_list = []
-        
-        # Add supplements
-        if protocol[4]:  # supplements
-            supp_data = protocol[4]
-            # Handle if it's a JSON string
-            if isinstance(supp_data, str):
-                try:
-                    supp_data = json.loads(supp_data)
-                except:
-                    pass
-            
-            if isinstance(supp_data, dict):
-                for name, instructions in supp_data.items():
-                    if instructions and str(instructions).strip():
-                        supplements_list.append(f"{name} - {instructions}")
-                    else:
-                        supplements_list.append(name)
-            elif isinstance(supp_data, list):
-                # Handle list of structured objects
-                for item in supp_data:
-                    if isinstance(item, dict):
-                        # ✅ WEEK FILTERING: Skip items not yet unlocked
-                        if item.get('start_week', 1) > assignment[2]:
-                            continue
-                        
-                        # Build readable string from structured data
-                        parts = [item.get('name', 'Unknown')]
-                        
-                        if item.get('dosage'):
-                            parts.append(item['dosage'])
-                        if item.get('frequency'):
-                            parts.append(item['frequency'].lower())
-                        if item.get('timing'):
-                            parts.append(f"({item['timing'].lower()})")
-                        if item.get('with_food'):
-                            parts.append(item['with_food'].lower())
-                        if item.get('instructions'):
-                            parts.append(f"- {item['instructions']}")
-                        if item.get('notes') and item['notes'].strip():
-                            parts.append(f"Note: {item['notes']}")
-                        
-                        supplements_list.append(' '.join(parts))
-                    elif isinstance(item, str):
-                        supplements_list.append(item)
-        
-        # Build exercises list (separate from supplements)
-        exercises_list = []
-        
-        # Add exercises
-        if protocol[5]:  # exercises
-            ex_data = protocol[5]
-            # Handle if it's a JSON string
-            if isinstance(ex_data, str):
-                try:
-                    ex_data = json.loads(ex_data)
-                except:
-                    pass
-            
-            if isinstance(ex_data, dict):
-                for name, instructions in ex_data.items():
-                    if instructions and str(instructions).strip():
-                        exercises_list.append(f"{name} - {instructions}")
-                    else:
-                        exercises_list.append(name)
-            elif isinstance(ex_data, list):
-                # Handle list of structured exercise objects
-                for item in ex_data:
-                    if isinstance(item, dict):
-                        # ✅ WEEK FILTERING: Skip items not yet unlocked
-                        if item.get('start_week', 1) > assignment[2]:
-                            continue
-                        
-                        # Build readable string from structured data
-                        parts = [item.get('name', 'Unknown exercise')]
-                        
-                        if item.get('duration'):
-                            parts.append(f"{item['duration']} minutes")
-                        if item.get('frequency'):
-                            freq = item['frequency']
-                            if freq == '1':
-                                parts.append('daily')
-                            else:
-                                parts.append(f"{freq}x per week")
-                        if item.get('intensity'):
-                            parts.append(f"({item['intensity'].lower()} intensity)")
-                        if item.get('instructions') and item['instructions'].strip():
-                            parts.append(f"- {item['instructions']}")
-                        
-                        exercises_list.append(' '.join(parts))
-                    elif isinstance(item, str):
-                        exercises_list.append(item)
-        
-        # Build lifestyle changes list (habits only, not nutrition/sleep/stress)
-        lifestyle_changes = []
-        
-        # Add lifestyle_changes field (just the habits)
-        if protocol[6]:  # lifestyle_changes
-            lc_data = protocol[6]
-            # Handle if it's a JSON string
-            if isinstance(lc_data, str):
-                try:
-                    lc_data = json.loads(lc_data)
-                except:
-                    pass
-            
-            if isinstance(lc_data, dict):
-                for key, value in lc_data.items():
-                    if isinstance(value, dict):
-                        # Extract all key-value pairs from nested dict
-                        for k, v in value.items():
-                            if v and str(v).strip():
-                                lifestyle_changes.append(f"{key.title()} - {k}: {v}")
-                    elif isinstance(value, list):
-                        if value:  # Only add if list is not empty
-                            lifestyle_changes.append(f"{key.title()}: {', '.join(str(v) for v in value)}")
-                    else:
-                        if value and str(value).strip():
-                            lifestyle_changes.append(f"{key.title()}: {value}")
-            elif isinstance(lc_data, list):
-                # Handle list of mixed strings and objects
-                for item in lc_data:
-                    if isinstance(item, dict):
-                        # ✅ WEEK FILTERING: Skip items not yet unlocked
-                        if item.get('start_week', 1) > assignment[2]:
-                            continue
-                        
-                        # Build readable string from structured lifestyle change
-                        parts = []
-                        
-                        if item.get('title'):
-                            parts.append(f"🎯 {item['title']}")
-                        if item.get('category'):
-                            parts.append(f"({item['category']})")
-                        if item.get('frequency'):
-                            parts.append(f"- {item['frequency']}")
-                        if item.get('description'):
-                            parts.append(f": {item['description']}")
-                        
-                        if parts:
-                            lifestyle_changes.append(' '.join(parts))
-                    elif isinstance(item, str):
-                        # Add emoji to Stress Management if it doesn't have one
-                        if item.startswith('Stress Management') and not item.startswith('🧘'):
-                            lifestyle_changes.append(f"🧘 {item}")
-                        else:
-                            lifestyle_changes.append(item)
-        
-       # Build nutrition list
-        nutrition_list = []
-        
-        # Add nutrition
-        if protocol[7]:  # nutrition
-            nut_data = protocol[7]
-            
-            # Handle if it's a JSON string
-            if isinstance(nut_data, str):
-                try:
-                    nut_data = json.loads(nut_data)
-                except:
-                    pass
-            
-            if isinstance(nut_data, dict):
-                # Add dietary approach
-                if nut_data.get('dietary_approach') and str(nut_data['dietary_approach']).strip():
-                    nutrition_list.append(f"🥗 Dietary Approach: {nut_data['dietary_approach']}")
-            
-                                 
-                # Add foods to include (handle both string and array)
-                if nut_data.get('foods_to_include'):
-                    foods = nut_data['foods_to_include']
-                    if isinstance(foods, list) and foods:
-                        foods_str = ', '.join(str(f).strip() for f in foods if f and str(f).strip())
-                        if foods_str:
-                            nutrition_list.append(f"✅ Foods to Include: {foods_str}")
-                    elif isinstance(foods, str) and foods.strip():
-                        # Split by common delimiters if it's a string
-                        foods_list = [f.strip() for f in foods.replace(',', '\n').replace(';', '\n').split('\n') if f.strip()]
-                        if foods_list:
-                            nutrition_list.append(f"✅ Foods to Include: {', '.join(foods_list)}")
-                
-                # Add foods to avoid (handle both string and array)
-                if nut_data.get('foods_to_avoid'):
-                    foods = nut_data['foods_to_avoid']
-                    if isinstance(foods, list) and foods:
-                        foods_str = ', '.join(str(f).strip() for f in foods if f and str(f).strip())
-                        if foods_str:
-                            nutrition_list.append(f"⛔ Foods to Avoid: {foods_str}")
-                    elif isinstance(foods, str) and foods.strip():
-                        # Split by common delimiters if it's a string
-                        foods_list = [f.strip() for f in foods.replace(',', '\n').replace(';', '\n').split('\n') if f.strip()]
-                        if foods_list:
-                            nutrition_list.append(f"⛔ Foods to Avoid: {', '.join(foods_list)}")
-                
-                # Add meal timing/structure
-                if nut_data.get('meal_timing') and str(nut_data['meal_timing']).strip():
-                    nutrition_list.append(f"⏰ Meal Timing: {nut_data['meal_timing']}")
-                elif nut_data.get('meal_structure') and str(nut_data['meal_structure']).strip():
-                    nutrition_list.append(f"⏰ Meal Structure: {nut_data['meal_structure']}")
-                
-                # Add hydration goals
-                if nut_data.get('hydration') and str(nut_data['hydration']).strip():
-                    nutrition_list.append(f"💧 Hydration: {nut_data['hydration']}")
-                elif nut_data.get('hydration_goals') and str(nut_data['hydration_goals']).strip():
-                    nutrition_list.append(f"💧 Hydration: {nut_data['hydration_goals']}")
-                
-                # Add daily calories if present
-                if nut_data.get('daily_calories') and str(nut_data['daily_calories']).strip():
-                    nutrition_list.append(f"📊 Daily Calories: {nut_data['daily_calories']}")
-                    
-            elif isinstance(nut_data, str) and nut_data.strip():
-                nutrition_list.append(f"🥗 Nutrition: {nut_data}")
-        
-        # Add sleep to lifestyle
-        if protocol[8]:  # sleep
-            sleep_data = protocol[8]
-            # Handle if it's a JSON string
-            if isinstance(sleep_data, str):
-                try:
-                    sleep_data = json.loads(sleep_data)
-                except:
-                    pass
-            
-            if isinstance(sleep_data, dict):
-                sleep_items = []
-                
-                if sleep_data.get('bedtime') and str(sleep_data['bedtime']).strip():
-                    sleep_items.append(f"Bedtime: {sleep_data['bedtime']}")
-                if sleep_data.get('target_hours') and str(sleep_data['target_hours']).strip():
-                    sleep_items.append(f"Target: {sleep_data['target_hours']} hours")
-                if sleep_data.get('notes') and str(sleep_data['notes']).strip():
-                    sleep_items.append(f"{sleep_data['notes']}")
-                
-                # Combine all sleep items into one line
-                if sleep_items:
-                    lifestyle_changes.append(f"😴 Sleep: {' | '.join(sleep_items)}")
-                    
-            elif isinstance(sleep_data, str) and sleep_data.strip():
-                lifestyle_changes.append(f"😴 Sleep: {sleep_data}")
-        
-        # Add stress management (only if not already in lifestyle_changes)
-        if protocol[9]:  # stress_management
-            stress_text = str(protocol[9]).strip() if protocol[9] else ""
-            if stress_text:
-                # Check if already added via lifestyle_changes
-                already_added = any('Stress Management' in str(item) for item in lifestyle_changes)
-                if not already_added:
-                    lifestyle_changes.append(f"🧘 Stress Management: {stress_text}")
-        
-       # Build timeline list - SHOW ONLY CURRENT WEEK
-        timeline_list = []
-        
-        # Add weekly notes - show only current week's focus
-        if protocol[10]:  # weekly_notes
-            notes_data = protocol[10]
-            
-            # Handle if it's a JSON string
-            if isinstance(notes_data, str):
-                try:
-                    notes_data = json.loads(notes_data)
-                except:
-                    pass
-            
-            if isinstance(notes_data, dict):
-                current_week_num = assignment[2]  # current_week
-                
-                # Try to find current week's notes with flexible key matching
-                current_week_note = None
-                for key, value in notes_data.items():
-                    if value and str(value).strip():
-                        key_lower = str(key).lower()
-                        
-                        # Match various key formats for current week
-                        if (f'week {current_week_num}' in key_lower or 
-                            f'week{current_week_num}' in key_lower or 
-                            f'week_{current_week_num}' in key_lower or
-                            key == str(current_week_num)):
-                            current_week_note = str(value).strip()
-                            break
-                
-                # Add current week's focus if found
-                if current_week_note:
-                    timeline_list.append(f"⭐ This Week's Focus: {current_week_note}")
-                else:
-                    timeline_list.append(f"⭐ Week {current_week_num} - Stay consistent with your protocol!")
-                        
-            elif isinstance(notes_data, str) and notes_data.strip():
-                # If weekly_notes is just a string, use it as the focus
-                timeline_list.append(f"⭐ This Week's Focus: {notes_data}")
-            
-            # Handle if it's a JSON string
-            if isinstance(notes_data, str):
-                try:
-                    notes_data = json.loads(notes_data)
-                except:
-                    pass
-            
-            if isinstance(notes_data, dict):
-                current_week_num = assignment[2]  # current_week
-                
-                # Try to extract notes for all weeks with flexible key matching
-                week_notes = {}
-                for key, value in notes_data.items():
-                    if value and str(value).strip():
-                        week_num = None
-                        key_lower = str(key).lower()
-                        
-                        # Try various key formats
-                        if 'week 1' in key_lower or 'week1' in key_lower or key == '1':
-                            week_num = 1
-                        elif 'week 2' in key_lower or 'week2' in key_lower or key == '2':
-                            week_num = 2
-                        elif 'week 3' in key_lower or 'week3' in key_lower or key == '3':
-                            week_num = 3
-                        elif 'week 4' in key_lower or 'week4' in key_lower or key == '4':
-                            week_num = 4
-                        elif 'week_1' in key_lower:
-                            week_num = 1
-                        elif 'week_2' in key_lower:
-                            week_num = 2
-                        elif 'week_3' in key_lower:
-                            week_num = 3
-                        elif 'week_4' in key_lower:
-                            week_num = 4
-                        elif key.isdigit():
-                            week_num = int(key)
-                        
-                        if week_num:
-                            week_notes[week_num] = str(value).strip()
-                
-                # Add current week's focus at the top
-                if current_week_num in week_notes:
-                    timeline_list.append(f"⭐ This Week's Focus: {week_notes[current_week_num]}")
-                
-                # Add full timeline preview
-                if len(week_notes) > 0:
-                    timeline_items = []
-                    for week_num in sorted(week_notes.keys()):
-                        if week_num == current_week_num:
-                            timeline_items.append(f"→ Week {week_num}: {week_notes[week_num]} ⬅ You are here")
-                        else:
-                            timeline_items.append(f"Week {week_num}: {week_notes[week_num]}")
-                    
-                    if timeline_items:
-                        # Add as separate items for better readability
-                        timeline_list.append("📅 ─── Protocol Timeline ───")
-                        for item in timeline_items:
-                            timeline_list.append(f"   {item}")
-                        
-            elif isinstance(notes_data, str) and notes_data.strip():
-                # If weekly_notes is just a string, use it as the focus
-                timeline_list.append(f"⭐ This Week's Focus: {notes_data}")
+        lists = build_client_view_lists(protocol, assignment[2])
         
         return {
             "client_name": member[0],
@@ -501,11 +522,11 @@ async def get_client_view_data(token: str):
                 "current_phase": {
                     "title": f"Week {assignment[2]} - {protocol[0]}",
                     "instructions": protocol[1] or "",  # description
-                    "supplements": supplements_list,
-                    "nutrition": nutrition_list,
-                    "exercises": exercises_list,
-                    "lifestyle": lifestyle_changes,
-                    "timeline": timeline_list
+                    "supplements": lists["supplements"],
+                    "nutrition": lists["nutrition"],
+                    "exercises": lists["exercises"],
+                    "lifestyle": lists["lifestyle"],
+                    "timeline": lists["timeline"]
                 },
                 
                 "recent_compliance": [{
@@ -866,7 +887,7 @@ async def get_client_compliance_details(member_id: int, current_user: dict = Dep
                     else:
                         compliance_data = compliance_data_json
                 except Exception as e:
-                    print(f"⚠️ Error parsing compliance_data: {e}")
+                    logger.warning(f"⚠️ Error parsing compliance_data: {e}")
             
             # Build full item list from protocol to match with compliance_data
             all_items = []
@@ -965,9 +986,7 @@ async def get_client_compliance_details(member_id: int, current_user: dict = Dep
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in compliance-details: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Error in compliance-details")
         raise HTTPException(status_code=500, detail=f"Error loading compliance: {str(e)}")
 # ==================== TWO-WAY MESSAGING ENDPOINTS ====================
 @router.get("/count-unread-messages/{member_id}")
@@ -1197,7 +1216,7 @@ async def client_send_message(
     image: Optional[UploadFile] = File(None)
 ):
     """Client sends message to practitioner"""
-    
+    # The body is capped while it is received (upload_service.UploadLimitMiddleware)
     with engine.connect() as conn:
         result = conn.execute(text("""
             SELECT family_member_id, practitioner_id
@@ -1213,16 +1232,11 @@ async def client_send_message(
         
         image_data = None
         if image:
-            image_content = await image.read()
-            
             if not image.content_type.startswith('image/'):
                 raise HTTPException(status_code=400, detail="Only image files allowed")
             
-            if len(image_content) > 5 * 1024 * 1024:
-                raise HTTPException(status_code=400, detail="Image too large (max 5MB)")
-            
-            image_base64 = base64.b64encode(image_content).decode('utf-8')
-            image_data = f"data:{image.content_type};base64,{image_base64}"
+            with await spool_upload(image, CLIENT_IMAGE_MAX_BYTES, CLIENT_IMAGE_TOO_LARGE) as upload:
+                image_data = f"data:{image.content_type};base64,{upload.b64encode()}"
         
         # Insert client message
         result = conn.execute(text("""
@@ -1263,7 +1277,13 @@ async def serve_client_view_page(token: str):
 @router.post("/client-view/{token}/submit-compliance")
 async def submit_client_compliance(token: str, data: dict):
     """Client submits weekly compliance - UNIFIED SYSTEM writes to compliance_logs"""
-    print(f"📥 Received compliance data: {data}")
+    # Only the shape - the payload carries notes and a base64 photo
+    logger.info("📥 Compliance submission received", extra={
+        'event': 'compliance.submitted',
+        'completed_items': len(data.get('completed_items') or []),
+        'incomplete_items': len(data.get('incomplete_items') or []),
+        'has_image': bool(data.get('image_base64')),
+    })
     
     with engine.connect() as conn:
         # Verify token
@@ -1,37 +1,159 @@
 """
 Authentication utilities for Tree of Life AI
 Extracted from main.py to avoid circular imports
+
+bcrypt costs a few hundred ms of CPU per call, so the async endpoints use
+hash_password_async / verify_password_async, which run it in a small
+bounded thread pool (bcrypt releases the GIL) instead of on the event loop.
+The work factor is BCRYPT_ROUNDS, or calibrated once to BCRYPT_TARGET_MS on
+this hardware; hashes below it are upgraded on the next successful login.
 """
 from fastapi import HTTPException, Request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
+import threading
+import time
 import jwt
 import bcrypt
 import os
 
+from app.services import metrics
+
+logger = logging.getLogger(__name__)
+
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
 
+# Fixed work factor; when unset it is calibrated to BCRYPT_TARGET_MS
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '0'))
+BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', '250'))
+# Calibration never goes below this (OWASP's minimum for bcrypt), however slow the host
+BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', '12'))
+BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', '14'))
+# Concurrent hashes per worker; further logins queue instead of starving the CPU
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+
+_rounds: Optional[int] = None
+_rounds_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def calibrate_rounds(target_ms: float = BCRYPT_TARGET_MS) -> int:
+    """Highest cost whose hash fits in target_ms here (each round doubles the time)"""
+    probe = 8
+    started = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(probe))
+    probe_ms = max((time.perf_counter() - started) * 1000, 0.01)
+    rounds = probe
+    while rounds < BCRYPT_MAX_ROUNDS and probe_ms * 2 ** (rounds + 1 - probe) <= target_ms:
+        rounds += 1
+    return max(BCRYPT_MIN_ROUNDS, rounds)
+
+
+def bcrypt_rounds() -> int:
+    global _rounds
+    if _rounds is None:
+        with _rounds_lock:
+            if _rounds is None:
+                if BCRYPT_ROUNDS:
+                    _rounds = BCRYPT_ROUNDS
+                else:
+                    _rounds = calibrate_rounds()
+                    logger.info(f"🔐 bcrypt cost {_rounds} (calibrated to {BCRYPT_TARGET_MS:.0f}ms)")
+    return _rounds
+
+
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(bcrypt_rounds())).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def needs_rehash(hashed: str) -> bool:
+    """True when the stored cost is below the current one.
+
+    Only upgrades: calibration can land one round apart on different hosts,
+    and a downgrade would flip hashes back and forth between workers.
+    """
+    try:
+        return int(hashed.split('$')[2]) < bcrypt_rounds()
+    except (IndexError, ValueError):
+        return False
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+    return _pool
+
+
+async def _run(operation: str, fn, *args):
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor(), fn, *args)
+    finally:
+        metrics.PASSWORD_HASH_DURATION.observe(time.perf_counter() - started, operation=operation)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run('hash', hash_password, password)
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    return await _run('verify', verify_password, password, hashed)
+
+
+def shutdown_password_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
 def create_token(user_id: str) -> str:
     payload = {'sub': str(user_id), 'exp': datetime.utcnow() + timedelta(days=7)}
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
-def verify_token(token: str) -> str:
+def decode_token(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload['sub']
+        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
     except:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def user_id_from_claims(claims: dict) -> str:
+    """Our tokens carry 'sub'; older portal tokens carried 'user_id'"""
+    user_id = claims.get('sub') or claims.get('user_id')
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return str(user_id)
+
+def verify_token(token: str) -> str:
+    return user_id_from_claims(decode_token(token))
+
 def get_current_user_id(request: Request) -> str:
-    """Extract user_id from JWT token in Authorization header"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
+    """Extract user_id from JWT token in Authorization header.
+
+    Decoded once per request and kept on request.state, so the route, its
+    dependencies and helpers can all call this without re-verifying.
+    """
+    user_id = getattr(request.state, 'user_id', None)
+    if user_id is not None:
+        return user_id
+    scheme, _, token = (request.headers.get('Authorization') or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
         raise HTTPException(status_code=401, detail="Missing token")
-    token = auth_header.split(' ')[1]
-    return verify_token(token)
+    claims = decode_token(token.strip())
+    request.state.token_claims = claims
+    request.state.user_id = user_id_from_claims(claims)
+    return request.state.user_id
 
+def get_optional_user_id(request: Request) -> Optional[str]:
+    """Like get_current_user_id, but None for guests and invalid tokens"""
+    try:
+        return get_current_user_id(request)
+    except HTTPException:
+        return None
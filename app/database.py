@@ -16,6 +16,8 @@ from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 
+from app.services import account_cache
+
 # Database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://localhost/treeoflife")
 
@@ -868,6 +870,7 @@ def update_user_subscription(
             user.stripe_subscription_id = stripe_subscription_id
         
         db.commit()
+        account_cache.invalidate(user_id)
         db.refresh(user)
         
         return user
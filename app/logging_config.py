@@ -0,0 +1,247 @@
+"""
+Logging Config - Structured, sampled, redacted logging for the whole app
+Handlers on the request path only enqueue records (QueueHandler); a
+background QueueListener formats and writes them, so a burst of log lines
+never blocks the event loop on stdout. Output is one JSON object per line
+(or readable text for local development), tagged with the current trace id.
+
+- Per-logger levels: LOG_LEVELS="app.skill_loader=WARNING,uvicorn.access=WARNING"
+- Sampling: records logged with extra={'event': 'skill.loaded'} are kept at
+  the rate in LOG_SAMPLE_RATES="skill.loaded=0.1,chat.image=0.05" (prefix
+  match); warnings and errors are never sampled out
+- Redaction: PHI/secret keys in `extra` (password, token, image data, notes,
+  ...) are masked, and emails, JWTs, base64 blobs and SQLAlchemy parameter
+  dumps are scrubbed from messages and tracebacks
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional
+
+from app.services.tracing import current_trace_id
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'json' or 'text'; JSON unless running locally
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json' if os.getenv('ENVIRONMENT') == 'production' else 'text').lower()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', 'skill.loaded=0.1,chat.image=0.1')
+LOG_MAX_MESSAGE_CHARS = int(os.getenv('LOG_MAX_MESSAGE_CHARS', '2000'))
+# Records beyond this many waiting for the writer thread are dropped, not blocked on
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+REDACTED = '[redacted]'
+
+# Keys whose values never reach the logs (matched case-insensitively, anywhere in `extra`)
+PHI_FIELDS = frozenset({
+    'password', 'hashed_password', 'new_password', 'token', 'access_token', 'refresh_token',
+    'authorization', 'secret', 'api_key', 'email', 'phone', 'full_name', 'name', 'date_of_birth',
+    'dob', 'address', 'image', 'image_base64', 'data', 'file_data', 'content', 'message',
+    'notes', 'compliance_data', 'compliance_details', 'health_data', 'results', 'response_text',
+})
+
+_SQL_PARAMETERS = re.compile(r'\[parameters: .*?\](?=\s*(?:\(Background on this error|\Z))', re.S)
+_JWT = re.compile(r'\beyJ[\w-]+\.[\w-]+\.[\w-]+')
+_EMAIL = re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b')
+_BASE64 = re.compile(r'(?:data:[\w/+.-]+;base64,)?[A-Za-z0-9+/]{200,}={0,2}')
+
+_STANDARD_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime', 'taskName'}
+# Set by ContextFilter / SamplingFilter, rendered as top-level fields
+_CONTEXT_ATTRS = frozenset({'trace_id', 'event', 'sample_rate'})
+
+_listener: Optional[QueueListener] = None
+
+
+def redact_text(text: str) -> str:
+    text = _SQL_PARAMETERS.sub('[parameters: redacted]', text)
+    text = _JWT.sub('[jwt]', text)
+    text = _EMAIL.sub('[email]', text)
+    text = _BASE64.sub(lambda m: f"[base64 {len(m.group())} chars]", text)
+    return text
+
+
+def redact_value(key: str, value: Any, depth: int = 0) -> Any:
+    if key.lower() in PHI_FIELDS:
+        return REDACTED
+    if depth > 4:
+        return '...'
+    if isinstance(value, dict):
+        return {k: redact_value(str(k), v, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact_value('', v, depth + 1) for v in value[:50]]
+    if isinstance(value, str):
+        return redact_text(value)
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    return redact_text(str(value))
+
+
+def _parse_pairs(spec: str) -> Dict[str, str]:
+    pairs = {}
+    for item in spec.split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+# ==================== FILTERS (caller thread) ====================
+
+class ContextFilter(logging.Filter):
+    """Attach the trace id while still in the request's context"""
+
+    def filter(self, record):
+        if not hasattr(record, 'trace_id'):
+            record.trace_id = current_trace_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of high-frequency events (records with extra={'event': ...})"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # Longest prefix wins
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def rate_for(self, event: str) -> float:
+        for prefix, rate in self.rates:
+            if event.startswith(prefix):
+                return rate
+        return 1.0
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        if not event or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(event)
+        if rate >= 1.0:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Merge args and render the traceback now (the objects may change or die),
+        # but leave JSON encoding and redaction to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block a request on logging
+            pass
+
+
+# ==================== FORMATTERS (listener thread) ====================
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry: Dict[str, Any] = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage())[:LOG_MAX_MESSAGE_CHARS],
+        }
+        for attr in _CONTEXT_ATTRS:
+            value = getattr(record, attr, None)
+            if value is not None:
+                entry[attr] = value
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key not in _CONTEXT_ATTRS and key not in entry:
+                entry[key] = redact_value(key, value)
+        if record.exc_text:
+            entry['exception'] = redact_text(record.exc_text)
+        if record.stack_info:
+            entry['stack'] = redact_text(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s', datefmt='%H:%M:%S')
+
+    def format(self, record):
+        record = copy.copy(record)
+        record.msg = redact_text(record.getMessage())[:LOG_MAX_MESSAGE_CHARS]
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact_text(record.exc_text)
+        extras = {
+            key: redact_value(key, value) for key, value in record.__dict__.items()
+            if key not in _STANDARD_ATTRS and key not in _CONTEXT_ATTRS
+        }
+        line = super().format(record)
+        if extras:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in extras.items())
+        if getattr(record, 'trace_id', None):
+            line += f" trace={record.trace_id[:12]}"
+        return line
+
+
+# ==================== SETUP ====================
+
+def configure_logging(force: bool = False):
+    """Route all logging through one queue; safe to call more than once"""
+    global _listener
+    if _listener is not None and not force:
+        return
+    if _listener is not None:
+        _listener.stop()
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter())
+
+    log_queue: 'queue.Queue[logging.LogRecord]' = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    rates = {}
+    for event, rate in _parse_pairs(LOG_SAMPLE_RATES).items():
+        try:
+            rates[event] = float(rate)
+        except ValueError:
+            pass
+    handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    for name, level in _parse_pairs(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def after_fork():
+    """Restart the writer thread in a forked worker (threads don't survive fork)"""
+    global _listener
+    _listener = None
+    configure_logging()
+
+
+def shutdown_logging():
+    """Flush queued records (registered with atexit)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,31 +1,53 @@
 import secrets
-from datetime import datetime, timedelta
-import resend
+from datetime import date, datetime, timedelta
 from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Depends
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse, Response
 from pydantic import BaseModel
 from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Date, Boolean, Text, JSON, text, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from fastapi import HTTPException, Depends
 from sqlalchemy.orm import Session
 import os
-import jwt
 import bcrypt
-import anthropic
-import stripe
 import base64
 import json
+import hashlib
 import asyncio
+import threading
 from app.api import client_messages
 from typing import Optional, List, Dict
 from app.enhanced_system_prompt import SYSTEM_PROMPT_WITH_WESTERN_MED
 from app.skill_loader import get_specialized_knowledge
-resend.api_key = os.environ.get('RESEND_API_KEY')
+from app.services.image_service import preprocess_image, preprocess_base64_image, ImageProcessingError
+from app.services.upload_service import LAB_UPLOAD_MAX_BYTES, LAB_UPLOAD_TOO_LARGE, UploadLimitMiddleware, spool_upload
+from app.services.lab_reference import flag_value, flag_results, abnormal_results
+from app.services.analytes import ANALYTES, canonicalize_results
+from app.services import explain_cache
+from app.services import account_cache
+from app.services import lab_values
+from app.services import health_context
+from app.services.analysis_parser import StreamingSectionParser, parse_sections
+from app.services import llm_client
+from app.services import metrics
+from app.services import tracing
+from app.services import slow_queries
+from app.services import rate_limit
+from app.services.llm_scheduler import scheduler as llm_scheduler, LLMOverloaded
+from app.services import lazy_import
+from app.services.lazy_import import LazyModule
+import importlib.metadata
+import logging
+from app.logging_config import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+# Heavy SDKs import on first use (see app/services/lazy_import.py)
+resend = LazyModule('resend', setup=lambda module: setattr(module, 'api_key', os.environ.get('RESEND_API_KEY')))
 
 # Near top of main.py, after imports
 MESSAGE_LIMITS = {
@@ -35,6 +57,7 @@ MESSAGE_LIMITS = {
     'pro': None       # None = unlimited
 }
 # Add this helper function
+@tracing.traced('chat.check_message_limit')
 def check_message_limit(user_id, tier):
     """Check if user has exceeded monthly message limit"""
     limit = MESSAGE_LIMITS.get(tier, MESSAGE_LIMITS['free'])
@@ -59,6 +82,11 @@ def check_message_limit(user_id, tier):
                 detail=f"Monthly message limit reached ({limit} messages). Upgrade your plan for more messages."
             )
 
+def get_user_tier(user_id):
+    """Subscription tier for a user - used for LLM admission priority"""
+    account = account_cache.get_account(engine, user_id)
+    return account['tier'] if account else 'free'
+
 # ==================== CONFIGURATION ====================
 
 DATABASE_URL = os.getenv('DATABASE_URL')
@@ -70,10 +98,10 @@ ALGORITHM = "HS256"
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 ANTHROPIC_PROJECT_ID = os.getenv('ANTHROPIC_PROJECT_ID')  # ← NEW: Add this to your Render environment variables
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY')
-stripe.api_key = STRIPE_SECRET_KEY
+stripe = LazyModule('stripe', setup=lambda module: setattr(module, 'api_key', STRIPE_SECRET_KEY))
 
 # ==================== ANTHROPIC SETUP ====================
-anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+# Model calls go through app.services.llm_client, which creates its clients on first use
 
 # ==================== STRIPE PRICE IDS ====================
 STRIPE_PRICES = {
@@ -88,9 +116,13 @@ STRIPE_PRICES = {
 # ==================== DATABASE SETUP ====================
 
 engine = create_engine(DATABASE_URL)
+metrics.instrument_engine(engine, 'main')
+tracing.instrument_engine(engine, 'main')
+slow_queries.instrument_engine(engine, 'main')
 # ==================== AUTO MIGRATION ====================
-def run_migrations():
-    statements = [
+# Each group commits on its own, so one failing statement only holds back its own feature
+MIGRATION_GROUPS = {
+    'protocol_tracking': [
         "CREATE TABLE IF NOT EXISTS weekly_checkins (id SERIAL PRIMARY KEY, client_protocol_id INTEGER NOT NULL REFERENCES client_protocols(id) ON DELETE CASCADE, week_number INTEGER NOT NULL, primary_symptom_rating INTEGER NOT NULL CHECK (primary_symptom_rating BETWEEN 1 AND 10), energy_level INTEGER NOT NULL CHECK (energy_level BETWEEN 1 AND 10), sleep_quality INTEGER NOT NULL CHECK (sleep_quality BETWEEN 1 AND 10), notes TEXT, what_helped TEXT, what_struggled TEXT, submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
         "CREATE TABLE IF NOT EXISTS protocol_outcomes (id SERIAL PRIMARY KEY, client_protocol_id INTEGER NOT NULL REFERENCES client_protocols(id) ON DELETE CASCADE, protocol_id INTEGER NOT NULL REFERENCES protocols(id), overall_effectiveness INTEGER CHECK (overall_effectiveness BETWEEN 1 AND 5), symptoms_improved BOOLEAN, would_recommend BOOLEAN, what_improved_most TEXT, what_was_hardest TEXT, suggestions TEXT, practitioner_effectiveness INTEGER CHECK (practitioner_effectiveness BETWEEN 1 AND 5), completed_by VARCHAR(50) DEFAULT 'client', submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE(client_protocol_id))",
         "CREATE UNIQUE INDEX IF NOT EXISTS idx_weekly_checkins_unique ON weekly_checkins(client_protocol_id, week_number, DATE(submitted_at))",
@@ -98,20 +130,41 @@ def run_migrations():
         "CREATE INDEX IF NOT EXISTS idx_weekly_checkins_week ON weekly_checkins(week_number)",
         "CREATE INDEX IF NOT EXISTS idx_weekly_checkins_date ON weekly_checkins(submitted_at)",
         "CREATE INDEX IF NOT EXISTS idx_protocol_outcomes_protocol ON protocol_outcomes(protocol_id)",
-        "CREATE INDEX IF NOT EXISTS idx_protocol_outcomes_effectiveness ON protocol_outcomes(overall_effectiveness)"
-    ]
-    try:
-        with engine.connect() as conn:
-            for stmt in statements:
-                conn.execute(text(stmt))
-            conn.commit()
-        print("✅ Migrations complete")
-    except Exception as e:
-        print(f"Migration error: {e}")
+        "CREATE INDEX IF NOT EXISTS idx_protocol_outcomes_effectiveness ON protocol_outcomes(overall_effectiveness)",
+    ],
+    'ai_analyses': [
+        "CREATE TABLE IF NOT EXISTS ai_analyses (id SERIAL PRIMARY KEY, user_id UUID NOT NULL, client_id INTEGER, analysis_data TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+        "ALTER TABLE ai_analyses ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(64)",
+        "ALTER TABLE ai_analyses ALTER COLUMN client_id DROP NOT NULL",
+        "CREATE INDEX IF NOT EXISTS idx_ai_analyses_user_fingerprint ON ai_analyses(user_id, fingerprint, created_at DESC)",
+        # One row per fingerprint (rows from before fingerprints existed are NULL and exempt)
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_analyses_generated_unique ON ai_analyses(user_id, fingerprint) WHERE client_id IS NULL AND fingerprint IS NOT NULL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_ai_analyses_saved_unique ON ai_analyses(user_id, client_id, fingerprint) WHERE client_id IS NOT NULL AND fingerprint IS NOT NULL",
+    ],
+    'lab_values': lab_values.MIGRATIONS,
+    'health_metrics': health_context.MIGRATIONS,
+}
 
-run_migrations()
+def run_migrations():
+    failed = []
+    for group, statements in MIGRATION_GROUPS.items():
+        try:
+            with engine.connect() as conn:
+                for stmt in statements:
+                    conn.execute(text(stmt))
+                conn.commit()
+        except Exception as e:
+            failed.append(group)
+            logger.error(f"❌ Migration error ({group}): {e}")
+    if failed:
+        logger.error(f"❌ Migrations incomplete, failed groups: {', '.join(failed)}")
+    else:
+        logger.info("✅ Migrations complete")
+
+# Runs from startup_event() after create_all, not as an import side effect
 # ==================== END MIGRATION ====================
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+tracing.instrument_sessions(SessionLocal)
 Base = declarative_base()
 def get_db():
     """Dependency for getting database session"""
@@ -303,18 +356,18 @@ class ClientMessage(Base):
 
 def run_migration():
     """Run database migration"""
-    print("🔧 Running database migration...")
+    logger.info("🔧 Running database migration...")
     
     try:
         with engine.connect() as conn:
-            print("🔑 Ensuring UUID extension...")
+            logger.info("🔑 Ensuring UUID extension...")
             try:
                 conn.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
                 conn.commit()
             except Exception as e:
-                print(f"  ⚠️ UUID extension: {e}")
+                logger.warning(f"  ⚠️ UUID extension: {e}")
             
-            print("👤 Checking users table columns...")
+            logger.info("👤 Checking users table columns...")
             
             try:
                 conn.execute(text("""
@@ -322,9 +375,9 @@ def run_migration():
                     ALTER COLUMN id SET DEFAULT gen_random_uuid()
                 """))
                 conn.commit()
-                print("  ✅ Fixed users.id UUID generation")
+                logger.info("  ✅ Fixed users.id UUID generation")
             except Exception as e:
-                print(f"  ⚠️ users.id fix: {e}")
+                logger.warning(f"  ⚠️ users.id fix: {e}")
             
             user_migrations = [
                 ("hashed_password", "ALTER TABLE users ADD COLUMN IF NOT EXISTS hashed_password VARCHAR(255)"),
@@ -340,13 +393,13 @@ def run_migration():
                 try:
                     conn.execute(text(query))
                     conn.commit()
-                    print(f"  ✅ Checked {col_name}")
+                    logger.info(f"  ✅ Checked {col_name}")
                 except Exception as e:
-                    print(f"  ⚠️  {col_name}: {e}")
+                    logger.warning(f"  ⚠️  {col_name}: {e}")
             
-            print("✅ Users table updated!")
+            logger.info("✅ Users table updated!")
             
-            print("👨‍👩‍👧‍👦 Checking family members fields...")
+            logger.info("👨‍👩‍👧‍👦 Checking family members fields...")
             family_migrations = [
                 "ALTER TABLE family_members ADD COLUMN IF NOT EXISTS age INTEGER",
                 "ALTER TABLE family_members ADD COLUMN IF NOT EXISTS gender VARCHAR(50)",
@@ -360,11 +413,11 @@ def run_migration():
                     conn.execute(text(query))
                     conn.commit()
                 except Exception as e:
-                    print(f"  ⚠️  Family member note: {e}")
+                    logger.warning(f"  ⚠️  Family member note: {e}")
             
-            print("✅ Family members fields checked!")
+            logger.info("✅ Family members fields checked!")
             
-            print("🏥 Checking health profile fields...")
+            logger.info("🏥 Checking health profile fields...")
             health_migrations = [
                 "ALTER TABLE health_profiles ADD COLUMN IF NOT EXISTS full_name VARCHAR(255)",
                 "ALTER TABLE health_profiles ADD COLUMN IF NOT EXISTS date_of_birth DATE",
@@ -382,22 +435,22 @@ def run_migration():
                     conn.execute(text(query))
                     conn.commit()
                 except Exception as e:
-                    print(f"  ⚠️  Health profile note: {e}")
+                    logger.warning(f"  ⚠️  Health profile note: {e}")
             
-            print("✅ Health profile fields checked!")
+            logger.info("✅ Health profile fields checked!")
             
-            print("🎯 Adding modality to protocols...")
+            logger.info("🎯 Adding modality to protocols...")
             try:
                 conn.execute(text("""
                     ALTER TABLE protocols 
                     ADD COLUMN IF NOT EXISTS modality VARCHAR(50) DEFAULT 'general'
                 """))
                 conn.commit()
-                print("  ✅ Added modality to protocols")
+                logger.info("  ✅ Added modality to protocols")
             except Exception as e:
-                print(f"  ⚠️ Modality column: {e}")
+                logger.warning(f"  ⚠️ Modality column: {e}")
             
-            print("👨‍👩‍👧‍👦 Fixing family_members ID auto-increment...")
+            logger.info("👨‍👩‍👧‍👦 Fixing family_members ID auto-increment...")
             try:
                 conn.execute(text("""
                     DO $$ 
@@ -415,13 +468,13 @@ def run_migration():
                     END $$;
                 """))
                 conn.commit()
-                print("  ✅ Fixed family_members.id auto-increment")
+                logger.info("  ✅ Fixed family_members.id auto-increment")
             except Exception as e:
-                print(f"  ⚠️ family_members.id fix: {e}")
+                logger.warning(f"  ⚠️ family_members.id fix: {e}")
             
             # ==================== CLIENT PORTAL TABLES ====================
             
-            print("🔗 Checking client portal tables...")
+            logger.info("🔗 Checking client portal tables...")
             try:
                 result = conn.execute(text("""
                     SELECT EXISTS (
@@ -432,7 +485,7 @@ def run_migration():
                 table_exists = result.fetchone()[0]
                 
                 if not table_exists:
-                    print("  📝 Creating client_view_tokens table...")
+                    logger.info("  📝 Creating client_view_tokens table...")
                     conn.execute(text("""
                         CREATE TABLE client_view_tokens (
                             id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -445,12 +498,12 @@ def run_migration():
                         )
                     """))
                     conn.commit()
-                    print("  ✅ client_view_tokens table created")
+                    logger.info("  ✅ client_view_tokens table created")
                 else:
-                    print("  ✅ client_view_tokens table exists (preserved)")
+                    logger.info("  ✅ client_view_tokens table exists (preserved)")
                     
             except Exception as e:
-                print(f"  ⚠️ client_view_tokens: {e}")
+                logger.warning(f"  ⚠️ client_view_tokens: {e}")
             
             try:
                 result = conn.execute(text("""
@@ -462,7 +515,7 @@ def run_migration():
                 table_exists = result.fetchone()[0]
                 
                 if not table_exists:
-                    print("  📝 Creating client_messages table...")
+                    logger.info("  📝 Creating client_messages table...")
                     conn.execute(text("""
                         CREATE TABLE client_messages (
                             id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -477,12 +530,12 @@ def run_migration():
                         )
                     """))
                     conn.commit()
-                    print("  ✅ client_messages table created")
+                    logger.info("  ✅ client_messages table created")
                 else:
-                    print("  ✅ client_messages table exists (preserved)")
+                    logger.info("  ✅ client_messages table exists (preserved)")
                     
             except Exception as e:
-                print(f"  ⚠️ client_messages: {e}")
+                logger.warning(f"  ⚠️ client_messages: {e}")
             
             try:
                 conn.execute(text("""
@@ -490,12 +543,12 @@ def run_migration():
                     ON client_messages(practitioner_id, is_read)
                 """))
                 conn.commit()
-                print("  ✅ client_messages index created")
+                logger.info("  ✅ client_messages index created")
             except Exception as e:
-                print(f"  ⚠️ index creation: {e}")
+                logger.warning(f"  ⚠️ index creation: {e}")
             # ==================== TWO-WAY MESSAGING MIGRATION ====================
             
-            print("💬 Adding two-way messaging support...")
+            logger.info("💬 Adding two-way messaging support...")
             try:
                 # Add sender_type column for tracking message sender
                 conn.execute(text("""
@@ -503,7 +556,7 @@ def run_migration():
                     ADD COLUMN IF NOT EXISTS sender_type VARCHAR(20) DEFAULT 'client'
                 """))
                 conn.commit()
-                print("  ✅ sender_type column added")
+                logger.info("  ✅ sender_type column added")
                 
                 # Update existing messages to be from 'client'
                 conn.execute(text("""
@@ -512,7 +565,7 @@ def run_migration():
                     WHERE sender_type IS NULL
                 """))
                 conn.commit()
-                print("  ✅ Existing messages marked as 'client'")
+                logger.info("  ✅ Existing messages marked as 'client'")
                 
                 # Make sender_type NOT NULL
                 try:
@@ -521,9 +574,9 @@ def run_migration():
                         ALTER COLUMN sender_type SET NOT NULL
                     """))
                     conn.commit()
-                    print("  ✅ sender_type set to NOT NULL")
+                    logger.info("  ✅ sender_type set to NOT NULL")
                 except Exception as e:
-                    print(f"  ℹ️ sender_type constraint: {e}")
+                    logger.info(f"  ℹ️ sender_type constraint: {e}")
                 
                 # Add index for faster thread retrieval
                 conn.execute(text("""
@@ -531,17 +584,17 @@ def run_migration():
                     ON client_messages(family_member_id, created_at DESC)
                 """))
                 conn.commit()
-                print("  ✅ Thread index created")
+                logger.info("  ✅ Thread index created")
                 
             except Exception as e:
-                print(f"  ⚠️ Two-way messaging migration: {e}")
+                logger.warning(f"  ⚠️ Two-way messaging migration: {e}")
             
-            print("✅ Two-way messaging ready!")
-            print("✅ Client portal tables ready!")
+            logger.info("✅ Two-way messaging ready!")
+            logger.info("✅ Client portal tables ready!")
             
             # ==================== PROTOCOL CONTENT FIELDS ====================
             
-            print("🌿 Checking protocol content fields...")
+            logger.info("🌿 Checking protocol content fields...")
             protocol_migrations = [
                 "ALTER TABLE protocols ADD COLUMN IF NOT EXISTS supplements JSONB",
                 "ALTER TABLE protocols ADD COLUMN IF NOT EXISTS exercises JSONB",
@@ -557,29 +610,56 @@ def run_migration():
                     conn.execute(text(query))
                     conn.commit()
                 except Exception as e:
-                    print(f"  ⚠️  Protocol field: {e}")
+                    logger.warning(f"  ⚠️  Protocol field: {e}")
             
-            print("✅ Protocol content fields checked!")
+            logger.info("✅ Protocol content fields checked!")
             
     except Exception as e:
-        print(f"❌ Migration error: {e}")
+        logger.error(f"❌ Migration error: {e}")
         raise
             
     except Exception as e:
-        print(f"❌ Migration error: {e}")
+        logger.error(f"❌ Migration error: {e}")
         raise
     
-    print("✅ Database migration completed!")
+    logger.info("✅ Database migration completed!")
 
 # ==================== FASTAPI APP ====================
-app = FastAPI(title="Tree of Life AI API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker startup, and shutdown once in-flight requests (LLM streams included) have drained"""
+    # Under gunicorn the master already ran these once, before forking (gunicorn.conf.py)
+    if os.getenv('STARTUP_TASKS_DONE') != '1':
+        await run_startup_tasks()
+    
+    # Normalize pre-existing lab_results into lab_values without blocking startup
+    # (an advisory lock keeps concurrent workers from doing it twice)
+    threading.Thread(target=_backfill_lab_values, daemon=True).start()
+    # Import stripe/resend/anthropic off the request path so the first call doesn't pay for it
+    lazy_import.warm_in_background()
+    # Pick the bcrypt cost now rather than on the first login (no-op if the master already did)
+    await asyncio.to_thread(bcrypt_rounds)
+    logger.info(f"🚀 Tree of Life AI is ready! (pid {os.getpid()})")
+    
+    yield
+    
+    logger.info(f"🛑 Worker {os.getpid()} shutting down")
+    shutdown_password_pool()
+    tracing.shutdown()
+    engine.dispose()
+    client_messages.engine.dispose()
+
+app = FastAPI(title="Tree of Life AI API", lifespan=lifespan)
 import os
 if os.path.exists("app/static"):
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
-    print("✅ Static files mounted from app/static/")
+    logger.info("✅ Static files mounted from app/static/")
 else:
-    print("⚠️  /app/static/ directory not found - PWA features disabled")
+    logger.warning("⚠️  /app/static/ directory not found - PWA features disabled")
 
+# Added before CORS so it sits inside it and 400s/429s still carry CORS headers
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(rate_limit.RateLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -587,8 +667,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(tracing.TracingMiddleware)
+# Outermost, so latency includes CORS and every other middleware
+app.add_middleware(metrics.MetricsMiddleware)
 # Register client inbox routes
 app.include_router(client_messages.router, prefix="/api", tags=["client-messages"])
+metrics.instrument_engine(client_messages.engine, 'client_messages')
+tracing.instrument_engine(client_messages.engine, 'client_messages')
+slow_queries.instrument_engine(client_messages.engine, 'client_messages')
 from app.api.client_portal import router as client_portal_router
 app.include_router(client_portal_router, prefix="/api", tags=["client-portal"])
 from app.api.client_portal import router as client_portal_router
@@ -598,11 +684,14 @@ app.include_router(client_portal_router, prefix="/api", tags=["client-portal"])
 
 # ==================== STARTUP EVENT ====================
 
-@app.on_event("startup")
+async def run_startup_tasks():
+    """One-time schema work - from lifespan() under uvicorn, or once in the gunicorn master"""
+    await startup_event()
+
 async def startup_event():
-    print("🌳 Starting Tree of Life AI...")
+    logger.info("🌳 Starting Tree of Life AI...")
     
-    print("🔧 Checking family_members.id data type...")
+    logger.info("🔧 Checking family_members.id data type...")
     try:
         with engine.connect() as conn:
             result = conn.execute(text("""
@@ -614,7 +703,7 @@ async def startup_event():
             row = result.fetchone()
             
             if row and row[0] != 'integer':
-                print(f"  ⚠️ family_members.id is {row[0]}, converting to INTEGER...")
+                logger.warning(f"  ⚠️ family_members.id is {row[0]}, converting to INTEGER...")
                 
                 conn.execute(text("ALTER TABLE IF EXISTS client_protocols DROP CONSTRAINT IF EXISTS client_protocols_client_id_fkey CASCADE"))
                 conn.commit()
@@ -624,45 +713,58 @@ async def startup_event():
                     ALTER COLUMN id TYPE INTEGER USING id::integer
                 """))
                 conn.commit()
-                print("  ✅ Converted family_members.id to INTEGER")
+                logger.info("  ✅ Converted family_members.id to INTEGER")
             else:
-                print("  ✅ family_members.id is already INTEGER")
+                logger.info("  ✅ family_members.id is already INTEGER")
                 
     except Exception as e:
-        print(f"  ⚠️ family_members.id check: {e}")
+        logger.warning(f"  ⚠️ family_members.id check: {e}")
     
     Base.metadata.create_all(bind=engine)
-    print("✅ Database tables created/verified")
+    logger.info("✅ Database tables created/verified")
     run_migration()
+    # After create_all: these reference model tables (client_protocols, protocols)
+    run_migrations()
     
-    print("🔧 Fixing conversations table...")
+    logger.info("🔧 Fixing conversations table...")
     try:
         with engine.connect() as conn:
             conn.execute(text("DROP TABLE IF EXISTS messages CASCADE"))
             conn.execute(text("DROP TABLE IF EXISTS conversations CASCADE"))
             conn.commit()
         Base.metadata.create_all(bind=engine)
-        print("✅ Conversations table recreated")
+        logger.info("✅ Conversations table recreated")
     except Exception as e:
-        print(f"⚠️ Conversations fix: {e}")
+        logger.warning(f"⚠️ Conversations fix: {e}")
     
    # ✅ CHECK PROJECT ID AND SDK VERSION
     if ANTHROPIC_PROJECT_ID:
-        print(f"✅ Claude Project ID configured: {ANTHROPIC_PROJECT_ID[:8]}...")
-        print(f"📦 Anthropic SDK version: {anthropic.__version__}")
+        logger.info(f"✅ Claude Project ID configured: {ANTHROPIC_PROJECT_ID[:8]}...")
+        logger.info(f"📦 Anthropic SDK version: {importlib.metadata.version('anthropic')}")
     else:
-        print("⚠️ WARNING: ANTHROPIC_PROJECT_ID not set - skills will not be accessible!")
+        logger.warning("⚠️ WARNING: ANTHROPIC_PROJECT_ID not set - skills will not be accessible!")
     
-    print("🚀 Tree of Life AI is ready!")
+
+def _backfill_lab_values():
+    try:
+        processed = lab_values.backfill_lab_values(engine)
+        if processed:
+            logger.info(f"✅ lab_values backfill complete ({processed} lab results)")
+    except Exception as e:
+        logger.warning(f"⚠️ lab_values backfill: {e}")
 
 # ==================== HELPER FUNCTIONS ====================
 # Auth functions moved to app/auth.py to avoid circular imports
 from app.auth import (
-    hash_password,
-    verify_password,
+    bcrypt_rounds,
+    hash_password_async,
+    verify_password_async,
+    needs_rehash,
+    shutdown_password_pool,
     create_token,
     verify_token,
-    get_current_user_id
+    get_current_user_id,
+    get_optional_user_id
 )
 
 def get_or_create_health_profile(db, user_id):
@@ -687,6 +789,9 @@ class LoginRequest(BaseModel):
 
 @app.post("/api/auth/register")
 async def register(request: SignupRequest):
+    # Hashed before checking out a connection so the pool isn't held for the bcrypt time
+    hashed_password = await hash_password_async(request.password)
+    
     with get_db_context() as db:
         existing = db.query(User).filter(User.email == request.email).first()
         if existing:
@@ -694,7 +799,7 @@ async def register(request: SignupRequest):
         
         user = User(
             email=request.email,
-            hashed_password=hash_password(request.password),
+            hashed_password=hashed_password,
             full_name=request.name
         )
         db.add(user)
@@ -704,8 +809,22 @@ async def register(request: SignupRequest):
         token = create_token(user.id)
         return {"token": token, "user": {"email": user.email, "name": user.full_name}}
 
+async def _upgrade_password_hash(user_id, old_hash: str, password: str):
+    """Re-hash at the current bcrypt cost after a successful login (runs after the response)"""
+    try:
+        new_hash = await hash_password_async(password)
+        with get_db_context() as db:
+            # Skipped if the password changed in the meantime
+            db.execute(text(
+                "UPDATE users SET hashed_password = :new_hash WHERE id = :user_id AND hashed_password = :old_hash"
+            ), {'new_hash': new_hash, 'user_id': str(user_id), 'old_hash': old_hash})
+            db.commit()
+        logger.info("🔐 Password hash upgraded to the current bcrypt cost", extra={'user_id': str(user_id)})
+    except Exception as e:
+        logger.warning(f"⚠️ Password hash upgrade failed: {e}", extra={'user_id': str(user_id)})
+
 @app.post("/api/auth/login")
-async def login(request: LoginRequest):
+async def login(request: LoginRequest, background_tasks: BackgroundTasks):
     with get_db_context() as db:
         user = db.query(User).filter(User.email == request.email).first()
         
@@ -718,14 +837,17 @@ async def login(request: LoginRequest):
         user_name = user.full_name
     
     try:
-        password_valid = verify_password(request.password, hashed_password)
+        password_valid = await verify_password_async(request.password, hashed_password)
     except (ValueError, Exception) as e:
-        print(f"❌ Password verification failed for {request.email}: {e}")
+        logger.warning(f"❌ Password verification failed: {e}", extra={'user_id': str(user_id)})
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not password_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    if needs_rehash(hashed_password):
+        background_tasks.add_task(_upgrade_password_hash, user_id, hashed_password, request.password)
+    
     token = create_token(user_id)
     return {"token": token, "user": {"email": user_email, "name": user_name}}
         
@@ -763,23 +885,24 @@ async def request_password_reset(data: dict):
             
             # Send email
             try:
-                resend.Emails.send({
-                    "from": "noreply@treeoflifeai.com",
-                    "to": email, 
-                    "subject": "Reset Your Tree of Life AI Password",
-                    "html": f"""
-                    <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
-                        <h2 style="color: #D4A574;">Reset Your Password</h2>
-                        <p>Click the link below to reset your password:</p>
-                        <a href="{reset_link}" style="display: inline-block; padding: 12px 24px; background: #B8860B; color: white; text-decoration: none; border-radius: 8px; margin: 20px 0;">Reset Password</a>
-                        <p style="color: #666; font-size: 14px;">This link expires in 1 hour.</p>
-                        <p style="color: #999; font-size: 12px;">If you didn't request this, ignore this email.</p>
-                    </div>
-                    """
-                })
-                print(f"✅ Password reset email sent to {email}")
+                with metrics.track_external('resend', 'emails.send'):
+                    resend.Emails.send({
+                        "from": "noreply@treeoflifeai.com",
+                        "to": email, 
+                        "subject": "Reset Your Tree of Life AI Password",
+                        "html": f"""
+                        <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
+                            <h2 style="color: #D4A574;">Reset Your Password</h2>
+                            <p>Click the link below to reset your password:</p>
+                            <a href="{reset_link}" style="display: inline-block; padding: 12px 24px; background: #B8860B; color: white; text-decoration: none; border-radius: 8px; margin: 20px 0;">Reset Password</a>
+                            <p style="color: #666; font-size: 14px;">This link expires in 1 hour.</p>
+                            <p style="color: #999; font-size: 12px;">If you didn't request this, ignore this email.</p>
+                        </div>
+                        """
+                    })
+                logger.info("✅ Password reset email sent")
             except Exception as e:
-                print(f"❌ Email send failed: {e}")
+                logger.error(f"❌ Email send failed: {e}")
     
     return {"success": True, "message": "If that email exists, you'll receive a password reset link shortly."}
 
@@ -811,16 +934,22 @@ async def reset_password(data: dict):
             raise HTTPException(status_code=400, detail="This reset link has expired")
         
         user_id = reset_token[0]
-        hashed_password = hash_password(new_password)
+    
+    # Outside the session: no pooled connection is held while bcrypt runs
+    hashed_password = await hash_password_async(new_password)
+    
+    with get_db_context() as db:
+        # Claim the token first so two concurrent resets can't both apply
+        claimed = db.execute(text(
+            "UPDATE password_reset_tokens SET used = true WHERE token = :token AND used = false"
+        ), {'token': token})
+        if claimed.rowcount != 1:
+            raise HTTPException(status_code=400, detail="This reset link has already been used")
         
         db.execute(text(
             "UPDATE users SET hashed_password = :hashed_password WHERE id = :user_id"
         ), {'hashed_password': hashed_password, 'user_id': str(user_id)})
         
-        db.execute(text(
-            "UPDATE password_reset_tokens SET used = true WHERE token = :token"
-        ), {'token': token})
-        
         db.commit()
     
     return {"success": True, "message": "Password successfully reset. You can now log in with your new password."}
@@ -846,37 +975,19 @@ async def me_endpoint(request: Request):
 
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
-from jwt.exceptions import InvalidTokenError as JWTError
 
 security = HTTPBearer(auto_error=False)
 
-def get_current_user_optional(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[dict]:
+def get_current_user_optional(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> Optional[dict]:
     """Optional JWT auth - returns user if logged in, None if guest"""
-    if not credentials:
-        return None
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        return {"sub": user_id}
-    except JWTError:
-        return None
+    user_id = get_optional_user_id(request)
+    return {"sub": user_id} if user_id else None
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+def get_current_user(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """Required JWT auth - raises error if not logged in"""
-    if not credentials:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return {"sub": user_id}
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    # `credentials` only documents the bearer scheme in OpenAPI; decoding is shared with get_current_user_id
+    return {"sub": get_current_user_id(request)}
+
 @app.delete("/api/auth/account")
 async def delete_account(
     current_user: dict = Depends(get_current_user),
@@ -894,17 +1005,19 @@ async def delete_account(
             user = db.query(User).filter(User.id == user_id).first()
             if user and user.stripe_customer_id:
                 try:
-                    subscriptions = stripe.Subscription.list(
-                        customer=user.stripe_customer_id,
-                        status='active'
-                    )
+                    with metrics.track_external('stripe', 'subscription.list'):
+                        subscriptions = stripe.Subscription.list(
+                            customer=user.stripe_customer_id,
+                            status='active'
+                        )
                     for subscription in subscriptions.data:
-                        stripe.Subscription.delete(subscription.id)
+                        with metrics.track_external('stripe', 'subscription.delete'):
+                            stripe.Subscription.delete(subscription.id)
                 except Exception as stripe_error:
-                    print(f"Stripe cancellation error: {stripe_error}")
+                    logger.error(f"Stripe cancellation error: {stripe_error}")
                     # Continue with deletion even if Stripe fails
         except Exception as e:
-            print(f"Error canceling subscription: {e}")        
+            logger.error(f"Error canceling subscription: {e}")
       
        # REPLACE your entire STEP 2 in delete_account with this:
 
@@ -935,7 +1048,8 @@ async def delete_account(
         db.execute(
             text("""
                 DELETE FROM ai_analyses 
-                WHERE client_id IN (SELECT id FROM family_members WHERE user_id = :user_id)
+                WHERE user_id = :user_id
+                   OR client_id IN (SELECT id FROM family_members WHERE user_id = :user_id)
             """),
             {"user_id": user_id}
         )
@@ -1033,6 +1147,7 @@ async def delete_account(
         
         # ✅ STEP 4: Commit all deletions
         db.commit()
+        account_cache.invalidate(user_id)
         
         return {
             "success": True,
@@ -1041,7 +1156,7 @@ async def delete_account(
         
     except Exception as e:
         db.rollback()
-        print(f"Error deleting account: {e}")
+        logger.error(f"Error deleting account: {e}")
         raise HTTPException(
             status_code=500,
             detail=f"Error deleting account data: {str(e)}"
@@ -1059,14 +1174,30 @@ class MessageCreate(BaseModel):
     message: str
     image: Optional[Dict] = None
 
+async def _build_image_block(image: Dict) -> Dict:
+    """Downscale/re-encode a chat image and wrap it as a Claude content block"""
+    try:
+        # Pillow decode/resize/re-encode is CPU-bound - keep it off the event loop
+        processed, stats = await asyncio.to_thread(preprocess_base64_image, image)
+    except ImageProcessingError as e:
+        raise HTTPException(status_code=400, detail=f"Could not process image: {e}")
+    
+    logger.info("🖼️ Chat image preprocessed", extra={'event': 'chat.image', 'original_bytes': stats['original_bytes'], 'processed_bytes': stats['processed_bytes']})
+    return {"type": "image", "source": {"type": "base64", "media_type": processed['type'], "data": processed['data']}}
+
 @app.post("/api/chat/conversations")
 async def create_conversation_endpoint(request: Request, data: ConversationCreate):
     user_id = get_current_user_id(request)
     
     # Check message limit
-    with get_db_context() as db:
-        user = db.query(User).filter(User.id == user_id).first()
-        check_message_limit(user_id, user.subscription_tier or 'free')
+    tier = account_cache.for_request(request, engine)['tier']
+    check_message_limit(user_id, tier)
+    
+    # Reject before anything is written if the model queue is already full
+    llm_scheduler.check_admission(tier)
+    
+    # Preprocess before anything is written so a bad image doesn't leave an orphan conversation
+    image_block = await _build_image_block(data.image) if data.image else None
     
     with get_db_context() as db:
         conversation = Conversation(user_id=user_id, title=data.initial_message[:50])
@@ -1084,17 +1215,15 @@ async def create_conversation_endpoint(request: Request, data: ConversationCreat
         
         messages = [{"role": "user", "content": data.initial_message}]
         
-        if data.image:
+        if image_block:
             messages[0] = {
                 "role": "user",
                 "content": [
-                    {"type": "image", "source": {"type": "base64", "media_type": data.image['type'], "data": data.image['data']}},
+                    image_block,
                     {"type": "text", "text": data.initial_message}
                 ]
             }
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        
         # Load specialized skill if needed
         specialized = get_specialized_knowledge(data.initial_message)
         final_prompt = SYSTEM_PROMPT_WITH_WESTERN_MED + specialized
@@ -1113,7 +1242,7 @@ async def create_conversation_endpoint(request: Request, data: ConversationCreat
             "messages": messages
         }
         
-        response = client.messages.create(**api_params)
+        response = await llm_client.create_message(api_params, tier=tier, endpoint='chat')
         
         ai_content = response.content[0].text
         
@@ -1184,9 +1313,13 @@ async def send_message(request: Request, conversation_id: str, data: MessageCrea
     user_id = get_current_user_id(request)
     
     # Check message limit
-    with get_db_context() as db:
-        user = db.query(User).filter(User.id == user_id).first()
-        check_message_limit(user_id, user.subscription_tier or 'free')
+    tier = account_cache.for_request(request, engine)['tier']
+    check_message_limit(user_id, tier)
+    
+    # Reject before anything is written if the model queue is already full
+    llm_scheduler.check_admission(tier)
+    
+    image_block = await _build_image_block(data.image) if data.image else None
     
     with get_db_context() as db:
         conversation = db.query(Conversation).filter(
@@ -1205,25 +1338,26 @@ async def send_message(request: Request, conversation_id: str, data: MessageCrea
         db.add(user_message)
         db.commit()
         
-        messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.timestamp).all()
+        with tracing.span('chat.load_history') as span:
+            messages = db.query(Message).filter(Message.conversation_id == conversation_id).order_by(Message.timestamp).all()
+            span.set('messages', len(messages))
         
         claude_messages = []
         for msg in messages:
             claude_messages.append({"role": msg.role, "content": msg.content})
         
-        if data.image:
+        if image_block:
             claude_messages[-1] = {
                 "role": "user",
                 "content": [
-                    {"type": "image", "source": {"type": "base64", "media_type": data.image['type'], "data": data.image['data']}},
+                    image_block,
                     {"type": "text", "text": data.message}
                 ]
             }
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        
         # Load specialized skill if needed
-        specialized = get_specialized_knowledge(data.message)
+        with tracing.span('chat.specialized_knowledge'):
+            specialized = get_specialized_knowledge(data.message)
         final_prompt = SYSTEM_PROMPT_WITH_WESTERN_MED + specialized
         
         # Enable prompt caching
@@ -1240,7 +1374,7 @@ async def send_message(request: Request, conversation_id: str, data: MessageCrea
             "messages": claude_messages
         }
         
-        response = client.messages.create(**api_params)
+        response = await llm_client.create_message(api_params, tier=tier, endpoint='chat')
         
         ai_content = response.content[0].text
         
@@ -1415,18 +1549,13 @@ async def delete_family_member(request: Request, member_id: int):
 
 @app.get("/api/subscription/status")
 async def get_subscription_status(request: Request):
-    user_id = get_current_user_id(request)
+    account = account_cache.for_request(request, engine)
     
-    with get_db_context() as db:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        return {
-            "tier": user.subscription_tier or 'free',
-            "family_member_limit": user.family_member_limit or 0,
-            "messages_this_month": 0
-        }
+    return {
+        "tier": account['tier'],
+        "family_member_limit": account['family_member_limit'],
+        "messages_this_month": 0
+    }
 
 @app.post("/api/subscription/create-checkout")
 async def create_checkout(request: Request, current_user: dict = Depends(get_current_user_optional)):
@@ -1453,10 +1582,11 @@ async def create_checkout(request: Request, current_user: dict = Depends(get_cur
             user = db.query(User).filter(User.id == current_user['sub']).first()
             if user:
                 if not user.stripe_customer_id:
-                    customer = stripe.Customer.create(
-                        email=user.email,
-                        metadata={'user_id': str(user.id)}
-                    )
+                    with metrics.track_external('stripe', 'customer.create'):
+                        customer = stripe.Customer.create(
+                            email=user.email,
+                            metadata={'user_id': str(user.id)}
+                        )
                     user.stripe_customer_id = customer.id
                     db.commit()
                 customer_id = user.stripe_customer_id
@@ -1465,15 +1595,17 @@ async def create_checkout(request: Request, current_user: dict = Depends(get_cur
     # Cancel any existing active subscriptions before creating new one
     if customer_id:
         try:
-            existing_subs = stripe.Subscription.list(
-                customer=customer_id,
-                status='active',
-                limit=10
-            )
+            with metrics.track_external('stripe', 'subscription.list'):
+                existing_subs = stripe.Subscription.list(
+                    customer=customer_id,
+                    status='active',
+                    limit=10
+                )
             for sub in existing_subs.data:
-                stripe.Subscription.modify(sub.id, cancel_at_period_end=True)
+                with metrics.track_external('stripe', 'subscription.modify'):
+                    stripe.Subscription.modify(sub.id, cancel_at_period_end=True)
         except Exception as e:
-            print(f"⚠️ Error canceling existing subscriptions: {e}")
+            logger.warning(f"⚠️ Error canceling existing subscriptions: {e}")
     
     # Create checkout session
     try:
@@ -1490,11 +1622,12 @@ async def create_checkout(request: Request, current_user: dict = Depends(get_cur
             session_params['client_reference_id'] = user_id_str
             session_params['metadata'] = {'user_id': user_id_str, 'tier': tier}
         
-        checkout_session = stripe.checkout.Session.create(**session_params)
+        with metrics.track_external('stripe', 'checkout.session.create'):
+            checkout_session = stripe.checkout.Session.create(**session_params)
         return {"checkout_url": checkout_session.url}
     
     except Exception as e:
-        print(f"❌ Stripe error: {e}")
+        logger.error(f"❌ Stripe error: {e}")
         raise HTTPException(status_code=500, detail=f"Stripe error: {str(e)}")
 @app.post("/api/subscription/webhook")
 async def stripe_webhook(request: Request):
@@ -1529,6 +1662,7 @@ async def stripe_webhook(request: Request):
                         user.family_member_limit = 999
                     
                     db.commit()
+                    account_cache.invalidate(user_id)
     elif event['type'] == 'customer.subscription.deleted':
         session = event['data']['object']
         customer_id = session.get('customer')
@@ -1541,6 +1675,7 @@ async def stripe_webhook(request: Request):
                     user.family_member_limit = 0
                     user.stripe_subscription_id = None
                     db.commit()
+                    account_cache.invalidate(user.id)
     return {"status": "success"}
 
 @app.post("/api/subscription/portal")
@@ -1557,15 +1692,16 @@ async def create_portal_session(request: Request):
             raise HTTPException(status_code=400, detail="No Stripe customer found")
         
         try:
-            portal_session = stripe.billing_portal.Session.create(
-                customer=user.stripe_customer_id,
-                return_url='https://treeoflifeai.com/index.html'
-            )
+            with metrics.track_external('stripe', 'billing_portal.session.create'):
+                portal_session = stripe.billing_portal.Session.create(
+                    customer=user.stripe_customer_id,
+                    return_url='https://treeoflifeai.com/index.html'
+                )
             
             return {"portal_url": portal_session.url}
         
         except Exception as e:
-            print(f"❌ Stripe portal error: {e}")
+            logger.error(f"❌ Stripe portal error: {e}")
             raise HTTPException(status_code=500, detail=f"Stripe error: {str(e)}")
 
 # ==================== HEALTH PROFILE ENDPOINTS ====================
@@ -1637,8 +1773,7 @@ async def update_health_profile(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Profile update failed")
         raise HTTPException(status_code=500, detail=f"Profile update failed: {str(e)}")
 # ==================== AI ANALYSIS ENDPOINTS ====================
 
@@ -1664,16 +1799,20 @@ async def save_ai_analysis(request: Request):
             if not member:
                 raise HTTPException(status_code=404, detail="Client not found")
             
-            # Save analysis to PostgreSQL
+            # Save analysis to PostgreSQL; saving the same analysis again only refreshes it
             with engine.connect() as conn:
                 result = conn.execute(text("""
-                    INSERT INTO ai_analyses (user_id, client_id, analysis_data, created_at)
-                    VALUES (:user_id, :client_id, :analysis_data, :created_at)
+                    INSERT INTO ai_analyses (user_id, client_id, analysis_data, fingerprint, created_at)
+                    VALUES (:user_id, :client_id, :analysis_data, :fingerprint, :created_at)
+                    ON CONFLICT (user_id, client_id, fingerprint) WHERE client_id IS NOT NULL AND fingerprint IS NOT NULL
+                    DO UPDATE SET analysis_data = EXCLUDED.analysis_data, created_at = EXCLUDED.created_at
                     RETURNING id
                 """), {
                     'user_id': str(user_id),
                     'client_id': client_id,
                     'analysis_data': json.dumps(analysis_data),
+                    # Computed here - a posted fingerprint is not trusted
+                    'fingerprint': _saved_analysis_fingerprint(analysis_data),
                     'created_at': datetime.now()
                 })
                 
@@ -1689,7 +1828,7 @@ async def save_ai_analysis(request: Request):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"❌ Error saving AI analysis: {str(e)}")
+        logger.error(f"❌ Error saving AI analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1736,7 +1875,7 @@ async def get_analysis_history(request: Request, client_id: int):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"❌ Error fetching analysis history: {str(e)}")
+        logger.error(f"❌ Error fetching analysis history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1774,7 +1913,7 @@ async def get_analysis(request: Request, analysis_id: int):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"❌ Error fetching analysis: {str(e)}")
+        logger.error(f"❌ Error fetching analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1807,10 +1946,171 @@ async def delete_analysis(request: Request, analysis_id: int):
     except HTTPException as he:
         raise he
     except Exception as e:
-        print(f"❌ Error deleting analysis: {str(e)}")
+        logger.error(f"❌ Error deleting analysis: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 # ==================== AI HEALTH ANALYSIS HELPERS ====================
 
+AI_ANALYSIS_MODEL = "claude-sonnet-4-20250514"
+AI_ANALYSIS_FANOUT = os.getenv('AI_ANALYSIS_FANOUT', 'false').lower() == 'true'
+
+# Section key -> prompt line, in the order the single-request prompt lists them
+AI_ANALYSIS_SECTIONS = {
+    "overall_assessment": "**Overall Health Assessment**: General health status and key observations",
+    "lab_results_analysis": "**Lab Results Analysis**: Interpretation of recent lab values, highlighting abnormalities",
+    "metrics_trends": "**Metrics Trends**: Analysis of weight, blood pressure, blood sugar trends",
+    "medication_review": "**Medication Review**: Assessment of current medications and potential interactions",
+    "integrative_recommendations": "**Integrative Recommendations**: Combine insights from multiple healing traditions",
+    "lifestyle_suggestions": "**Lifestyle Suggestions**: Diet, exercise, sleep, stress management recommendations",
+    "western_medicine": "**Western Medicine Perspective**: Evidence-based medical insights",
+    "clinical_nutrition": "**Clinical Nutrition**: Specific nutritional therapy recommendations",
+    "herbal_medicine": "**Herbal Medicine**: Evidence-based herbal remedies",
+    "supplement_recommendations": "**Supplement Recommendations**: Specific supplements with dosages",
+    "ayurvedic_perspective": "**Ayurvedic Perspective**: Recommendations based on dosha (if applicable)",
+    "tcm_perspective": "**TCM Perspective**: Recommendations based on pattern (if applicable)",
+    "action_items": "**Action Items**: Specific, actionable steps",
+}
+
+# Fan-out groups: each is one concurrent request, sized to finish in similar time
+AI_ANALYSIS_SECTION_GROUPS = {
+    "clinical": ["overall_assessment", "lab_results_analysis", "metrics_trends", "medication_review", "western_medicine"],
+    "traditions": ["integrative_recommendations", "clinical_nutrition", "herbal_medicine", "supplement_recommendations", "ayurvedic_perspective", "tcm_perspective"],
+    "action": ["lifestyle_suggestions", "action_items"],
+}
+AI_ANALYSIS_GROUP_MAX_TOKENS = 2000
+
+def _analysis_patient_context(health_data, user_id):
+    """
+    Posted profile/metrics/labs are used when present (older clients and
+    practitioners analysing a client still post the full payload). The
+    caller's own server-side records are only used when the request says
+    so with "subject": "self" - an empty client payload must never turn into
+    an analysis of the practitioner's own health data.
+    """
+    if any(health_data.get(key) for key in ('personal', 'medical', 'metrics', 'lab_results')):
+        return _format_posted_health_data(health_data)
+    if health_data.get('subject') == 'self' and not health_data.get('client_id'):
+        return health_context.build_health_context(engine, user_id)['text']
+    raise HTTPException(
+        status_code=400,
+        detail="No health data provided. Send the client's data, or \"subject\": \"self\" to analyze your own records."
+    )
+
+def _analysis_system_prompt():
+    """Cacheable system prompt - always loads Functional Medicine for comprehensive analysis"""
+    specialized = get_specialized_knowledge("functional medicine comprehensive health analysis")
+    return [
+        {
+            "type": "text",
+            "text": SYSTEM_PROMPT_WITH_WESTERN_MED + specialized,
+            "cache_control": {"type": "ephemeral"}
+        }
+    ]
+
+def _find_stored_analysis(user_id, fingerprint):
+    """Most recent stored analysis with this fingerprint as (id, sections), or None"""
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT id, analysis_data
+            FROM ai_analyses
+            WHERE user_id = :user_id AND fingerprint = :fingerprint AND client_id IS NULL
+            ORDER BY created_at DESC
+            LIMIT 1
+        """), {'user_id': str(user_id), 'fingerprint': fingerprint}).fetchone()
+    if not row:
+        return None
+    return row[0], json.loads(row[1]) if isinstance(row[1], str) else row[1]
+
+def _saved_analysis_fingerprint(analysis_data):
+    """Fingerprint of a saved analysis's content (sections only, not response metadata)"""
+    if not isinstance(analysis_data, dict):
+        return None
+    content = {key: analysis_data.get(key) for key in AI_ANALYSIS_SECTIONS}
+    payload = json.dumps(content, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _store_analysis(user_id, sections, fingerprint):
+    """
+    Store an analysis with its fingerprint so an identical request is a single
+    indexed lookup. Regenerating (?force=true) replaces the row for that
+    fingerprint rather than adding another.
+    """
+    try:
+        with engine.connect() as conn:
+            analysis_id = conn.execute(text("""
+                INSERT INTO ai_analyses (user_id, client_id, analysis_data, fingerprint, created_at)
+                VALUES (:user_id, NULL, :analysis_data, :fingerprint, :created_at)
+                ON CONFLICT (user_id, fingerprint) WHERE client_id IS NULL AND fingerprint IS NOT NULL
+                DO UPDATE SET analysis_data = EXCLUDED.analysis_data, created_at = EXCLUDED.created_at
+                RETURNING id
+            """), {
+                'user_id': str(user_id),
+                'analysis_data': json.dumps(sections),
+                'fingerprint': fingerprint,
+                'created_at': datetime.now()
+            }).scalar()
+            conn.commit()
+            return analysis_id
+    except Exception as e:
+        logger.warning(f"⚠️ Could not store AI analysis for reuse: {str(e)}")
+        return None
+
+def _analysis_preamble(patient_context):
+    """Shared prompt prefix - identical across fan-out requests so it can be cached"""
+    return f"""You are an expert integrative health advisor with deep knowledge of Western medicine, Ayurveda, 
+Traditional Chinese Medicine, Clinical Nutrition, Herbal Medicine, and evidence-based supplement therapy. 
+Analyze the following health data and provide a comprehensive, personalized health assessment.
+
+{patient_context}"""
+
+def _analysis_instructions(section_keys):
+    """Numbered section list for the requested sections"""
+    lines = [f"{i}. {AI_ANALYSIS_SECTIONS[key]}" for i, key in enumerate(section_keys, 1)]
+    if len(section_keys) == len(AI_ANALYSIS_SECTIONS):
+        intro = "Please provide a comprehensive health analysis with the following sections:"
+    else:
+        intro = "Please provide ONLY the following sections of the health analysis (other sections are written separately):"
+    return intro + "\n\n" + "\n".join(lines) + "\n\nUse markdown formatting. Be compassionate, clear, and actionable."
+
+async def _generate_analysis_fanout(system, patient_context, tier):
+    """
+    Generate each section group as its own request and merge the results into
+    the usual section dict. The system prompt and the patient preamble are
+    marked cacheable; the first group runs alone so it writes that prefix, and
+    the rest then run concurrently and read it.
+
+    Returns (sections, failed_groups). A failure in the first group is raised;
+    a later group that fails leaves its sections empty and is named in
+    failed_groups.
+    """
+    preamble = {"type": "text", "text": _analysis_preamble(patient_context), "cache_control": {"type": "ephemeral"}}
+    
+    async def generate(section_keys):
+        message = await llm_client.create_message({
+            "model": AI_ANALYSIS_MODEL,
+            "max_tokens": AI_ANALYSIS_GROUP_MAX_TOKENS,
+            "system": system,
+            "messages": [{"role": "user", "content": [preamble, {"type": "text", "text": _analysis_instructions(section_keys)}]}]
+        }, tier=tier, endpoint='ai_analysis')
+        return message.content[0].text
+    
+    groups = list(AI_ANALYSIS_SECTION_GROUPS.items())
+    first_text = await generate(groups[0][1])
+    rest = await asyncio.gather(*(generate(keys) for _, keys in groups[1:]), return_exceptions=True)
+    
+    sections = {key: "" for key in AI_ANALYSIS_SECTIONS}
+    failed_groups = []
+    for (group, section_keys), analysis_text in zip(groups, [first_text, *rest]):
+        if isinstance(analysis_text, BaseException):
+            logger.error(f"❌ AI analysis group '{group}' failed: {str(analysis_text)}")
+            failed_groups.append(group)
+            continue
+        parsed = _parse_analysis_sections(analysis_text)
+        # Keep only the sections this request was asked for - anything the
+        # heuristic parser routed elsewhere is preamble, not content
+        for key in section_keys:
+            sections[key] = parsed.get(key, "")
+    return sections, failed_groups
+
 def _format_metric_trend(metrics):
     """Format metrics for prompt"""
     if not metrics or len(metrics) == 0:
@@ -1833,74 +2133,9 @@ def _format_lab_results(lab_results):
     
     return "\n".join(formatted)
 
-def _parse_analysis_sections(analysis_text):
-    """Parse Claude's response into structured sections"""
-    sections = {
-        "overall_assessment": "",
-        "lab_results_analysis": "",
-        "metrics_trends": "",
-        "medication_review": "",
-        "integrative_recommendations": "",
-        "lifestyle_suggestions": "",
-        "western_medicine": "",
-        "clinical_nutrition": "",
-        "herbal_medicine": "",
-        "supplement_recommendations": "",
-        "ayurvedic_perspective": "",
-        "tcm_perspective": "",
-        "action_items": ""
-    }
-    
-    current_section = "overall_assessment"
-    lines = analysis_text.split('\n')
-    
-    for line in lines:
-        line_lower = line.lower()
-        
-        if 'overall health' in line_lower or 'health assessment' in line_lower:
-            current_section = "overall_assessment"
-        elif 'lab result' in line_lower:
-            current_section = "lab_results_analysis"
-        elif 'metric' in line_lower and 'trend' in line_lower:
-            current_section = "metrics_trends"
-        elif 'medication' in line_lower:
-            current_section = "medication_review"
-        elif 'integrative' in line_lower:
-            current_section = "integrative_recommendations"
-        elif 'lifestyle' in line_lower:
-            current_section = "lifestyle_suggestions"
-        elif 'western medicine' in line_lower:
-            current_section = "western_medicine"
-        elif 'clinical nutrition' in line_lower or 'nutrition' in line_lower:
-            current_section = "clinical_nutrition"
-        elif 'herbal medicine' in line_lower or 'herbal' in line_lower:
-            current_section = "herbal_medicine"
-        elif 'supplement' in line_lower:
-            current_section = "supplement_recommendations"
-        elif 'ayurvedic' in line_lower:
-            current_section = "ayurvedic_perspective"
-        elif 'tcm' in line_lower or 'chinese medicine' in line_lower:
-            current_section = "tcm_perspective"
-        elif 'action item' in line_lower:
-            current_section = "action_items"
-        else:
-            sections[current_section] += line + "\n"
-    
-    return sections
-
-# ==================== AI HEALTH ANALYSIS ENDPOINTS ====================
-
-@app.post("/api/health/ai-analysis")
-async def ai_health_analysis(health_data: dict, request: Request):
-    """Generate comprehensive AI health analysis"""
-    user_id = get_current_user_id(request)
-    
-    try:
-        prompt = f"""You are an expert integrative health advisor with deep knowledge of Western medicine, Ayurveda, 
-Traditional Chinese Medicine, Clinical Nutrition, Herbal Medicine, and evidence-based supplement therapy. 
-Analyze the following health data and provide a comprehensive, personalized health assessment.
-
-PATIENT PROFILE:
+def _format_posted_health_data(health_data):
+    """Format a client-posted health_data payload for the analysis prompt"""
+    return f"""PATIENT PROFILE:
 - Name: {health_data.get('personal', {}).get('name', 'User')}
 - Age: {health_data.get('personal', {}).get('age', 'Not provided')}
 - Sex: {health_data.get('personal', {}).get('sex', 'Not provided')}
@@ -1935,56 +2170,139 @@ Blood Pressure Trend: {_format_metric_trend(health_data.get('metrics', {}).get('
 Blood Sugar Trend: {_format_metric_trend(health_data.get('metrics', {}).get('blood_sugar', []))}
 
 RECENT LAB RESULTS:
-{_format_lab_results(health_data.get('lab_results', []))}
-
-Please provide a comprehensive health analysis with the following sections:
-
-1. **Overall Health Assessment**: General health status and key observations
-2. **Lab Results Analysis**: Interpretation of recent lab values, highlighting abnormalities
-3. **Metrics Trends**: Analysis of weight, blood pressure, blood sugar trends
-4. **Medication Review**: Assessment of current medications and potential interactions
-5. **Integrative Recommendations**: Combine insights from multiple healing traditions
-6. **Lifestyle Suggestions**: Diet, exercise, sleep, stress management recommendations
-7. **Western Medicine Perspective**: Evidence-based medical insights
-8. **Clinical Nutrition**: Specific nutritional therapy recommendations
-9. **Herbal Medicine**: Evidence-based herbal remedies
-10. **Supplement Recommendations**: Specific supplements with dosages
-11. **Ayurvedic Perspective**: Recommendations based on dosha (if applicable)
-12. **TCM Perspective**: Recommendations based on pattern (if applicable)
-13. **Action Items**: Specific, actionable steps
-
-Use markdown formatting. Be compassionate, clear, and actionable."""
-
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        
-        # Always load Functional Medicine for comprehensive analysis
-        specialized = get_specialized_knowledge("functional medicine comprehensive health analysis")
-        final_prompt = SYSTEM_PROMPT_WITH_WESTERN_MED + specialized
-        
-        # Enable prompt caching
-        api_params = {
-            "model": "claude-sonnet-4-20250514",
-            "max_tokens": 4000,
-            "system": [
-                {
-                    "type": "text",
-                    "text": final_prompt,
-                    "cache_control": {"type": "ephemeral"}
-                }
-            ],
-            "messages": [{"role": "user", "content": prompt}]
-        }
+{_format_lab_results(health_data.get('lab_results', []))}"""
+
+def _parse_analysis_sections(analysis_text):
+    """Parse Claude's response into structured sections"""
+    return parse_sections(analysis_text, AI_ANALYSIS_SECTIONS)
+
+# ==================== AI HEALTH ANALYSIS ENDPOINTS ====================
+
+@app.post("/api/health/ai-analysis")
+async def ai_health_analysis(health_data: dict, request: Request, force: bool = False, fanout: bool = False):
+    """
+    Generate comprehensive AI health analysis.
+    
+    The last analysis generated from identical inputs is returned with
+    cached: true instead of regenerating; pass ?force=true to regenerate.
+    With ?fanout=true the section groups are generated as separate requests;
+    if one fails after the first, the other sections are still returned, the
+    failed groups are listed in failed_groups, and nothing is stored.
+    """
+    user_id = get_current_user_id(request)
+    
+    try:
+        patient_context = _analysis_patient_context(health_data, user_id)
+        fingerprint = health_context.analysis_fingerprint(patient_context, AI_ANALYSIS_MODEL)
+        
+        if not (force or health_data.get('force')):
+            stored = _find_stored_analysis(user_id, fingerprint)
+            if stored:
+                analysis_id, sections = stored
+                sections.update({'cached': True, 'fingerprint': fingerprint, 'analysis_id': analysis_id})
+                return JSONResponse(content=sections)
+        
+        tier = get_user_tier(user_id)
+        system = _analysis_system_prompt()
+        
+        failed_groups = []
+        if fanout or health_data.get('fanout') or AI_ANALYSIS_FANOUT:
+            sections, failed_groups = await _generate_analysis_fanout(system, patient_context, tier)
+        else:
+            api_params = {
+                "model": AI_ANALYSIS_MODEL,
+                "max_tokens": 4000,
+                "system": system,
+                "messages": [{"role": "user", "content": _analysis_preamble(patient_context) + "\n\n" + _analysis_instructions(list(AI_ANALYSIS_SECTIONS))}]
+            }
+            
+            message = await llm_client.create_message(api_params, tier=tier, endpoint='ai_analysis')
+            
+            analysis_text = message.content[0].text
+            sections = _parse_analysis_sections(analysis_text)
         
-        message = client.messages.create(**api_params)
+        if failed_groups:
+            # Partial - return what was written, but don't store it as the answer for these inputs
+            sections.update({'cached': False, 'fingerprint': fingerprint, 'analysis_id': None, 'failed_groups': failed_groups})
+            return JSONResponse(content=sections)
         
-        analysis_text = message.content[0].text
-        sections = _parse_analysis_sections(analysis_text)
+        analysis_id = _store_analysis(user_id, sections, fingerprint)
         
+        sections.update({'cached': False, 'fingerprint': fingerprint, 'analysis_id': analysis_id})
         return JSONResponse(content=sections)
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ AI analysis error: {str(e)}")
+        logger.error(f"❌ AI analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail="AI analysis failed")
+
+@app.post("/api/health/ai-analysis/stream")
+async def ai_health_analysis_stream(health_data: dict, request: Request, force: bool = False):
+    """
+    Server-sent events version of /api/health/ai-analysis.
+    
+    Emits a 'section' event ({"section", "content"}) as soon as each section
+    of the completion is finished, then a 'done' event with the fingerprint
+    and analysis_id. A stored analysis for the same inputs is replayed as
+    section events with cached: true on 'done'.
+    """
+    user_id = get_current_user_id(request)
+    
+    try:
+        patient_context = _analysis_patient_context(health_data, user_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ AI analysis context error: {str(e)}")
+        raise HTTPException(status_code=500, detail="AI analysis failed")
+    
+    fingerprint = health_context.analysis_fingerprint(patient_context, AI_ANALYSIS_MODEL)
+    stored = None if (force or health_data.get('force')) else _find_stored_analysis(user_id, fingerprint)
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    def replay_stored():
+        analysis_id, sections = stored
+        for key in AI_ANALYSIS_SECTIONS:
+            yield sse("section", {"section": key, "content": sections.get(key, "")})
+        yield sse("done", {"cached": True, "fingerprint": fingerprint, "analysis_id": analysis_id})
+    
+    if not stored:
+        tier = get_user_tier(user_id)
+        # Saturated queue gets a real 429 before the stream starts
+        llm_scheduler.check_admission(tier)
+    
+    async def generate():
+        parser = StreamingSectionParser()
+        try:
+            async for delta in llm_client.stream_text({
+                "model": AI_ANALYSIS_MODEL,
+                "max_tokens": 4000,
+                "system": _analysis_system_prompt(),
+                "messages": [{"role": "user", "content": _analysis_preamble(patient_context) + "\n\n" + _analysis_instructions(list(AI_ANALYSIS_SECTIONS))}]
+            }, tier=tier, endpoint='ai_analysis'):
+                for event in parser.feed(delta):
+                    yield sse("section", {"section": event['section'], "content": event['content']})
+            for event in parser.finish():
+                yield sse("section", {"section": event['section'], "content": event['content']})
+        except LLMOverloaded as e:
+            yield sse("error", {"detail": e.detail, "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            logger.error(f"❌ AI analysis stream error: {str(e)}")
+            yield sse("error", {"detail": "AI analysis failed"})
+            return
+        
+        analysis_id = await asyncio.to_thread(_store_analysis, user_id, dict(parser.sections), fingerprint)
+        yield sse("done", {"cached": False, "fingerprint": fingerprint, "analysis_id": analysis_id})
+    
+    return StreamingResponse(
+        replay_stored() if stored else generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 @app.post("/api/health/explain-value")
 async def explain_lab_value(request_data: dict, request: Request):
     """Get AI explanation for a specific lab value"""
@@ -1997,21 +2315,75 @@ async def explain_lab_value(request_data: dict, request: Request):
         reference_range = request_data.get('reference_range')
         user_data = request_data.get('user_data', {})
         
+        # The prompt is built from the canonical, de-identified request so the cached
+        # narrative is valid for every request that maps to the same key; only the
+        # reference range is shown as written (the key holds its parsed bounds)
+        canonical = explain_cache.canonicalize_request(value_name, value, unit, reference_range, user_data)
+        
+        # Normal/high/low is decided locally, from the same rounded value the
+        # cache key holds, so a cached narrative never contradicts the status;
+        # the model only writes the narrative
+        flag = flag_value(canonical['value'], reference_range)
+        
+        if flag['status'] == 'normal' and not request_data.get('detailed'):
+            return JSONResponse(content={
+                "explanation": (
+                    f"Your {value_name} result of {value} {unit or ''} is within the reference range "
+                    f"({reference_range}). Nothing in this value on its own suggests a problem - "
+                    f"review it with your healthcare provider alongside your other results."
+                ),
+                "value_name": value_name,
+                "value": value,
+                "unit": unit,
+                "reference_range": reference_range,
+                "status": flag['status'],
+                "deviation_pct": flag['deviation_pct'],
+                "source": "reference_range"
+            })
+        
+        if flag['status'] in ('high', 'low'):
+            status_line = f"{flag['status'].upper()}"
+            if flag['deviation_pct'] is not None:
+                status_line += f" ({abs(flag['deviation_pct'])}% {'above' if flag['status'] == 'high' else 'below'} the reference limit)"
+        elif flag['status'] == 'abnormal':
+            status_line = "ABNORMAL (does not match the expected result)"
+        elif flag['status'] == 'normal':
+            status_line = "NORMAL (within the reference range)"
+        else:
+            status_line = "Could not be determined automatically - assess from the range"
+        canonical['status'] = status_line
+        
+        cache_key = explain_cache.cache_key(canonical)
+        cached_explanation = await explain_cache.get_explanation(cache_key)
+        if cached_explanation is not None:
+            return JSONResponse(content={
+                "explanation": cached_explanation,
+                "value_name": value_name,
+                "value": value,
+                "unit": unit,
+                "reference_range": reference_range,
+                "status": flag['status'],
+                "deviation_pct": flag['deviation_pct'],
+                "source": "ai",
+                "cached": True
+            })
+        
         prompt = f"""Explain the following lab value in a clear, compassionate way:
 
-Test: {value_name}
-Patient's Value: {value} {unit}
+Test: {canonical['analyte']}
+Patient's Value: {canonical['value']} {canonical['unit']}
 Reference Range: {reference_range}
+Status: {status_line}
 
 Patient Context:
-- Age: {user_data.get('age', 'Not provided')}
-- Sex: {user_data.get('sex', 'Not provided')}
-- Current Conditions: {', '.join(user_data.get('conditions', [])) or 'None reported'}
-- Current Medications: {len(user_data.get('medications', []))} medications
+- Age: {canonical['age_band']}
+- Sex: {canonical['sex']}
+- Current Conditions: {', '.join(canonical['conditions']) or 'None reported'}
+- Current Medications: {canonical['medications']}
 
 Please explain:
 1. What this test measures
-2. What the value means (is it normal, high, or low?)
+2. What the value means given its status above
 3. Possible causes if abnormal
 4. Health implications
 5. Lifestyle factors that may affect it
@@ -2021,8 +2393,6 @@ Please explain:
 
 Use simple language that a non-medical person can understand."""
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        
         # Load functional medicine for lab analysis
         specialized = get_specialized_knowledge(f"{value_name} lab test functional medicine")
         final_prompt = SYSTEM_PROMPT_WITH_WESTERN_MED + specialized
@@ -2041,20 +2411,27 @@ Use simple language that a non-medical person can understand."""
             "messages": [{"role": "user", "content": prompt}]
         }
         
-        message = client.messages.create(**api_params)
+        message = await llm_client.create_message(api_params, tier=get_user_tier(user_id), endpoint='explain_value')
         
         explanation = message.content[0].text
+        await explain_cache.store_explanation(cache_key, explanation)
         
         return JSONResponse(content={
             "explanation": explanation,
             "value_name": value_name,
             "value": value,
             "unit": unit,
-            "reference_range": reference_range
+            "reference_range": reference_range,
+            "status": flag['status'],
+            "deviation_pct": flag['deviation_pct'],
+            "source": "ai",
+            "cached": False
         })
     
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"❌ Value explanation error: {str(e)}")
+        logger.error(f"❌ Value explanation error: {str(e)}")
         raise HTTPException(status_code=500, detail="Explanation failed")
 
 # ==================== LAB RESULTS UPLOAD ENDPOINT ====================
@@ -2076,20 +2453,13 @@ async def upload_lab_result(
             detail=f"Invalid file type '{file.content_type}'. Please upload JPG, PNG, or PDF only."
         )
     
-    file_content = await file.read()
-    
-    max_size = 10 * 1024 * 1024
-    if len(file_content) > max_size:
-        raise HTTPException(
-            status_code=400,
-            detail="File too large. Maximum size is 10MB."
-        )
+    # The body was capped while it was received (UploadLimitMiddleware);
+    # this checks the file itself, in chunks, without copying it
+    upload = await spool_upload(file, LAB_UPLOAD_MAX_BYTES, LAB_UPLOAD_TOO_LARGE)
     
-    print(f"📄 Processing lab results upload: {file.filename} ({len(file_content)} bytes)")
+    logger.info("📄 Processing lab results upload", extra={'content_type': file.content_type, 'size_bytes': upload.size})
     
     try:
-        base64_content = base64.b64encode(file_content).decode('utf-8')
-        
         media_type = file.content_type
         if file.filename.lower().endswith('.pdf'):
             media_type = "application/pdf"
@@ -2098,7 +2468,18 @@ async def upload_lab_result(
         elif file.filename.lower().endswith('.png'):
             media_type = "image/png"
         
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+        # Phone photos of lab reports are often 4-10MB; shrink them to what the model can use
+        image_stats = None
+        if media_type == "application/pdf":
+            base64_content = await asyncio.to_thread(upload.b64encode)
+        else:
+            try:
+                # CPU-bound (decode, EXIF transpose, resize, quality ladder) - run it in a thread
+                image_bytes, media_type, image_stats = await asyncio.to_thread(preprocess_image, upload.file)
+            except ImageProcessingError as e:
+                raise HTTPException(status_code=400, detail=f"Could not read image: {e}")
+            base64_content = base64.b64encode(image_bytes).decode('utf-8')
+        upload.close()
         
         if media_type == "application/pdf":
             content_block = {
@@ -2162,21 +2543,23 @@ Now extract all lab values from this document:"""
             }]
         }
         
+        tier = get_user_tier(user_id)
         if ANTHROPIC_PROJECT_ID:
             try:
                 api_params["project_id"] = ANTHROPIC_PROJECT_ID
-                message = client.messages.create(**api_params)
+                message = await llm_client.create_message(api_params, tier=tier, endpoint='lab_extraction')
             except TypeError as e:
                 if "project_id" in str(e):
                     del api_params["project_id"]
-                    message = client.messages.create(**api_params)
+                    message = await llm_client.create_message(api_params, tier=tier, endpoint='lab_extraction')
                 else:
                     raise
         else:
-            message = client.messages.create(**api_params)
+            message = await llm_client.create_message(api_params, tier=tier, endpoint='lab_extraction')
         
         response_text = message.content[0].text
-        print(f"🤖 Raw AI Response:\n{response_text}\n")
+        # Never log the extracted text itself - it is the patient's lab report
+        logger.debug("🤖 Lab extraction response received", extra={'response_chars': len(response_text)})
         
         if '```json' in response_text:
             response_text = response_text.split('```json')[1].split('```')[0]
@@ -2188,7 +2571,7 @@ Now extract all lab values from this document:"""
         try:
             extracted_data = json.loads(response_text)
         except json.JSONDecodeError as e:
-            print(f"❌ JSON Parse Error: {e}")
+            logger.error(f"❌ JSON Parse Error: {e}")
             raise HTTPException(
                 status_code=500,
                 detail="Failed to parse extracted data. Please try uploading a clearer image."
@@ -2217,15 +2600,18 @@ Now extract all lab values from this document:"""
                 }
                 validated_results.append(validated_result)
         
-        extracted_data['results'] = validated_results
+        extracted_data['results'] = canonicalize_results(flag_results(validated_results))
         extracted_data['provider'] = provider
         extracted_data['test_date'] = test_date
         extracted_data['file_url'] = f"uploaded/{file.filename}"
+        extracted_data['file_sha256'] = upload.sha256
+        if image_stats:
+            extracted_data['image_preprocessing'] = image_stats
         
         if 'test_type' not in extracted_data or not extracted_data['test_type']:
             extracted_data['test_type'] = 'Lab Results'
         
-        print(f"✅ Successfully extracted {len(validated_results)} lab values")
+        logger.info(f"✅ Successfully extracted {len(validated_results)} lab values")
         
         return extracted_data
     
@@ -2233,57 +2619,45 @@ Now extract all lab values from this document:"""
         raise
     
     except Exception as e:
-        print(f"❌ Lab extraction error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Lab extraction error")
         raise HTTPException(
             status_code=500,
             detail=f"Failed to process lab results: {str(e)}"
         )
+    
+    finally:
+        upload.close()
 
 @app.post("/api/lab-results/save")
 async def save_lab_results(request: Request):
     user_id = get_current_user_id(request)
     data = await request.json()
     
+    results = canonicalize_results(flag_results(data.get('results', [])))
+    
+    # lab_results / lab_values tables are created by run_migrations()
     with engine.connect() as conn:
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS lab_results (
-                id SERIAL PRIMARY KEY,
-                user_id UUID NOT NULL,
-                test_type VARCHAR(255),
-                test_date DATE,
-                provider VARCHAR(255),
-                file_url TEXT,
-                results JSONB,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """))
-        conn.commit()
-        
-        try:
-            conn.execute(text("""
-                ALTER TABLE lab_results 
-                ADD COLUMN IF NOT EXISTS file_url TEXT
-            """))
-            conn.commit()
-        except Exception as e:
-            print(f"⚠️ Column add note: {e}")
-        
-        conn.execute(text("""
+        lab_result_id = conn.execute(text("""
             INSERT INTO lab_results (user_id, test_type, test_date, provider, file_url, results)
             VALUES (:user_id, :test_type, :test_date, :provider, :file_url, :results)
+            RETURNING id
         """), {
             'user_id': str(user_id),
             'test_type': data.get('test_type'),
             'test_date': data.get('test_date'),
             'provider': data.get('provider'),
             'file_url': data.get('file_url'),
-            'results': json.dumps(data.get('results', []))
-        })
+            'results': json.dumps(results)
+        }).scalar()
+        
+        # Same transaction, so the normalized rows never drift from the JSONB copy
+        lab_values.insert_lab_values(
+            conn,
+            lab_values.build_lab_value_rows(lab_result_id, user_id, data.get('test_date'), results)
+        )
         conn.commit()
     
-    return {"success": True}
+    return {"success": True, "id": lab_result_id}
 
 @app.get("/api/lab-results")
 async def get_lab_results(request: Request):
@@ -2297,14 +2671,38 @@ async def get_lab_results(request: Request):
             ORDER BY test_date DESC
         """), {'user_id': str(user_id)})
         
-        return [{
-            'id': row[0],
-            'test_type': row[1],
-            'test_date': row[2].isoformat() if row[2] else None,
-            'provider': row[3],
-            'results': row[4] if isinstance(row[4], list) else json.loads(row[4]) if row[4] else [],
-            'created_at': row[5].isoformat() if row[5] else None
-        } for row in results]
+        lab_results = []
+        for row in results:
+            values = flag_results(row[4] if isinstance(row[4], list) else json.loads(row[4]) if row[4] else [])
+            lab_results.append({
+                'id': row[0],
+                'test_type': row[1],
+                'test_date': row[2].isoformat() if row[2] else None,
+                'provider': row[3],
+                'results': values,
+                'abnormal_count': len(abnormal_results(values)),
+                'created_at': row[5].isoformat() if row[5] else None
+            })
+        
+        return lab_results
+
+@app.get("/api/lab-results/trends/{analyte}")
+async def get_lab_trend(request: Request, analyte: str, since: Optional[date] = None):
+    """Time series for a single analyte across all of the user's lab results"""
+    user_id = get_current_user_id(request)
+    key = lab_values.analyte_key(analyte)
+    
+    with engine.connect() as conn:
+        points = lab_values.get_trend(conn, user_id, key, since)
+    
+    canonical = ANALYTES.get(key)
+    return {
+        "analyte": key,
+        "name": canonical['name'] if canonical else analyte,
+        "unit": canonical['unit'] if canonical else None,
+        "count": len(points),
+        "points": points
+    }
 
 @app.delete("/api/lab-results/{result_id}")
 async def delete_lab_result(request: Request, result_id: int):
@@ -2675,7 +3073,7 @@ async def remove_client_protocol(client_id: int, request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error removing protocol: {e}")
+        logger.error(f"❌ Error removing protocol: {e}")
         raise HTTPException(status_code=500, detail=str(e)) 
         
 @app.post("/api/client-protocols/{assignment_id}/advance-week")
@@ -3297,7 +3695,7 @@ async def delete_client_message(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error deleting message: {e}")
+        logger.error(f"Error deleting message: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete message: {str(e)}")
     
 # ==================== PRO DASHBOARD ENDPOINTS ====================
@@ -3541,6 +3939,7 @@ async def admin_activate_subscription(request: Request):
                 user.family_member_limit = 0
             
             db.commit()
+            account_cache.invalidate(user.id)
             
             return {
                 "success": True,
@@ -3555,7 +3954,7 @@ async def admin_activate_subscription(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Admin activation error: {e}")
+        logger.error(f"❌ Admin activation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -3583,6 +3982,7 @@ async def admin_deactivate_subscription(request: Request):
             user.family_member_limit = 0
             
             db.commit()
+            account_cache.invalidate(user.id)
             
             return {
                 "success": True,
@@ -3596,7 +3996,7 @@ async def admin_deactivate_subscription(request: Request):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Admin deactivation error: {e}")
+        logger.error(f"❌ Admin deactivation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/admin/delete-user")
@@ -3630,7 +4030,7 @@ async def delete_user(data: dict):
         
         db.commit()
         
-        print(f"🗑️ DELETED USER: {email} (ID: {user_id})")
+        logger.warning(f"🗑️ Deleted user {user_id}")
         
         return {
             "success": True,
@@ -3668,8 +4068,52 @@ async def admin_list_users(request: Request, admin_password: str):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Admin list error: {e}")
+        logger.error(f"❌ Admin list error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+@app.get("/api/admin/cache-stats")
+async def admin_cache_stats(admin_password: str):
+    """Admin endpoint for in-process cache hit/eviction metrics"""
+    if admin_password != SUBSCRIPTION_ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Invalid admin password")
+    
+    return {
+        "success": True,
+        "explain_value": explain_cache.stats(),
+        "health_context": health_context.stats(),
+        "accounts": account_cache.stats()
+    }
+
+@app.get("/api/admin/llm-stats")
+async def admin_llm_stats(admin_password: str):
+    """Admin endpoint for LLM admission queue depth and wait times per tier"""
+    if admin_password != SUBSCRIPTION_ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Invalid admin password")
+    
+    return {
+        "success": True,
+        "llm": llm_client.stats()
+    }
+
+@app.get("/api/admin/slow-queries")
+async def admin_slow_queries(admin_password: str, sort: str = 'total_ms', limit: int = 50):
+    """Admin endpoint for statements slower than SLOW_QUERY_MS, grouped by fingerprint"""
+    if admin_password != SUBSCRIPTION_ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Invalid admin password")
+    
+    return {
+        "success": True,
+        **slow_queries.report(sort=sort, limit=limit)
+    }
+
+@app.post("/api/admin/slow-queries/reset")
+async def admin_reset_slow_queries(data: dict):
+    """Admin endpoint to start a fresh slow-query window (e.g. after adding an index)"""
+    if data.get('admin_password') != SUBSCRIPTION_ADMIN_PASSWORD:
+        raise HTTPException(status_code=403, detail="Invalid admin password")
+    
+    slow_queries.reset()
+    return {"success": True}
+
 # ==================== HEALTH CHECK ====================
 
 @app.get("/")
@@ -3680,6 +4124,16 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Prometheus scrape endpoint (text exposition format)"""
+    if metrics.METRICS_TOKEN:
+        supplied = request.query_params.get('token') or request.headers.get('authorization', '').removeprefix('Bearer ')
+        if not secrets.compare_digest(supplied, metrics.METRICS_TOKEN):
+            raise HTTPException(status_code=403, detail="Invalid metrics token")
+    
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=10000)
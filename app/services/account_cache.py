@@ -0,0 +1,146 @@
+"""
+Account Cache - Subscription tier and limits per user, per request and across requests
+A chat turn used to load the User row just to read subscription_tier, and
+the LLM endpoints re-read it via get_user_tier. The handful of fields that
+gate requests (tier, family member limit) are now loaded once per request
+(kept on request.state) and cached across requests: briefly in-process, and
+for longer in Redis (REDIS_URL) when configured.
+
+Anything that changes a user's subscription must call invalidate(user_id) -
+the Stripe webhook, the admin activate/deactivate endpoints and
+database.update_user_subscription do. Other workers see the change once
+their short in-process entry expires (ACCOUNT_CACHE_LOCAL_TTL).
+
+Redis entries carry the user's version number, which invalidate() bumps. A
+request that read the database before an invalidation writes its entry
+under the old version, so readers ignore it instead of serving the old tier
+for ACCOUNT_CACHE_TTL.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from sqlalchemy import text
+
+from app.auth import get_current_user_id
+from app.services.cache import TTLCache, get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+# In-process entries are not invalidated across workers, so keep them short
+ACCOUNT_CACHE_LOCAL_TTL = float(os.getenv('ACCOUNT_CACHE_LOCAL_TTL', '10'))
+ACCOUNT_CACHE_TTL = int(os.getenv('ACCOUNT_CACHE_TTL', '300'))
+ACCOUNT_CACHE_SIZE = int(os.getenv('ACCOUNT_CACHE_SIZE', '10000'))
+
+REDIS_PREFIX = 'tol:account:'
+# No TTL: a version that expired and restarted could match an old entry again
+VERSION_PREFIX = 'tol:account-version:'
+
+_local = TTLCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_LOCAL_TTL)
+_shared = {'hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+
+def load_account(engine, user_id: str) -> Optional[Dict[str, Any]]:
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT subscription_tier, family_member_limit
+            FROM users
+            WHERE id = :user_id
+        """), {'user_id': str(user_id)}).fetchone()
+    if row is None:
+        return None
+    return {
+        'user_id': str(user_id),
+        'tier': row[0] or 'free',
+        'family_member_limit': row[1] or 0,
+    }
+
+
+def _get_shared(user_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+    """(account, current version) from Redis; the version is None when Redis is unavailable"""
+    redis_client = get_redis()
+    if redis_client is None:
+        return None, None
+    try:
+        raw, version = redis_client.mget(REDIS_PREFIX + user_id, VERSION_PREFIX + user_id)
+    except Exception as e:
+        _shared['errors'] += 1
+        mark_redis_failed(e)
+        return None, None
+    version = int(version or 0)
+    entry = json.loads(raw) if raw is not None else None
+    # Written from a read that an invalidation has since superseded
+    if not isinstance(entry, dict) or entry.get('version') != version:
+        _shared['misses'] += 1
+        return None, version
+    _shared['hits'] += 1
+    return entry['account'], version
+
+
+def _set_shared(user_id: str, account: Dict[str, Any], version: int):
+    redis_client = get_redis()
+    if redis_client is None:
+        return
+    try:
+        entry = {'version': version, 'account': account}
+        redis_client.setex(REDIS_PREFIX + user_id, ACCOUNT_CACHE_TTL, json.dumps(entry))
+        _shared['writes'] += 1
+    except Exception as e:
+        _shared['errors'] += 1
+        mark_redis_failed(e)
+
+
+def get_account(engine, user_id: str) -> Optional[Dict[str, Any]]:
+    """Tier and limits for a user (None if the user doesn't exist); L1, then Redis, then the database"""
+    user_id = str(user_id)
+    account = _local.get(user_id)
+    if account is not None:
+        return account
+
+    # The version is read before the database so a concurrent invalidation outdates this entry
+    account, version = _get_shared(user_id)
+    if account is None:
+        account = load_account(engine, user_id)
+        if account is None:
+            return None
+        if version is not None:
+            _set_shared(user_id, account, version)
+    _local.set(user_id, account)
+    return account
+
+
+def for_request(request: Request, engine) -> Dict[str, Any]:
+    """The authenticated user's account, loaded at most once per request"""
+    account = getattr(request.state, 'account', None)
+    if account is None:
+        account = get_account(engine, get_current_user_id(request))
+        if account is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        request.state.account = account
+    return account
+
+
+def invalidate(user_id: Any):
+    """Call after any change to a user's subscription fields"""
+    user_id = str(user_id)
+    _local.delete(user_id)
+    redis_client = get_redis()
+    if redis_client is None:
+        return
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(VERSION_PREFIX + user_id)
+        pipe.delete(REDIS_PREFIX + user_id)
+        pipe.execute()
+    except Exception as e:
+        _shared['errors'] += 1
+        mark_redis_failed(e)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        'local': _local.stats(),
+        'shared': dict(_shared, enabled=get_redis() is not None),
+    }
@@ -0,0 +1,139 @@
+"""
+Analysis Parser - Incremental section parser for AI health analysis output
+Consumes the completion as it streams (token deltas), recognizes section
+headers with a precompiled grammar and emits an event as soon as each
+section is complete. Only a markdown heading or a line that is bold from
+start to end can start a section - a bold label leading a bullet
+('**Nutrition**: eat leafy greens') or a numbered list item ('1. Supplements')
+is body text and stays in the section it appears in
+"""
+import re
+from typing import Dict, Iterable, List, Optional
+
+SECTION_KEYS = [
+    "overall_assessment",
+    "lab_results_analysis",
+    "metrics_trends",
+    "medication_review",
+    "integrative_recommendations",
+    "lifestyle_suggestions",
+    "western_medicine",
+    "clinical_nutrition",
+    "herbal_medicine",
+    "supplement_recommendations",
+    "ayurvedic_perspective",
+    "tcm_perspective",
+    "action_items",
+]
+
+# Where text before the first header goes (matches the legacy parser)
+DEFAULT_SECTION = "overall_assessment"
+
+# Header lines: '## Title', '## 3. **Title**', '**Title**', '**3. Title:**', '**Title**:'
+_HEADER_LINE = re.compile(
+    r'^\s{0,3}(?:'
+    r'#{1,6}\s*(?P<md>.+?)\s*#*\s*$'
+    r'|\*\*(?P<bold>[^*]{2,80}?)\s*\*\*\s*:?\s*$'
+    r')'
+)
+_TITLE_NOISE = re.compile(r'^\s*\d{1,2}[.)]\s*|[*#:()\[\]&/,-]+')
+_SPACES = re.compile(r'\s+')
+
+# Normalized title -> section; each pattern must match the whole title
+_SECTION_TITLES = [
+    ("overall_assessment", r'(overall )?(health )?(assessment|status|summary|overview)|overall health'),
+    ("lab_results_analysis", r'lab(oratory)?( results?| values?| work)?( analysis| interpretation| review)?'),
+    ("metrics_trends", r'(health )?metrics?( trends?| analysis| review)?|(health |metric )?trends?( analysis)?'),
+    ("medication_review", r'(current )?medications?( review| assessment| analysis| interactions?)?'),
+    ("integrative_recommendations", r'integrative( medicine)?( recommendations?| approach| perspective| plan)?'),
+    ("lifestyle_suggestions", r'lifestyle( suggestions?| recommendations?| modifications?| changes?)?'),
+    ("western_medicine", r'(western|conventional)( medicine| medical)?( perspective| insights?| view)?'),
+    ("clinical_nutrition", r'(clinical )?nutrition(al)?( therapy| recommendations?| plan)?|diet(ary)? recommendations?'),
+    ("herbal_medicine", r'(herbal|botanical)( medicine| remedies| recommendations?)?'),
+    ("supplement_recommendations", r'supplements?( recommendations?| protocol| plan)?|supplementation'),
+    ("ayurvedic_perspective", r'ayurved(a|ic)( medicine)?( perspective| recommendations?)?'),
+    ("tcm_perspective", r'(traditional )?(chinese medicine|tcm)( tcm)?( perspective| recommendations?| pattern)?'),
+    ("action_items", r'(key )?(action( items?| plan| steps)|next steps)'),
+]
+_SECTION_GRAMMAR = [(key, re.compile(pattern)) for key, pattern in _SECTION_TITLES]
+
+
+def _normalize_title(title: str) -> str:
+    return _SPACES.sub(' ', _TITLE_NOISE.sub(' ', title.lower())).strip()
+
+
+def match_header(line: str):
+    """
+    Return (section_key, remaining_text) when the line is a section header,
+    else None. A header line carries no body text, so remaining_text is
+    always empty; it is kept for callers that unpack the pair.
+    """
+    match = _HEADER_LINE.match(line)
+    if not match:
+        return None
+    normalized = _normalize_title(match.group('md') or match.group('bold'))
+    for key, pattern in _SECTION_GRAMMAR:
+        if pattern.fullmatch(normalized):
+            return key, ''
+    return None
+
+
+class StreamingSectionParser:
+    """
+    Feed completion deltas with feed(); each call returns the events that
+    became final, i.e. {'event': 'section', 'section': key, 'content': text}
+    for every section closed by a newly seen header. finish() flushes the
+    last section. The accumulated result is always available as .sections.
+    """
+
+    def __init__(self, section_keys: Optional[Iterable[str]] = None):
+        self.sections: Dict[str, str] = {key: "" for key in (section_keys or SECTION_KEYS)}
+        self.current = DEFAULT_SECTION if DEFAULT_SECTION in self.sections else next(iter(self.sections))
+        self._buffer = ""
+        self._finished = False
+
+    def feed(self, delta: str) -> List[Dict[str, str]]:
+        if not delta:
+            return []
+        self._buffer += delta
+        *lines, self._buffer = self._buffer.split('\n')
+        events = []
+        for line in lines:
+            event = self._consume_line(line)
+            if event:
+                events.append(event)
+        return events
+
+    def finish(self) -> List[Dict[str, str]]:
+        if self._finished:
+            return []
+        self._finished = True
+        events = []
+        if self._buffer:
+            event = self._consume_line(self._buffer)
+            self._buffer = ""
+            if event:
+                events.append(event)
+        events.append(self._section_event(self.current))
+        return events
+
+    def _consume_line(self, line: str) -> Optional[Dict[str, str]]:
+        header = match_header(line)
+        if header and header[0] in self.sections:
+            key = header[0]
+            closed = self._section_event(self.current) if key != self.current else None
+            self.current = key
+            return closed
+        self.sections[self.current] += line + "\n"
+        return None
+
+    def _section_event(self, key: str) -> Dict[str, str]:
+        return {'event': 'section', 'section': key, 'content': self.sections[key]}
+
+
+def parse_sections(analysis_text: str, section_keys: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    """Parse a complete analysis in one call"""
+    parser = StreamingSectionParser(section_keys)
+    parser.feed(analysis_text)
+    parser.finish()
+    return parser.sections
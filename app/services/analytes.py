@@ -0,0 +1,375 @@
+"""
+Analyte Dictionary - Canonical lab analyte names, aliases and unit conversions
+Extracted names vary wildly between labs ("HbA1c", "Hemoglobin A1C", "A1c")
+as do units (mg/dL vs mmol/L). Every extracted result is mapped to a
+canonical key and converted to the canonical unit so trends and comparisons
+can aggregate on the key without per-row string work
+"""
+import difflib
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from app.services.lab_reference import normalize_unit, parse_value, parse_reference_range
+
+# key: display name, canonical unit, aliases, conversions {unit: (factor, offset)}
+# canonical_value = value * factor + offset
+ANALYTES: Dict[str, Dict[str, Any]] = {
+    'glucose': {
+        'name': 'Glucose', 'unit': 'mg/dL',
+        'aliases': ['glucose', 'glucose fasting', 'fasting glucose', 'blood glucose', 'blood sugar', 'fasting blood sugar', 'fbs', 'fbg', 'glu'],
+        'conversions': {'mmol/L': (18.016, 0)},
+    },
+    'hba1c': {
+        'name': 'Hemoglobin A1c', 'unit': '%',
+        'aliases': ['hba1c', 'hemoglobin a1c', 'haemoglobin a1c', 'a1c', 'hb a1c', 'glycated hemoglobin', 'glycosylated hemoglobin', 'glycohemoglobin', 'hgb a1c'],
+        'conversions': {'mmol/mol': (0.09148, 2.152)},
+    },
+    'total_cholesterol': {
+        'name': 'Total Cholesterol', 'unit': 'mg/dL',
+        'aliases': ['cholesterol', 'total cholesterol', 'cholesterol total', 'chol', 'tc'],
+        'conversions': {'mmol/L': (38.67, 0)},
+    },
+    'ldl_cholesterol': {
+        'name': 'LDL Cholesterol', 'unit': 'mg/dL',
+        'aliases': ['ldl', 'ldl cholesterol', 'ldl c', 'ldl calculated', 'ldl cholesterol calc', 'ldl chol calc nih', 'low density lipoprotein'],
+        'conversions': {'mmol/L': (38.67, 0)},
+    },
+    'hdl_cholesterol': {
+        'name': 'HDL Cholesterol', 'unit': 'mg/dL',
+        'aliases': ['hdl', 'hdl cholesterol', 'hdl c', 'high density lipoprotein'],
+        'conversions': {'mmol/L': (38.67, 0)},
+    },
+    'triglycerides': {
+        'name': 'Triglycerides', 'unit': 'mg/dL',
+        'aliases': ['triglycerides', 'triglyceride', 'trig', 'trigs', 'tg'],
+        'conversions': {'mmol/L': (88.57, 0)},
+    },
+    'apob': {
+        'name': 'Apolipoprotein B', 'unit': 'mg/dL',
+        'aliases': ['apob', 'apo b', 'apolipoprotein b'],
+        'conversions': {'g/L': (100, 0)},
+    },
+    'creatinine': {
+        'name': 'Creatinine', 'unit': 'mg/dL',
+        'aliases': ['creatinine', 'creat', 'creatinine serum'],
+        'conversions': {'umol/L': (0.01131, 0)},
+    },
+    'bun': {
+        'name': 'Blood Urea Nitrogen', 'unit': 'mg/dL',
+        'aliases': ['bun', 'blood urea nitrogen', 'urea nitrogen', 'urea nitrogen bun'],
+        'conversions': {'mmol/L': (2.801, 0)},
+    },
+    'egfr': {
+        'name': 'eGFR', 'unit': 'mL/min/1.73m2',
+        'aliases': ['egfr', 'gfr', 'estimated gfr', 'egfr non afr american', 'egfr if nonafricn am', 'egfr african american', 'estimated glomerular filtration rate'],
+        'conversions': {},
+    },
+    'sodium': {
+        'name': 'Sodium', 'unit': 'mmol/L',
+        'aliases': ['sodium', 'na', 'sodium serum'],
+        'conversions': {'mEq/L': (1, 0)},
+    },
+    'potassium': {
+        'name': 'Potassium', 'unit': 'mmol/L',
+        'aliases': ['potassium', 'k', 'potassium serum'],
+        'conversions': {'mEq/L': (1, 0)},
+    },
+    'chloride': {
+        'name': 'Chloride', 'unit': 'mmol/L',
+        'aliases': ['chloride', 'cl'],
+        'conversions': {'mEq/L': (1, 0)},
+    },
+    'co2': {
+        'name': 'Carbon Dioxide (Bicarbonate)', 'unit': 'mmol/L',
+        'aliases': ['co2', 'carbon dioxide', 'carbon dioxide total', 'bicarbonate', 'hco3', 'total co2'],
+        'conversions': {'mEq/L': (1, 0)},
+    },
+    'calcium': {
+        'name': 'Calcium', 'unit': 'mg/dL',
+        'aliases': ['calcium', 'ca', 'calcium serum', 'calcium total'],
+        'conversions': {'mmol/L': (4.008, 0)},
+    },
+    'magnesium': {
+        'name': 'Magnesium', 'unit': 'mg/dL',
+        'aliases': ['magnesium', 'mg', 'magnesium serum', 'magnesium rbc', 'rbc magnesium'],
+        'conversions': {'mmol/L': (2.431, 0)},
+    },
+    'albumin': {
+        'name': 'Albumin', 'unit': 'g/dL',
+        'aliases': ['albumin', 'alb', 'albumin serum'],
+        'conversions': {'g/L': (0.1, 0)},
+    },
+    'total_protein': {
+        'name': 'Total Protein', 'unit': 'g/dL',
+        'aliases': ['total protein', 'protein total', 'protein'],
+        'conversions': {'g/L': (0.1, 0)},
+    },
+    'bilirubin_total': {
+        'name': 'Total Bilirubin', 'unit': 'mg/dL',
+        'aliases': ['bilirubin', 'total bilirubin', 'bilirubin total', 't bili', 'tbil'],
+        'conversions': {'umol/L': (0.05848, 0)},
+    },
+    'alt': {
+        'name': 'ALT', 'unit': 'U/L',
+        'aliases': ['alt', 'sgpt', 'alt sgpt', 'alanine aminotransferase', 'alanine transaminase'],
+        'conversions': {'IU/L': (1, 0)},
+    },
+    'ast': {
+        'name': 'AST', 'unit': 'U/L',
+        'aliases': ['ast', 'sgot', 'ast sgot', 'aspartate aminotransferase', 'aspartate transaminase'],
+        'conversions': {'IU/L': (1, 0)},
+    },
+    'alp': {
+        'name': 'Alkaline Phosphatase', 'unit': 'U/L',
+        'aliases': ['alkaline phosphatase', 'alk phos', 'alp', 'alkaline phosphatase s'],
+        'conversions': {'IU/L': (1, 0)},
+    },
+    'ggt': {
+        'name': 'GGT', 'unit': 'U/L',
+        'aliases': ['ggt', 'gamma gt', 'gamma glutamyl transferase', 'ggtp'],
+        'conversions': {'IU/L': (1, 0)},
+    },
+    'tsh': {
+        'name': 'TSH', 'unit': 'mIU/L',
+        'aliases': ['tsh', 'thyroid stimulating hormone', 'thyrotropin', 'tsh 3rd generation'],
+        'conversions': {'uIU/mL': (1, 0), 'mIU/mL': (1000, 0)},
+    },
+    'free_t4': {
+        'name': 'Free T4', 'unit': 'ng/dL',
+        'aliases': ['free t4', 't4 free', 'ft4', 'free thyroxine', 't4 free direct'],
+        'conversions': {'pmol/L': (0.0777, 0)},
+    },
+    'free_t3': {
+        'name': 'Free T3', 'unit': 'pg/mL',
+        'aliases': ['free t3', 't3 free', 'ft3', 'free triiodothyronine'],
+        'conversions': {'pmol/L': (0.651, 0)},
+    },
+    'vitamin_d': {
+        'name': 'Vitamin D, 25-Hydroxy', 'unit': 'ng/mL',
+        'aliases': ['vitamin d', 'vitamin d 25 hydroxy', 'vitamin d 25 oh', '25 oh vitamin d', '25 hydroxyvitamin d', '25 hydroxy vitamin d', 'vit d', 'vitamin d3', 'calcidiol'],
+        'conversions': {'nmol/L': (0.4006, 0)},
+    },
+    'vitamin_b12': {
+        'name': 'Vitamin B12', 'unit': 'pg/mL',
+        'aliases': ['vitamin b12', 'b12', 'vit b12', 'cobalamin', 'cyanocobalamin'],
+        'conversions': {'pmol/L': (1.355, 0)},
+    },
+    'folate': {
+        'name': 'Folate', 'unit': 'ng/mL',
+        'aliases': ['folate', 'folic acid', 'folate serum'],
+        'conversions': {'nmol/L': (0.4413, 0)},
+    },
+    'ferritin': {
+        'name': 'Ferritin', 'unit': 'ng/mL',
+        'aliases': ['ferritin', 'ferritin serum'],
+        'conversions': {'ug/L': (1, 0)},
+    },
+    'iron': {
+        'name': 'Iron', 'unit': 'ug/dL',
+        'aliases': ['iron', 'iron serum', 'serum iron', 'fe'],
+        'conversions': {'umol/L': (5.585, 0)},
+    },
+    'hemoglobin': {
+        'name': 'Hemoglobin', 'unit': 'g/dL',
+        'aliases': ['hemoglobin', 'haemoglobin', 'hgb', 'hb'],
+        'conversions': {'g/L': (0.1, 0)},
+    },
+    'hematocrit': {
+        'name': 'Hematocrit', 'unit': '%',
+        'aliases': ['hematocrit', 'haematocrit', 'hct', 'pcv'],
+        'conversions': {},
+    },
+    'wbc': {
+        'name': 'White Blood Cells', 'unit': 'K/uL',
+        'aliases': ['wbc', 'white blood cells', 'white blood cell count', 'white cell count', 'leukocytes', 'wbc count'],
+        'conversions': {'10^9/L': (1, 0)},
+    },
+    'rbc': {
+        'name': 'Red Blood Cells', 'unit': 'M/uL',
+        'aliases': ['rbc', 'red blood cells', 'red blood cell count', 'red cell count', 'erythrocytes', 'rbc count'],
+        'conversions': {'10^12/L': (1, 0)},
+    },
+    'platelets': {
+        'name': 'Platelets', 'unit': 'K/uL',
+        'aliases': ['platelets', 'platelet count', 'plt', 'thrombocytes'],
+        'conversions': {'10^9/L': (1, 0)},
+    },
+    'mcv': {
+        'name': 'MCV', 'unit': 'fL',
+        'aliases': ['mcv', 'mean corpuscular volume', 'mean cell volume'],
+        'conversions': {},
+    },
+    'mch': {
+        'name': 'MCH', 'unit': 'pg',
+        'aliases': ['mch', 'mean corpuscular hemoglobin', 'mean cell hemoglobin'],
+        'conversions': {},
+    },
+    'mchc': {
+        'name': 'MCHC', 'unit': 'g/dL',
+        'aliases': ['mchc', 'mean corpuscular hemoglobin concentration'],
+        'conversions': {'g/L': (0.1, 0)},
+    },
+    'crp': {
+        'name': 'C-Reactive Protein', 'unit': 'mg/L',
+        'aliases': ['crp', 'c reactive protein', 'c-reactive protein'],
+        'conversions': {'mg/dL': (10, 0)},
+    },
+    'hs_crp': {
+        'name': 'hs-CRP', 'unit': 'mg/L',
+        'aliases': ['hs crp', 'hscrp', 'high sensitivity crp', 'crp high sensitivity', 'c reactive protein cardiac', 'cardio crp'],
+        'conversions': {'mg/dL': (10, 0)},
+    },
+    'homocysteine': {
+        'name': 'Homocysteine', 'unit': 'umol/L',
+        'aliases': ['homocysteine', 'homocysteine plasma', 'hcy'],
+        'conversions': {},
+    },
+    'insulin': {
+        'name': 'Insulin', 'unit': 'uIU/mL',
+        'aliases': ['insulin', 'fasting insulin', 'insulin fasting'],
+        'conversions': {'pmol/L': (0.144, 0), 'mIU/L': (1, 0)},
+    },
+    'uric_acid': {
+        'name': 'Uric Acid', 'unit': 'mg/dL',
+        'aliases': ['uric acid', 'urate'],
+        'conversions': {'umol/L': (0.01681, 0)},
+    },
+    'testosterone_total': {
+        'name': 'Total Testosterone', 'unit': 'ng/dL',
+        'aliases': ['testosterone', 'total testosterone', 'testosterone total', 'testosterone serum'],
+        'conversions': {'nmol/L': (28.84, 0)},
+    },
+    'estradiol': {
+        'name': 'Estradiol', 'unit': 'pg/mL',
+        'aliases': ['estradiol', 'e2', 'oestradiol'],
+        'conversions': {'pmol/L': (0.2724, 0)},
+    },
+    'cortisol': {
+        'name': 'Cortisol', 'unit': 'ug/dL',
+        'aliases': ['cortisol', 'cortisol am', 'morning cortisol', 'cortisol serum'],
+        'conversions': {'nmol/L': (0.03625, 0)},
+    },
+    'dhea_s': {
+        'name': 'DHEA-S', 'unit': 'ug/dL',
+        'aliases': ['dhea s', 'dhea sulfate', 'dheas', 'dehydroepiandrosterone sulfate'],
+        'conversions': {'umol/L': (36.81, 0)},
+    },
+    'psa': {
+        'name': 'PSA', 'unit': 'ng/mL',
+        'aliases': ['psa', 'prostate specific antigen', 'psa total'],
+        'conversions': {'ug/L': (1, 0)},
+    },
+    'esr': {
+        'name': 'ESR', 'unit': 'mm/hr',
+        'aliases': ['esr', 'sed rate', 'sedimentation rate', 'erythrocyte sedimentation rate'],
+        'conversions': {},
+    },
+}
+
+# Words that never distinguish one analyte from another
+_NOISE_WORDS = {'serum', 'plasma', 'blood', 'level', 'levels', 'whole', 'result', 'test'}
+_PARENTHETICAL = re.compile(r'\([^)]*\)')
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+FUZZY_CUTOFF = 0.88
+
+
+def _normalize_name(name: str) -> str:
+    return _NON_ALNUM.sub(' ', name.lower()).strip()
+
+
+def _strip_noise(normalized: str) -> str:
+    return ' '.join(word for word in normalized.split() if word not in _NOISE_WORDS)
+
+
+def _build_alias_map() -> Dict[str, str]:
+    alias_map = {}
+    for key, info in ANALYTES.items():
+        for alias in [key.replace('_', ' '), info['name']] + info['aliases']:
+            alias_map.setdefault(_normalize_name(alias), key)
+    return alias_map
+
+
+# Built once at import: normalized alias -> canonical key
+ALIAS_MAP = _build_alias_map()
+_ALIAS_NAMES = list(ALIAS_MAP)
+
+
+@lru_cache(maxsize=8192)
+def match_analyte(name: Optional[str]) -> Optional[str]:
+    """
+    Resolve an extracted test name to a canonical analyte key.
+
+    Exact alias lookup first, then the same with parentheticals and noise
+    words removed, then a difflib fuzzy match. Returns None when nothing
+    is close enough.
+    """
+    if not name:
+        return None
+
+    normalized = _normalize_name(name)
+    key = ALIAS_MAP.get(normalized)
+    if key:
+        return key
+
+    stripped = _strip_noise(_normalize_name(_PARENTHETICAL.sub(' ', name)))
+    key = ALIAS_MAP.get(stripped)
+    if key:
+        return key
+
+    candidate = stripped or normalized
+    # Very short names ('k', 'na') only match exactly - fuzzy hits would be noise
+    if len(candidate) < 4:
+        return None
+    # Only accept typo-level differences: an extra word ('Non-HDL', '1,25-Dihydroxy')
+    # usually names a different analyte
+    words = len(candidate.split())
+    for alias in difflib.get_close_matches(candidate, _ALIAS_NAMES, n=3, cutoff=FUZZY_CUTOFF):
+        if len(alias.split()) == words:
+            return ALIAS_MAP[alias]
+    return None
+
+
+def convert(value: Optional[float], unit: str, key: str) -> Optional[float]:
+    """Convert a value in `unit` to the analyte's canonical unit (None if unknown)"""
+    if value is None:
+        return None
+    info = ANALYTES[key]
+    unit = normalize_unit(unit)
+    if not unit or unit == info['unit']:
+        return value
+    conversion = info['conversions'].get(unit)
+    if not conversion:
+        return None
+    factor, offset = conversion
+    return round(value * factor + offset, 4)
+
+
+def canonicalize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a copy of an extracted result with analyte_key, canonical_name,
+    canonical_value, canonical_unit and canonical ref bounds added. Unknown
+    analytes keep analyte_key None; unconvertible units keep canonical_value None.
+    """
+    entry = dict(result)
+    key = match_analyte(entry.get('name'))
+    entry['analyte_key'] = key
+    if not key:
+        return entry
+
+    info = ANALYTES[key]
+    unit = entry.get('unit') or ''
+    number, qualifier = parse_value(entry.get('value'))
+    _, low, high, _ = parse_reference_range(entry.get('reference_range'))
+
+    canonical_value = convert(number, unit, key)
+    entry['canonical_name'] = info['name']
+    entry['canonical_unit'] = info['unit'] if canonical_value is not None else None
+    entry['canonical_value'] = canonical_value
+    entry['canonical_ref_low'] = convert(low, unit, key) if canonical_value is not None else None
+    entry['canonical_ref_high'] = convert(high, unit, key) if canonical_value is not None else None
+    return entry
+
+
+def canonicalize_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [canonicalize_result(r) for r in results or [] if isinstance(r, dict)]
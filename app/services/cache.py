@@ -0,0 +1,123 @@
+"""
+Cache Service - In-process LRU/TTL cache and shared Redis backend
+The LRU is per worker; Redis (REDIS_URL) is shared across workers and is
+optional - every caller must work when get_redis() returns None
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv('REDIS_URL')
+# Shared-cache calls sit on the request path, so fail fast rather than wait
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.1'))
+# After a Redis error, skip it for this long instead of timing out per request
+REDIS_RETRY_AFTER = 30.0
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss/eviction counters"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = (value, expires_at)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+_redis_client = None
+_redis_disabled_until = 0.0
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Shared Redis client, or None when REDIS_URL is unset, the redis package
+    is missing, or Redis failed recently.
+    """
+    global _redis_client
+
+    if not REDIS_URL or time.monotonic() < _redis_disabled_until:
+        return None
+
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                try:
+                    import redis
+                except ImportError:
+                    logger.warning("REDIS_URL is set but the redis package is not installed")
+                    return None
+                _redis_client = redis.Redis.from_url(
+                    REDIS_URL,
+                    socket_timeout=REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                )
+    return _redis_client
+
+
+def mark_redis_failed(error: Exception):
+    """Back off from Redis for REDIS_RETRY_AFTER seconds after an error"""
+    global _redis_disabled_until
+    _redis_disabled_until = time.monotonic() + REDIS_RETRY_AFTER
+    logger.warning(f"Redis unavailable, using in-process cache only for {REDIS_RETRY_AFTER:.0f}s: {error}")
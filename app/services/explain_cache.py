@@ -0,0 +1,173 @@
+"""
+Explain Cache - Two-tier cache for /api/health/explain-value
+Requests are canonicalized and de-identified (analyte, rounded value, unit,
+range, age band, sex, conditions, medication-count band, prompt version) so
+the same explanation can be served to every user with an equivalent request.
+Redis calls run in a worker thread so a slow Redis never blocks the event loop
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, Optional
+
+from app.services.cache import TTLCache, get_redis, mark_redis_failed
+from app.services.lab_reference import canonical_range, normalize_unit, parse_value
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the explain prompt changes so stale narratives are never served
+EXPLAIN_PROMPT_VERSION = os.getenv('EXPLAIN_PROMPT_VERSION', 'explain-v2')
+EXPLAIN_CACHE_TTL = int(os.getenv('EXPLAIN_CACHE_TTL', str(7 * 24 * 3600)))  # 7 days
+EXPLAIN_CACHE_SIZE = int(os.getenv('EXPLAIN_CACHE_SIZE', '2048'))
+
+REDIS_PREFIX = 'tol:explain:'
+
+_local = TTLCache(maxsize=EXPLAIN_CACHE_SIZE, ttl=EXPLAIN_CACHE_TTL)
+_shared = {'hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+
+_NON_WORD = re.compile(r'[^a-z0-9%/.<>=-]+')
+
+
+def _normalize_text(value: Any) -> str:
+    return _NON_WORD.sub(' ', str(value or '').lower()).strip()
+
+
+def _round_value(value: Any) -> str:
+    """3 significant figures - lab precision rarely exceeds it"""
+    number, qualifier = parse_value(value)
+    if number is None:
+        return qualifier or ''
+    rounded = float(f"{number:.3g}")
+    text = format(rounded, 'f').rstrip('0').rstrip('.') or '0'
+    return f"{qualifier}{text}" if qualifier in ('<', '>') else text
+
+
+def _age_band(age: Any) -> str:
+    try:
+        age = int(float(age))
+    except (TypeError, ValueError):
+        return 'Not provided'
+    if age < 18:
+        return 'under 18'
+    decade = min(age // 10 * 10, 80)
+    return '80+' if decade == 80 else f"{decade}-{decade + 9}"
+
+
+def _sex(sex: Any) -> str:
+    sex = str(sex or '').strip().lower()
+    if sex[:1] in ('f', 'w'):
+        return 'Female'
+    if sex[:1] == 'm':
+        return 'Male'
+    return 'Not provided'
+
+
+def _medication_band(medications: Any) -> str:
+    count = len(medications) if isinstance(medications, list) else 0
+    if count == 0:
+        return 'none'
+    if count <= 2:
+        return '1-2'
+    if count <= 5:
+        return '3-5'
+    return '6+'
+
+
+def canonicalize_request(
+    value_name: Any,
+    value: Any,
+    unit: Any,
+    reference_range: Any,
+    user_data: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    Reduce an explain-value request to its de-identified, canonical form.
+    The prompt is built from this, not from the raw request, so a cached
+    answer is valid for every request that maps to the same key.
+    """
+    user_data = user_data or {}
+    conditions = user_data.get('conditions') or []
+    if not isinstance(conditions, list):
+        conditions = [conditions]
+
+    return {
+        'analyte': _normalize_text(value_name),
+        'value': _round_value(value),
+        'unit': normalize_unit(unit),
+        # Parsed bounds - the model is shown the range as the lab wrote it
+        'reference_range': canonical_range(reference_range),
+        'age_band': _age_band(user_data.get('age')),
+        'sex': _sex(user_data.get('sex')),
+        'conditions': sorted({_normalize_text(c) for c in conditions if c}),
+        'medications': _medication_band(user_data.get('medications')),
+        'prompt_version': EXPLAIN_PROMPT_VERSION,
+    }
+
+
+def cache_key(canonical: Dict[str, Any]) -> str:
+    payload = json.dumps(canonical, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _get_shared(key: str) -> Optional[str]:
+    redis_client = get_redis()
+    if redis_client is None:
+        return None
+
+    try:
+        raw = redis_client.get(REDIS_PREFIX + key)
+    except Exception as e:
+        _shared['errors'] += 1
+        mark_redis_failed(e)
+        return None
+
+    if raw is None:
+        _shared['misses'] += 1
+        return None
+
+    _shared['hits'] += 1
+    return raw.decode('utf-8') if isinstance(raw, bytes) else raw
+
+
+def _set_shared(key: str, explanation: str):
+    redis_client = get_redis()
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.setex(REDIS_PREFIX + key, EXPLAIN_CACHE_TTL, explanation)
+        _shared['writes'] += 1
+    except Exception as e:
+        _shared['errors'] += 1
+        mark_redis_failed(e)
+
+
+async def get_explanation(key: str) -> Optional[str]:
+    """Look up L1 (in-process LRU) then L2 (Redis), back-filling L1 on an L2 hit"""
+    explanation = _local.get(key)
+    if explanation is not None:
+        return explanation
+
+    if get_redis() is None:
+        return None
+    explanation = await asyncio.to_thread(_get_shared, key)
+    if explanation is not None:
+        _local.set(key, explanation)
+    return explanation
+
+
+async def store_explanation(key: str, explanation: str):
+    _local.set(key, explanation)
+    if get_redis() is not None:
+        await asyncio.to_thread(_set_shared, key, explanation)
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        'prompt_version': EXPLAIN_PROMPT_VERSION,
+        'local': _local.stats(),
+        'shared': dict(_shared, enabled=get_redis() is not None),
+    }
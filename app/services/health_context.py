@@ -0,0 +1,280 @@
+"""
+Health Context - Server-side patient context for AI analysis prompts
+Loads the profile, the last few readings per metric type and the latest
+abnormal lab values straight from the database and renders them as a
+compact, token-budgeted block. The rendered block is cached per user and
+reused until a cheap data-version probe shows the underlying rows changed
+"""
+import hashlib
+import logging
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_METRICS_PER_TYPE = int(os.getenv('HEALTH_CONTEXT_METRICS_PER_TYPE', '5'))
+CONTEXT_MAX_ABNORMAL_LABS = int(os.getenv('HEALTH_CONTEXT_MAX_ABNORMAL_LABS', '25'))
+CONTEXT_TOKEN_BUDGET = int(os.getenv('HEALTH_CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_CACHE_TTL = int(os.getenv('HEALTH_CONTEXT_CACHE_TTL', '3600'))
+# Rough chars-per-token for English prose; only used to stay under the budget
+CHARS_PER_TOKEN = 4
+# Bump whenever the analysis prompt changes so stored analyses stop matching
+ANALYSIS_PROMPT_VERSION = 'analysis-v1'
+
+MIGRATIONS = [
+    "CREATE TABLE IF NOT EXISTS health_metrics (id SERIAL PRIMARY KEY, user_id UUID NOT NULL, metric_type VARCHAR NOT NULL, value VARCHAR NOT NULL, unit VARCHAR, notes TEXT, recorded_at TIMESTAMP NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE INDEX IF NOT EXISTS idx_health_metrics_user_type_date ON health_metrics(user_id, metric_type, recorded_at DESC)",
+]
+
+_cache = TTLCache(maxsize=4096, ttl=CONTEXT_CACHE_TTL)
+
+
+def data_version(conn, user_id: str) -> tuple:
+    """
+    One round trip that changes whenever the profile, metrics or lab values
+    for the user change. Counts catch deletes, max ids catch inserts.
+    """
+    row = conn.execute(text("""
+        SELECT
+            (SELECT MAX(updated_at) FROM health_profiles WHERE user_id = :user_id),
+            (SELECT COUNT(*) FROM health_metrics WHERE user_id = :user_id),
+            (SELECT MAX(id) FROM health_metrics WHERE user_id = :user_id),
+            (SELECT COUNT(*) FROM lab_values WHERE user_id = :user_id),
+            (SELECT MAX(id) FROM lab_values WHERE user_id = :user_id)
+    """), {'user_id': str(user_id)}).fetchone()
+    return tuple(str(v) for v in row) if row else ()
+
+
+def _age(date_of_birth) -> Optional[int]:
+    if not date_of_birth:
+        return None
+    today = date.today()
+    age = today.year - date_of_birth.year
+    if (today.month, today.day) < (date_of_birth.month, date_of_birth.day):
+        age -= 1
+    return age
+
+
+def _label(item: Any) -> str:
+    """Profile list entries are plain strings or {'name': ...} dicts"""
+    if isinstance(item, dict):
+        return str(item.get('name') or item.get('condition') or '').strip()
+    return str(item or '').strip()
+
+
+def load_health_context(conn, user_id: str) -> Dict[str, Any]:
+    """Profile, recent metrics per type and latest abnormal labs in three queries"""
+    params = {'user_id': str(user_id)}
+
+    profile_row = conn.execute(text("""
+        SELECT date_of_birth, sex, blood_type, height_inches, weight, ethnicity,
+               ayurvedic_dosha, tcm_pattern, diet_type, sleep_hours, stress_level,
+               preferred_traditions, current_conditions, allergies, past_diagnoses, medications
+        FROM health_profiles
+        WHERE user_id = :user_id
+    """), params).fetchone()
+
+    profile = {}
+    if profile_row:
+        profile = {
+            'age': _age(profile_row[0]),
+            'sex': profile_row[1],
+            'blood_type': profile_row[2],
+            'height_inches': profile_row[3],
+            'weight': profile_row[4],
+            'ethnicity': profile_row[5],
+            'ayurvedic_dosha': profile_row[6],
+            'tcm_pattern': profile_row[7],
+            'diet_type': profile_row[8],
+            'sleep_hours': profile_row[9],
+            'stress_level': profile_row[10],
+            'preferred_traditions': profile_row[11] or [],
+            'current_conditions': profile_row[12] or [],
+            'allergies': profile_row[13] or [],
+            'past_diagnoses': profile_row[14] or [],
+            'medications': profile_row[15] or [],
+        }
+
+    # Last N readings per metric type, served by idx_health_metrics_user_type_date
+    metrics: Dict[str, List[Dict[str, Any]]] = {}
+    for metric_type, value, unit, recorded_at in conn.execute(text("""
+        SELECT metric_type, value, unit, recorded_at
+        FROM (
+            SELECT metric_type, value, unit, recorded_at,
+                   ROW_NUMBER() OVER (PARTITION BY metric_type ORDER BY recorded_at DESC) AS rn
+            FROM health_metrics
+            WHERE user_id = :user_id
+        ) recent
+        WHERE rn <= :per_type
+        ORDER BY metric_type, recorded_at ASC
+    """), dict(params, per_type=CONTEXT_METRICS_PER_TYPE)):
+        metrics.setdefault(metric_type, []).append({
+            'value': value,
+            'unit': unit,
+            'recorded_at': recorded_at.date().isoformat() if recorded_at else None,
+        })
+
+    # Latest value per analyte, kept only if that latest value is out of range,
+    # so abnormalities that have since resolved are not reported
+    abnormal_labs = [{
+        'analyte': row[0],
+        'name': row[1],
+        'value': row[2] if row[2] is not None else row[3],
+        'unit': row[4],
+        'ref_low': row[5],
+        'ref_high': row[6],
+        'status': row[7],
+        'test_date': row[8].isoformat() if row[8] else None,
+    } for row in conn.execute(text("""
+        SELECT analyte, name, value, value_text, unit, ref_low, ref_high, status, test_date
+        FROM (
+            SELECT DISTINCT ON (analyte) analyte, name, value, value_text, unit, ref_low, ref_high, status, test_date
+            FROM lab_values
+            WHERE user_id = :user_id
+            ORDER BY analyte, test_date DESC NULLS LAST, id DESC
+        ) latest
+        WHERE status IN ('high', 'low', 'abnormal')
+        ORDER BY test_date DESC NULLS LAST
+        LIMIT :limit
+    """), dict(params, limit=CONTEXT_MAX_ABNORMAL_LABS))]
+
+    return {'profile': profile, 'metrics': metrics, 'abnormal_labs': abnormal_labs}
+
+
+def _format_number(value: Any) -> str:
+    if isinstance(value, float):
+        return format(round(value, 2), 'g')
+    return str(value)
+
+
+def _range_text(low: Any, high: Any) -> str:
+    if low is not None and high is not None:
+        return f"{_format_number(low)}-{_format_number(high)}"
+    if high is not None:
+        return f"<{_format_number(high)}"
+    if low is not None:
+        return f">{_format_number(low)}"
+    return "n/a"
+
+
+def _sections(context: Dict[str, Any]) -> List[tuple]:
+    """(heading, lines) in priority order - later sections are trimmed first"""
+    profile = context['profile']
+    sections = []
+
+    basics = []
+    for label, key, suffix in (
+        ('Age', 'age', ''), ('Sex', 'sex', ''), ('Blood type', 'blood_type', ''),
+        ('Height', 'height_inches', ' in'), ('Weight', 'weight', ' lbs'), ('Ethnicity', 'ethnicity', ''),
+        ('Ayurvedic dosha', 'ayurvedic_dosha', ''), ('TCM pattern', 'tcm_pattern', ''),
+        ('Diet', 'diet_type', ''), ('Sleep', 'sleep_hours', ' h/night'), ('Stress', 'stress_level', '/10'),
+    ):
+        if profile.get(key) not in (None, ''):
+            basics.append(f"{label}: {profile[key]}{suffix}")
+    traditions = [_label(t) for t in profile.get('preferred_traditions', []) if _label(t)]
+    if traditions:
+        basics.append(f"Preferred traditions: {', '.join(traditions)}")
+    sections.append(('PATIENT PROFILE', ['- ' + '; '.join(basics)] if basics else ['- Not provided']))
+
+    history = []
+    for label, key in (('Conditions', 'current_conditions'), ('Allergies', 'allergies'), ('Past diagnoses', 'past_diagnoses')):
+        names = [_label(item) for item in profile.get(key, []) if _label(item)]
+        history.append(f"- {label}: {', '.join(names) if names else 'None reported'}")
+    sections.append(('MEDICAL HISTORY', history))
+
+    medications = []
+    for med in profile.get('medications', []):
+        if isinstance(med, dict):
+            detail = ' '.join(str(med.get(k)) for k in ('dosage', 'frequency') if med.get(k))
+            kind = f" ({med['type']})" if med.get('type') else ''
+            medications.append(f"- {med.get('name')}: {detail}{kind}".rstrip(': '))
+        elif _label(med):
+            medications.append(f"- {_label(med)}")
+    sections.append(('MEDICATIONS', medications or ['- None']))
+
+    labs = [
+        f"- {lab['name']}: {_format_number(lab['value'])} {lab['unit'] or ''} "
+        f"[{lab['status'].upper()}, ref {_range_text(lab['ref_low'], lab['ref_high'])}] {lab['test_date'] or ''}".rstrip()
+        for lab in context['abnormal_labs']
+    ]
+    sections.append(('OUT-OF-RANGE LAB VALUES (latest per analyte)', labs or ['- None on file']))
+
+    metrics = []
+    for metric_type, readings in context['metrics'].items():
+        values = ', '.join(f"{r['value']}{' ' + r['unit'] if r['unit'] else ''} ({r['recorded_at']})" for r in readings)
+        metrics.append(f"- {metric_type.replace('_', ' ').title()}: {values}")
+    sections.append(('RECENT HEALTH METRICS', metrics or ['- No data available']))
+
+    return sections
+
+
+def render_context(context: Dict[str, Any], token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Render the context block within roughly `token_budget` tokens. Every
+    section heading is kept; lines are dropped from the end once the budget
+    is spent and replaced with a '+N more' marker.
+    """
+    budget = token_budget * CHARS_PER_TOKEN
+    sections = _sections(context)
+    # Reserve room for every heading so low-priority sections never vanish entirely
+    budget -= sum(len(heading) + 2 for heading, _ in sections)
+
+    blocks = []
+    for heading, lines in sections:
+        kept = []
+        for index, line in enumerate(lines):
+            if len(line) + 1 > budget:
+                kept.append(f"- (+{len(lines) - index} more omitted)")
+                break
+            kept.append(line)
+            budget -= len(line) + 1
+        blocks.append(heading + ':\n' + '\n'.join(kept))
+    return '\n\n'.join(blocks)
+
+
+def build_health_context(engine, user_id: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """
+    Cached context block for a user.
+
+    Returns:
+        {"text": rendered block, "version": data-version tuple, "cached": bool,
+         "counts": {...}} - "version" changes whenever the underlying data does
+    """
+    with engine.connect() as conn:
+        version = data_version(conn, user_id)
+        cache_key = (str(user_id), token_budget)
+        cached = _cache.get(cache_key)
+        if cached is not None and cached['version'] == version:
+            return dict(cached, cached=True)
+
+        context = load_health_context(conn, user_id)
+
+    entry = {
+        'text': render_context(context, token_budget),
+        'version': version,
+        'counts': {
+            'metric_types': len(context['metrics']),
+            'abnormal_labs': len(context['abnormal_labs']),
+            'has_profile': bool(context['profile']),
+        },
+    }
+    _cache.set(cache_key, entry)
+    return dict(entry, cached=False)
+
+
+def stats() -> Dict[str, Any]:
+    return _cache.stats()
+
+
+def analysis_fingerprint(context_text: str, model: str) -> str:
+    """
+    Fingerprint of everything an analysis depends on. The rendered context is
+    already the normalized form of the profile, medications, metrics and labs.
+    """
+    payload = '\n'.join((ANALYSIS_PROMPT_VERSION, model, context_text.strip()))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
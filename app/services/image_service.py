@@ -0,0 +1,157 @@
+"""
+Image Service - Preprocessing for images sent to Claude
+Decodes uploads, strips EXIF, downsizes to the model's useful resolution
+and re-encodes within a byte budget before they are base64'd into a request
+"""
+import base64
+import binascii
+import io
+import logging
+import os
+from typing import Any, BinaryIO, Dict, Tuple, Union
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Claude downsamples anything with a long edge over ~1568px, so extra pixels
+# only cost upload bandwidth and image tokens
+IMAGE_MAX_EDGE = int(os.getenv('IMAGE_MAX_EDGE', '1568'))
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(1024 * 1024)))  # 1MB
+IMAGE_OUTPUT_FORMAT = os.getenv('IMAGE_OUTPUT_FORMAT', 'JPEG').upper()  # JPEG or WEBP
+
+QUALITY_STEPS = (85, 75, 65, 55)
+MIN_EDGE = 512
+
+OUTPUT_MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+}
+
+
+class ImageProcessingError(ValueError):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Convert to RGB, compositing transparency onto white (JPEG has no alpha)"""
+    if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    # No exif= argument is passed, so no metadata survives the re-encode
+    if fmt == 'WEBP':
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def preprocess_image(
+    data: Union[bytes, BinaryIO],
+    max_edge: int = IMAGE_MAX_EDGE,
+    max_bytes: int = IMAGE_MAX_BYTES,
+    output_format: str = IMAGE_OUTPUT_FORMAT,
+) -> Tuple[bytes, str, Dict[str, Any]]:
+    """
+    Decode, strip metadata, downsize and re-encode an image.
+
+    Args:
+        data: Raw image bytes as uploaded, or a seekable file object
+        max_edge: Longest edge in pixels after downsizing
+        max_bytes: Byte budget for the encoded output
+        output_format: 'JPEG' or 'WEBP'
+
+    Returns:
+        (encoded bytes, media type, stats dict with before/after sizes)
+    """
+    fmt = output_format if output_format in OUTPUT_MEDIA_TYPES else 'JPEG'
+
+    if isinstance(data, (bytes, bytearray)):
+        original_bytes = len(data)
+        stream = io.BytesIO(data)
+    else:
+        # Spooled uploads are decoded straight from the temp file
+        stream = data
+        stream.seek(0, os.SEEK_END)
+        original_bytes = stream.tell()
+        stream.seek(0)
+
+    try:
+        img = Image.open(stream)
+        img.load()
+    except (Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise ImageProcessingError(f"Could not decode image: {e}")
+
+    original_size = img.size
+
+    # Apply the EXIF orientation before the metadata is dropped
+    img = ImageOps.exif_transpose(img)
+    img = _flatten(img)
+
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    encoded = b''
+    while True:
+        for quality in QUALITY_STEPS:
+            encoded = _encode(img, fmt, quality)
+            if len(encoded) <= max_bytes:
+                break
+
+        if len(encoded) <= max_bytes or max(img.size) <= MIN_EDGE:
+            break
+
+        # Still over budget at the lowest quality step - shrink and try again
+        img = img.resize(
+            (max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))),
+            Image.LANCZOS
+        )
+
+    stats = {
+        'original_bytes': original_bytes,
+        'processed_bytes': len(encoded),
+        'original_dimensions': list(original_size),
+        'processed_dimensions': list(img.size),
+        'media_type': OUTPUT_MEDIA_TYPES[fmt],
+    }
+
+    logger.info(
+        f"Image preprocessed: {original_bytes} bytes {original_size[0]}x{original_size[1]} -> "
+        f"{len(encoded)} bytes {img.size[0]}x{img.size[1]} ({fmt})"
+    )
+
+    return encoded, OUTPUT_MEDIA_TYPES[fmt], stats
+
+
+def preprocess_base64_image(image: Dict[str, str]) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """
+    Preprocess a chat image payload ({"type": media_type, "data": base64}).
+
+    Returns:
+        (new payload in the same shape, stats dict)
+    """
+    raw = image.get('data') or ''
+    # Browsers sometimes send a full data URL rather than bare base64
+    if raw.startswith('data:') and ',' in raw:
+        raw = raw.split(',', 1)[1]
+
+    try:
+        decoded = base64.b64decode(raw, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ImageProcessingError(f"Invalid base64 image data: {e}")
+
+    encoded, media_type, stats = preprocess_image(decoded)
+
+    return {
+        'type': media_type,
+        'data': base64.b64encode(encoded).decode('ascii')
+    }, stats
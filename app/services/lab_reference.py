@@ -0,0 +1,273 @@
+"""
+Lab Reference Engine - Deterministic flagging of lab values
+Parses reference_range strings ("3.5-5.0", "<200", ">=40", "Negative"),
+normalizes units and flags each result as normal / high / low / abnormal
+without a model call
+"""
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+NORMAL = 'normal'
+HIGH = 'high'
+LOW = 'low'
+ABNORMAL = 'abnormal'
+UNKNOWN = 'unknown'
+
+_NUM = r'[-+]?\d+(?:\.\d+)?'
+
+# Precompiled grammar - tried in order, first match wins
+_RANGE_BETWEEN = re.compile(rf'^({_NUM})\s*(?:-|–|—|to)\s*({_NUM})')
+_RANGE_UPPER = re.compile(rf'^(?:<=|=<|≤|<|less than|up to|below)\s*({_NUM})')
+_RANGE_LOWER = re.compile(rf'^(?:>=|=>|≥|>|greater than|more than|above|at least)\s*({_NUM})')
+_VALUE = re.compile(rf'^(<=|>=|≤|≥|<|>)?\s*({_NUM})')
+
+# Qualitative results, keyed by the normalized expected value
+_QUALITATIVE = {
+    'negative': {'negative', 'neg', 'non-reactive', 'nonreactive', 'not detected', 'none detected', 'absent', 'none seen', 'normal'},
+    'non-reactive': {'non-reactive', 'nonreactive', 'negative', 'neg', 'not detected'},
+    'not detected': {'not detected', 'none detected', 'negative', 'neg', 'absent'},
+    'normal': {'normal', 'negative', 'within normal limits', 'wnl'},
+    'absent': {'absent', 'negative', 'not detected', 'none'},
+    'clear': {'clear'},
+}
+
+# Canonical spellings for unit strings as they come out of extraction
+_UNIT_ALIASES = {
+    'mg/dl': 'mg/dL',
+    'g/dl': 'g/dL',
+    'ng/dl': 'ng/dL',
+    'ug/dl': 'ug/dL',
+    'mmol/l': 'mmol/L',
+    'umol/l': 'umol/L',
+    'nmol/l': 'nmol/L',
+    'pmol/l': 'pmol/L',
+    'mmol/mol': 'mmol/mol',
+    'ng/ml': 'ng/mL',
+    'pg/ml': 'pg/mL',
+    'ug/ml': 'ug/mL',
+    'miu/l': 'mIU/L',
+    'uiu/ml': 'uIU/mL',
+    'miu/ml': 'mIU/mL',
+    'iu/l': 'IU/L',
+    'u/l': 'U/L',
+    'meq/l': 'mEq/L',
+    'g/l': 'g/L',
+    'fl': 'fL',
+    'pg': 'pg',
+    '%': '%',
+    'k/ul': 'K/uL',
+    'x10e3/ul': 'K/uL',
+    '10^3/ul': 'K/uL',
+    'x10^3/ul': 'K/uL',
+    'thousand/ul': 'K/uL',
+    'm/ul': 'M/uL',
+    'x10e6/ul': 'M/uL',
+    '10^6/ul': 'M/uL',
+    'x10^6/ul': 'M/uL',
+    'million/ul': 'M/uL',
+    '10^9/l': '10^9/L',
+    'x10^9/l': '10^9/L',
+    'x10e9/l': '10^9/L',
+    '10*9/l': '10^9/L',
+    '10^12/l': '10^12/L',
+    'x10^12/l': '10^12/L',
+    'x10e12/l': '10^12/L',
+    '10*12/l': '10^12/L',
+    'ug/l': 'ug/L',
+    'ml/min/1.73m2': 'mL/min/1.73m2',
+    'mm/hr': 'mm/hr',
+    'mg/l': 'mg/L',
+}
+
+
+def normalize_unit(unit: Any) -> str:
+    """Canonical spelling for a unit string ('MG/DL', 'mg / dl' -> 'mg/dL')"""
+    if not unit:
+        return ''
+    # Client JSON isn't typed - a bare number or list must not 500 the request
+    if not isinstance(unit, str):
+        unit = str(unit)
+    key = unit.strip().replace('µ', 'u').replace('μ', 'u').replace(' ', '').lower()
+    return _UNIT_ALIASES.get(key, unit.strip())
+
+
+def parse_reference_range(reference_range: Any) -> Tuple[str, Optional[float], Optional[float], Optional[str]]:
+    """
+    Parse a reference range string.
+
+    Returns:
+        (kind, low, high, qualitative) where kind is 'between', 'upper',
+        'lower', 'qualitative' or 'unknown'
+    """
+    # Client JSON isn't typed: a number is read as its text, anything else
+    # (a list, an object) is no range at all - and can't be an lru_cache key
+    if isinstance(reference_range, (int, float)) and not isinstance(reference_range, bool):
+        reference_range = str(reference_range)
+    if not reference_range or not isinstance(reference_range, str):
+        return ('unknown', None, None, None)
+    return _parse_reference_range(reference_range)
+
+
+@lru_cache(maxsize=4096)
+def _parse_reference_range(reference_range: str) -> Tuple[str, Optional[float], Optional[float], Optional[str]]:
+    text = reference_range.strip().lower().replace(',', '')
+    if not text or text in ('n/a', 'na', '-', 'none'):
+        return ('unknown', None, None, None)
+
+    match = _RANGE_BETWEEN.match(text)
+    if match:
+        low, high = float(match.group(1)), float(match.group(2))
+        if low > high:
+            low, high = high, low
+        return ('between', low, high, None)
+
+    match = _RANGE_UPPER.match(text)
+    if match:
+        return ('upper', None, float(match.group(1)), None)
+
+    match = _RANGE_LOWER.match(text)
+    if match:
+        return ('lower', float(match.group(1)), None, None)
+
+    if text in _QUALITATIVE:
+        return ('qualitative', None, None, text)
+
+    return ('unknown', None, None, None)
+
+
+def _format_bound(number: float) -> str:
+    return format(number, 'g')
+
+
+def canonical_range(reference_range: Any) -> str:
+    """
+    A reference range rendered from its parsed bounds ('3.5–5', '≤200',
+    '≥40'), so different spellings of one range compare equal. Whatever the
+    grammar didn't consume is kept ('<1:40' -> '≤1 :40'), so two different
+    ranges never do.
+    """
+    kind, low, high, qualitative = parse_reference_range(reference_range)
+    text = ' '.join(str(reference_range or '').lower().replace(',', '').split())
+    if kind == 'qualitative':
+        return qualitative
+    if kind == 'unknown':
+        return text
+
+    if kind == 'between':
+        grammar, bounds = _RANGE_BETWEEN, f"{_format_bound(low)}–{_format_bound(high)}"
+    elif kind == 'upper':
+        grammar, bounds = _RANGE_UPPER, f"≤{_format_bound(high)}"
+    else:
+        grammar, bounds = _RANGE_LOWER, f"≥{_format_bound(low)}"
+    rest = text[grammar.match(text).end():].strip()
+    return f"{bounds} {rest}".strip()
+
+
+def parse_value(value: Any) -> Tuple[Optional[float], Optional[str]]:
+    """
+    Parse an extracted value.
+
+    Returns:
+        (number, qualifier) - qualifier is '<' / '>' for censored values
+        like '<0.5', or the lower-cased text for qualitative values
+    """
+    if value is None:
+        return (None, None)
+    if isinstance(value, (int, float)):
+        return (float(value), None)
+
+    text = str(value).strip().lower().replace(',', '')
+    match = _VALUE.match(text)
+    if match:
+        qualifier = match.group(1)
+        if qualifier in ('≤', '<='):
+            qualifier = '<'
+        elif qualifier in ('≥', '>='):
+            qualifier = '>'
+        return (float(match.group(2)), qualifier)
+
+    return (None, text or None)
+
+
+def flag_value(value: Any, reference_range: Optional[str]) -> Dict[str, Any]:
+    """
+    Flag a single value against its reference range.
+
+    Returns:
+        {"status": ..., "deviation_pct": float | None, "ref_low": ..., "ref_high": ...}
+        deviation_pct is how far outside the nearest bound the value sits,
+        as a percentage of that bound (negative when low, 0 when normal)
+    """
+    kind, low, high, expected = parse_reference_range(reference_range)
+    number, qualifier = parse_value(value)
+
+    flag = {'status': UNKNOWN, 'deviation_pct': None, 'ref_low': low, 'ref_high': high}
+
+    if kind == 'qualitative':
+        if number is None and qualifier:
+            flag['status'] = NORMAL if qualifier in _QUALITATIVE[expected] else ABNORMAL
+        return flag
+
+    if kind == 'unknown' or number is None:
+        return flag
+
+    # A censored value like '<0.5' is only known to sit below 0.5
+    if qualifier == '<':
+        if low is not None and number <= low:
+            flag['status'] = LOW
+        elif low is None and high is not None and number <= high:
+            flag['status'] = NORMAL
+        return flag
+    if qualifier == '>':
+        if high is not None and number >= high:
+            flag['status'] = HIGH
+        elif high is None and low is not None and number >= low:
+            flag['status'] = NORMAL
+        return flag
+
+    if high is not None and number > high:
+        flag['status'] = HIGH
+        flag['deviation_pct'] = _deviation(number, high)
+    elif low is not None and number < low:
+        flag['status'] = LOW
+        flag['deviation_pct'] = _deviation(number, low)
+    else:
+        flag['status'] = NORMAL
+        flag['deviation_pct'] = 0.0
+
+    return flag
+
+
+def _deviation(number: float, bound: float) -> Optional[float]:
+    if bound == 0:
+        return None
+    return round((number - bound) / abs(bound) * 100, 1)
+
+
+def flag_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Flag every entry of a lab_results `results` array in one pass.
+
+    Reference ranges repeat heavily across a panel and across users, so the
+    range grammar is parsed once per distinct string (lru_cache) and the
+    per-row work is just the numeric comparison. Entries are copied, not
+    mutated, and gain 'status', 'deviation_pct' and a normalized 'unit'.
+    """
+    flagged = []
+    for result in results or []:
+        if not isinstance(result, dict):
+            continue
+        entry = dict(result)
+        entry.update(flag_value(entry.get('value'), entry.get('reference_range')))
+        entry.pop('ref_low', None)
+        entry.pop('ref_high', None)
+        if entry.get('unit'):
+            entry['unit'] = normalize_unit(entry['unit'])
+        flagged.append(entry)
+    return flagged
+
+
+def abnormal_results(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Subset of flagged results that are outside their reference range"""
+    return [r for r in results if r.get('status') in (HIGH, LOW, ABNORMAL)]
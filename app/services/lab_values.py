@@ -0,0 +1,210 @@
+"""
+Lab Values - Normalized per-analyte storage of extracted lab results
+lab_results.results stays the source of truth; every entry is also written
+to lab_values (one row per analyte) so per-analyte time series are a single
+indexed range scan on (user_id, analyte, test_date)
+
+Backfill existing rows with:
+    python -m app.services.lab_values --batch-size 500
+Re-derive every row (e.g. after the analyte dictionary changes) with --rebuild
+"""
+import json
+import logging
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from app.services.analytes import canonicalize_result, match_analyte
+from app.services.lab_reference import flag_value, normalize_unit, parse_value
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 500
+# Arbitrary constant shared by every worker so only one runs the backfill
+BACKFILL_LOCK_ID = 730_001
+
+MIGRATIONS = [
+    "CREATE TABLE IF NOT EXISTS lab_results (id SERIAL PRIMARY KEY, user_id UUID NOT NULL, test_type VARCHAR(255), test_date DATE, provider VARCHAR(255), file_url TEXT, results JSONB, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "ALTER TABLE lab_results ADD COLUMN IF NOT EXISTS file_url TEXT",
+    "CREATE TABLE IF NOT EXISTS lab_values (id BIGSERIAL PRIMARY KEY, lab_result_id INTEGER NOT NULL REFERENCES lab_results(id) ON DELETE CASCADE, user_id UUID NOT NULL, analyte VARCHAR(100) NOT NULL, name VARCHAR(255), value DOUBLE PRECISION, value_text VARCHAR(100), unit VARCHAR(50), ref_low DOUBLE PRECISION, ref_high DOUBLE PRECISION, status VARCHAR(20), test_date DATE, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE INDEX IF NOT EXISTS idx_lab_values_user_analyte_date ON lab_values(user_id, analyte, test_date)",
+    "CREATE INDEX IF NOT EXISTS idx_lab_values_result ON lab_values(lab_result_id)",
+]
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+
+def analyte_key(name: Optional[str]) -> str:
+    """
+    Stable key for an analyte name - the canonical dictionary key when the
+    name is recognized ('HbA1c', 'Hemoglobin A1C' -> 'hba1c'), otherwise a
+    slug ('Vitamin K2, MK-7' -> 'vitamin_k2_mk_7')
+    """
+    return match_analyte(name) or _NON_ALNUM.sub('_', (name or '').lower()).strip('_')[:100] or 'unknown'
+
+
+def build_lab_value_rows(
+    lab_result_id: int,
+    user_id: str,
+    test_date: Any,
+    results: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """
+    Turn a lab_results.results array into lab_values insert parameters.
+    Recognized analytes are stored in their canonical unit so a series
+    mixing mg/dL and mmol/L reports lines up; value_text keeps the original.
+    """
+    rows = []
+    for result in results or []:
+        if not isinstance(result, dict):
+            continue
+        number, qualifier = parse_value(result.get('value'))
+        flag = flag_value(result.get('value'), result.get('reference_range'))
+        unit = normalize_unit(result.get('unit'))
+        ref_low, ref_high = flag['ref_low'], flag['ref_high']
+
+        canonical = canonicalize_result(result)
+        if canonical.get('canonical_value') is not None:
+            number = canonical['canonical_value']
+            unit = canonical['canonical_unit']
+            ref_low = canonical['canonical_ref_low']
+            ref_high = canonical['canonical_ref_high']
+
+        rows.append({
+            'lab_result_id': lab_result_id,
+            'user_id': str(user_id),
+            'analyte': canonical['analyte_key'] or analyte_key(result.get('name')),
+            'name': (result.get('name') or '')[:255],
+            'value': number,
+            'value_text': str(result.get('value') or '')[:100],
+            'unit': unit[:50],
+            'ref_low': ref_low,
+            'ref_high': ref_high,
+            'status': flag['status'],
+            'test_date': test_date,
+        })
+    return rows
+
+
+def insert_lab_values(conn, rows: List[Dict[str, Any]]):
+    """Insert prepared rows on an open connection (caller commits)"""
+    if not rows:
+        return
+    conn.execute(text("""
+        INSERT INTO lab_values
+        (lab_result_id, user_id, analyte, name, value, value_text, unit, ref_low, ref_high, status, test_date)
+        VALUES (:lab_result_id, :user_id, :analyte, :name, :value, :value_text, :unit, :ref_low, :ref_high, :status, :test_date)
+    """), rows)
+
+
+def get_trend(conn, user_id: str, analyte: str, since: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Time series for one analyte, oldest first"""
+    query = """
+        SELECT lab_result_id, test_date, name, value, value_text, unit, ref_low, ref_high, status
+        FROM lab_values
+        WHERE user_id = :user_id AND analyte = :analyte
+    """
+    params = {'user_id': str(user_id), 'analyte': analyte}
+    if since:
+        query += " AND test_date >= :since"
+        params['since'] = since
+    query += " ORDER BY test_date ASC, id ASC"
+
+    return [{
+        'lab_result_id': row[0],
+        'test_date': row[1].isoformat() if row[1] else None,
+        'name': row[2],
+        'value': row[3],
+        'value_text': row[4],
+        'unit': row[5],
+        'ref_low': row[6],
+        'ref_high': row[7],
+        'status': row[8],
+    } for row in conn.execute(text(query), params)]
+
+
+def backfill_lab_values(engine, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Populate lab_values for lab_results rows that have none yet.
+
+    Walks lab_results by primary key in batches, committing each batch, so it
+    can be interrupted and resumed. A session-level advisory lock keeps
+    concurrent workers from backfilling the same rows twice.
+
+    Returns:
+        Number of lab_results rows processed
+    """
+    processed = 0
+    with engine.connect() as conn:
+        locked = conn.execute(text("SELECT pg_try_advisory_lock(:id)"), {'id': BACKFILL_LOCK_ID}).scalar()
+        conn.commit()
+        if not locked:
+            logger.info("lab_values backfill already running in another worker")
+            return 0
+
+        try:
+            last_id = 0
+            while True:
+                batch = conn.execute(text("""
+                    SELECT lr.id, lr.user_id, lr.test_date, lr.results
+                    FROM lab_results lr
+                    WHERE lr.id > :last_id
+                      AND NOT EXISTS (SELECT 1 FROM lab_values lv WHERE lv.lab_result_id = lr.id)
+                    ORDER BY lr.id
+                    LIMIT :batch_size
+                """), {'last_id': last_id, 'batch_size': batch_size}).fetchall()
+
+                if not batch:
+                    break
+
+                rows = []
+                for lab_result_id, user_id, test_date, results in batch:
+                    if isinstance(results, str):
+                        try:
+                            results = json.loads(results)
+                        except ValueError:
+                            results = []
+                    rows.extend(build_lab_value_rows(lab_result_id, user_id, test_date, results))
+
+                insert_lab_values(conn, rows)
+                conn.commit()
+
+                processed += len(batch)
+                last_id = batch[-1][0]
+                logger.info(f"lab_values backfill: {processed} lab results processed (last id {last_id})")
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': BACKFILL_LOCK_ID})
+            conn.commit()
+
+    return processed
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description="Backfill lab_values from lab_results")
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument('--rebuild', action='store_true', help="Delete all lab_values rows and re-derive them")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    database_url = os.getenv('DATABASE_URL', '')
+    if database_url.startswith('postgres://'):
+        database_url = database_url.replace('postgres://', 'postgresql://', 1)
+
+    backfill_engine = create_engine(database_url)
+    with backfill_engine.connect() as migration_conn:
+        for statement in MIGRATIONS:
+            migration_conn.execute(text(statement))
+        if args.rebuild:
+            migration_conn.execute(text("TRUNCATE lab_values"))
+        migration_conn.commit()
+
+    total = backfill_lab_values(backfill_engine, args.batch_size)
+    print(f"✅ Backfilled lab_values for {total} lab results")
@@ -0,0 +1,70 @@
+"""
+Lazy Import - Defer heavy SDK imports until first use
+stripe (~1s), anthropic (~0.5s) and resend dominate `import app.main`, yet
+only a few endpoints touch them. A LazyModule stands in for the module and
+imports it on first attribute access, so worker spawn and scale-out don't
+pay for SDKs a worker may never call. warm() imports them ahead of traffic
+(in the background after startup, or in a preloading master before fork).
+
+    stripe = LazyModule('stripe', setup=lambda m: setattr(m, 'api_key', KEY))
+    stripe.Customer.create(...)   # imports + configures on first use
+"""
+import importlib
+import logging
+import threading
+import time
+from types import ModuleType
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_registry: List['LazyModule'] = []
+
+
+class LazyModule:
+    def __init__(self, name: str, setup: Optional[Callable[[ModuleType], None]] = None):
+        self._name = name
+        self._setup = setup
+        self._module: Optional[ModuleType] = None
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def load(self) -> ModuleType:
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    if self._setup is not None:
+                        self._setup(module)
+                    self._module = module
+                    logger.debug(f"Imported {self._name} in {(time.perf_counter() - started) * 1000:.0f}ms")
+                module = self._module
+        return module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def warm():
+    """Import every registered module now; failures are logged, not raised"""
+    for lazy in list(_registry):
+        try:
+            lazy.load()
+        except Exception as e:
+            logger.warning(f"Could not import {lazy._name}: {e}")
+
+
+def warm_in_background() -> threading.Thread:
+    thread = threading.Thread(target=warm, name='lazy-import-warmup', daemon=True)
+    thread.start()
+    return thread
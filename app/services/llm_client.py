@@ -0,0 +1,150 @@
+"""
+LLM Client - Single entry point for Anthropic model calls
+Every call goes through the LLM scheduler for admission control and the
+resilience layer (retries, hedging, circuit breaker), and the blocking SDK
+call runs in a worker thread so it never stalls the event loop
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from app.services import llm_resilience, metrics, tracing
+from app.services.lazy_import import LazyModule
+from app.services.llm_scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+anthropic = LazyModule('anthropic')
+
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
+# Point at tools/mock_anthropic.py for load tests (e.g. http://127.0.0.1:8089)
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL') or None
+
+# How long a request may wait in the admission queue, per endpoint. Chat is
+# interactive; extraction and analysis already take tens of seconds
+ENDPOINT_QUEUE_TIMEOUTS = {
+    'chat': 15.0,
+    'explain_value': 10.0,
+    'ai_analysis': 30.0,
+    'lab_extraction': 45.0,
+}
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> 'anthropic.Anthropic':
+    """Shared sync client - reuses its connection pool across requests"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Retries are owned by llm_resilience, not the SDK
+                _client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL, max_retries=0)
+    return _client
+
+
+def get_async_client() -> 'anthropic.AsyncAnthropic':
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                _async_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL, max_retries=0)
+    return _async_client
+
+
+async def create_message(
+    api_params: Dict[str, Any],
+    tier: Optional[str] = None,
+    endpoint: str = 'default',
+    queue_timeout: Optional[float] = None,
+):
+    """
+    messages.create behind admission control.
+
+    Raises:
+        LLMOverloaded (HTTP 429 with Retry-After) when the tier's queue is
+        full or the request waited past its queue deadline
+        LLMUnavailable (HTTP 503 with Retry-After) when the provider keeps failing
+    """
+    timeout = queue_timeout or ENDPOINT_QUEUE_TIMEOUTS.get(endpoint)
+    request_timeout = llm_resilience.get_policy(endpoint)['timeout']
+    client = get_client()
+
+    with tracing.span('llm.create', **{'llm.endpoint': endpoint, 'llm.model': api_params.get('model'), 'llm.tier': tier}) as span:
+        queued = time.perf_counter()
+        async with scheduler.slot(tier, timeout):
+            started = time.perf_counter()
+            span.set('llm.queue_wait_ms', round((started - queued) * 1000, 3))
+            try:
+                response = await llm_resilience.call_with_resilience(
+                    lambda: asyncio.to_thread(client.messages.create, **api_params, timeout=request_timeout),
+                    endpoint,
+                )
+            except Exception:
+                metrics.observe_llm(endpoint, api_params.get('model'), time.perf_counter() - started, 'error')
+                raise
+            metrics.observe_llm(endpoint, api_params.get('model'), time.perf_counter() - started, 'ok', response.usage)
+            span.set_usage(response.usage)
+            return response
+
+
+async def stream_text(
+    api_params: Dict[str, Any],
+    tier: Optional[str] = None,
+    endpoint: str = 'default',
+    queue_timeout: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Text deltas of a streamed message; the slot is held until the stream ends.
+    Opening the stream is retried; once text has been yielded a failure
+    propagates, since the caller has already forwarded part of the answer.
+    """
+    timeout = queue_timeout or ENDPOINT_QUEUE_TIMEOUTS.get(endpoint)
+    request_timeout = llm_resilience.get_policy(endpoint)['timeout']
+    client = get_async_client()
+
+    # Not made current: the generator may be resumed from the response's task
+    span = tracing.start_span('llm.stream', **{'llm.endpoint': endpoint, 'llm.model': api_params.get('model'), 'llm.tier': tier})
+    queued = time.perf_counter()
+    usage = {}
+    outcome = 'error'
+    try:
+        async with scheduler.slot(tier, timeout):
+            started = time.perf_counter()
+            span.set('llm.queue_wait_ms', round((started - queued) * 1000, 3))
+            try:
+                stream = await llm_resilience.call_with_resilience(
+                    lambda: client.messages.create(**api_params, stream=True, timeout=request_timeout),
+                    endpoint,
+                    hedge=False,
+                )
+                try:
+                    async for event in stream:
+                        if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+                            yield event.delta.text
+                        elif event.type == 'message_start':
+                            usage.update(event.message.usage.model_dump(exclude_none=True))
+                        elif event.type == 'message_delta' and event.usage is not None:
+                            usage['output_tokens'] = event.usage.output_tokens
+                    outcome = 'ok'
+                finally:
+                    await stream.close()
+            finally:
+                metrics.observe_llm(endpoint, api_params.get('model'), time.perf_counter() - started, outcome, usage)
+    finally:
+        span.set_usage(usage)
+        if outcome != 'ok':
+            span.set_status('error')
+        span.finish()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        'scheduler': scheduler.stats(),
+        'resilience': llm_resilience.stats(),
+    }
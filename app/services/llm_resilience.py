@@ -0,0 +1,295 @@
+"""
+LLM Resilience - Retries, hedged requests and a circuit breaker for model calls
+Transient provider failures (429, 5xx, 529 overloaded, connection resets,
+timeouts) are retried with full-jitter exponential backoff. Endpoints that
+opt in send a second, hedged request once the first has run longer than
+that endpoint's recent latency percentile. A shared circuit breaker fails
+fast with a 503 while the provider is having an incident instead of
+queueing every user behind doomed calls
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+from app.services.lazy_import import LazyModule
+from app.services.llm_scheduler import scheduler
+
+# Only needed once a call has failed - by then the client has imported it
+anthropic = LazyModule('anthropic')
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('LLM_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+# Endpoints that may send a hedged duplicate request (comma separated). Off by
+# default: the losing request can't be stopped (its SDK call runs in a thread),
+# so every hedge pays for a second, discarded response (see hedge_wasted_tokens)
+HEDGE_ENDPOINTS = {e.strip() for e in os.getenv('LLM_HEDGE_ENDPOINTS', '').split(',') if e.strip()}
+
+DEFAULT_POLICY = {
+    'max_retries': 2,
+    'base_delay': 0.5,        # seconds, doubled per attempt before jitter
+    'max_delay': 8.0,
+    'timeout': 120.0,         # per attempt
+    'hedge_percentile': 95,
+    'hedge_min_samples': 20,
+}
+
+# Per-endpoint overrides of DEFAULT_POLICY
+ENDPOINT_POLICIES = {
+    'chat': {'max_retries': 2, 'timeout': 90.0},
+    'explain_value': {'max_retries': 2, 'timeout': 60.0, 'hedge_percentile': 90},
+    'ai_analysis': {'max_retries': 1, 'timeout': 180.0},
+    'lab_extraction': {'max_retries': 2, 'timeout': 120.0},
+}
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+_LATENCY_SAMPLES = 200
+
+
+class LLMUnavailable(HTTPException):
+    """503 raised while the circuit breaker is open or retries are exhausted"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=503,
+            detail="The AI service is temporarily unavailable. Please try again shortly.",
+            headers={'Retry-After': str(retry_after)},
+        )
+        self.retry_after = retry_after
+
+
+def get_policy(endpoint: str) -> Dict[str, Any]:
+    policy = dict(DEFAULT_POLICY, **ENDPOINT_POLICIES.get(endpoint, {}))
+    policy['hedge'] = endpoint in HEDGE_ENDPOINTS
+    return policy
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (anthropic.APIConnectionError, anthropic.APITimeoutError)):
+        return True
+    if isinstance(error, anthropic.APIStatusError):
+        return error.status_code in _RETRYABLE_STATUS
+    return False
+
+
+def _retry_after_header(error: Exception) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, policy: Dict[str, Any], error: Optional[Exception] = None) -> float:
+    """Full jitter: uniform(0, min(max_delay, base * 2^attempt)), never below a server Retry-After"""
+    ceiling = min(policy['max_delay'], policy['base_delay'] * (2 ** attempt))
+    delay = random.uniform(0, ceiling)
+    server_hint = _retry_after_header(error) if error is not None else None
+    if server_hint is not None:
+        delay = max(delay, min(server_hint, policy['max_delay']))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive retryable failures;
+    open -> half-open after `cooldown` seconds, letting one probe through;
+    the probe closes the breaker on success or re-opens it on failure.
+    """
+
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half-open'
+            if self.state == 'half-open' and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            raise LLMUnavailable(max(1, math.ceil(remaining if remaining > 0 else self.cooldown)))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info("LLM circuit breaker closed")
+            self.state = 'closed'
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """The call ended without a verdict (cancelled) - let the next call probe instead"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    self.times_opened += 1
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} failures")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'times_opened': self.times_opened,
+        }
+
+
+breaker = CircuitBreaker()
+
+_latencies: Dict[str, deque] = {}
+_counters: Dict[str, Dict[str, int]] = {}
+
+
+def _count(endpoint: str, name: str, amount: int = 1):
+    counters = _counters.setdefault(endpoint, {
+        'calls': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0, 'failures': 0, 'hedge_wasted_tokens': 0,
+    })
+    counters[name] += amount
+
+
+def _usage_tokens(response: Any) -> int:
+    usage = getattr(response, 'usage', None)
+    return (getattr(usage, 'input_tokens', 0) or 0) + (getattr(usage, 'output_tokens', 0) or 0)
+
+
+def _hedge_after(endpoint: str, policy: Dict[str, Any]) -> Optional[float]:
+    """Latency percentile after which a hedge fires, once there are enough samples"""
+    samples = _latencies.get(endpoint)
+    if not policy['hedge'] or not samples or len(samples) < policy['hedge_min_samples']:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, math.ceil(policy['hedge_percentile'] / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+async def _attempt(call: Callable[[], Awaitable[Any]], endpoint: str, policy: Dict[str, Any], hedge: bool):
+    """One attempt, plus a hedged duplicate if it outlives the latency threshold"""
+    threshold = _hedge_after(endpoint, policy) if hedge else None
+    primary = asyncio.ensure_future(call())
+    if threshold is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=threshold)
+    if done:
+        return primary.result()
+
+    # A hedge only goes out on spare capacity - it must never push others into the queue
+    if not scheduler.try_acquire():
+        return await primary
+
+    _count(endpoint, 'hedges')
+    hedged = asyncio.ensure_future(call())
+    winner = []
+    unfinished = {primary, hedged}
+
+    def _finished(task):
+        # The loser is left to run: cancelling the task would not stop the SDK call in
+        # its thread, which keeps a connection (and spends tokens) until it returns.
+        # The extra slot is only given back once both requests have really ended.
+        unfinished.discard(task)
+        if not task.cancelled() and task.exception() is None:
+            if winner:
+                _count(endpoint, 'hedge_wasted_tokens', _usage_tokens(task.result()))
+            else:
+                winner.append(task)
+        if not unfinished:
+            scheduler.release()
+
+    # Registered before asyncio.wait's own callback, so `winner` is set by the time it returns
+    primary.add_done_callback(_finished)
+    hedged.add_done_callback(_finished)
+
+    pending = {primary, hedged}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if winner:
+            if winner[0] is hedged:
+                _count(endpoint, 'hedge_wins')
+            return winner[0].result()
+        error = next(iter(done)).exception()
+    raise error
+
+
+async def call_with_resilience(call: Callable[[], Awaitable[Any]], endpoint: str = 'default', hedge: bool = True):
+    """
+    Run `call` (a coroutine factory making one model request) with the
+    endpoint's retry/hedge policy behind the shared circuit breaker.
+
+    Raises:
+        LLMUnavailable: breaker open, or retryable failures outlasted the retries
+        the provider error itself when it isn't retryable (bad request, auth)
+    """
+    policy = get_policy(endpoint)
+    _count(endpoint, 'calls')
+
+    attempt = 0
+    while True:
+        breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = await _attempt(call, endpoint, policy, hedge)
+        except asyncio.CancelledError:
+            # Client disconnected or the caller gave up: says nothing about the
+            # provider, but a half-open probe must not stay in flight forever
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not is_retryable(e):
+                # Caller errors (400, auth) say nothing about provider health
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= policy['max_retries']:
+                _count(endpoint, 'failures')
+                logger.error(f"LLM {endpoint} failed after {attempt + 1} attempts: {e}")
+                raise LLMUnavailable(max(1, math.ceil(_retry_after_header(e) or policy['max_delay']))) from e
+            delay = backoff_delay(attempt, policy, e)
+            attempt += 1
+            _count(endpoint, 'retries')
+            logger.warning(f"LLM {endpoint} attempt {attempt} failed ({e.__class__.__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+
+        breaker.record_success()
+        _latencies.setdefault(endpoint, deque(maxlen=_LATENCY_SAMPLES)).append(time.monotonic() - started)
+        return result
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        'breaker': breaker.stats(),
+        'hedge_endpoints': sorted(HEDGE_ENDPOINTS),
+        'endpoints': {
+            endpoint: dict(counters, hedge_after_seconds=_hedge_after(endpoint, get_policy(endpoint)))
+            for endpoint, counters in _counters.items()
+        },
+    }
@@ -0,0 +1,243 @@
+"""
+LLM Scheduler - Admission control in front of every model call
+A global concurrency limit shared by all requests in the worker, with one
+FIFO queue per subscription tier served by weighted fair (stride)
+scheduling, so a burst from one tier can't starve the others. Waiters give
+up at their queue deadline, and a saturated queue is rejected immediately
+with a 429 and a Retry-After estimate instead of piling up
+
+LLM_MAX_CONCURRENCY is the limit for the whole deployment. Each worker
+process has its own scheduler, so it takes an equal share (rounded up):
+LLM_WORKERS, which gunicorn.conf.py sets, or WEB_CONCURRENCY, or 1
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '8'))
+LLM_WORKERS = max(1, int(os.getenv('LLM_WORKERS') or os.getenv('WEB_CONCURRENCY') or '1'))
+# This worker's share of the deployment-wide limit
+LLM_WORKER_CONCURRENCY = max(1, math.ceil(LLM_MAX_CONCURRENCY / LLM_WORKERS))
+LLM_MAX_QUEUE_PER_TIER = int(os.getenv('LLM_MAX_QUEUE_PER_TIER', '50'))
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '20'))
+
+# Share of freed slots each tier gets while several tiers are waiting
+TIER_WEIGHTS = {
+    'free': 1,
+    'basic': 2,
+    'premium': 4,
+    'pro': 8,
+}
+DEFAULT_TIER = 'free'
+
+# Recent waits/service times kept per tier for percentiles and Retry-After
+_SAMPLE_SIZE = 500
+
+
+class LLMOverloaded(HTTPException):
+    """429 raised when a request can't be admitted; carries Retry-After"""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(
+            status_code=429,
+            detail=detail,
+            headers={'Retry-After': str(retry_after)},
+        )
+        self.retry_after = retry_after
+
+
+def _percentile(samples, pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+class LLMScheduler:
+    """
+    Weighted fair admission for a fixed number of concurrent model calls.
+
+    Each tier keeps a stride 'pass' value; when a slot frees up the
+    non-empty queue with the lowest pass is served and its pass advances by
+    1/weight. A tier that was idle re-enters at the current minimum pass so
+    it can't bank credit while idle.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = LLM_WORKER_CONCURRENCY,
+        max_queue: int = LLM_MAX_QUEUE_PER_TIER,
+        weights: Optional[Dict[str, int]] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.weights = dict(weights or TIER_WEIGHTS)
+        self.active = 0
+        self._queues = {tier: deque() for tier in self.weights}
+        self._pass = {tier: 0.0 for tier in self.weights}
+        self._lock = threading.Lock()
+        self._waits = {tier: deque(maxlen=_SAMPLE_SIZE) for tier in self.weights}
+        self._service = deque(maxlen=_SAMPLE_SIZE)
+        self._counters = {tier: {'admitted': 0, 'rejected': 0, 'timed_out': 0} for tier in self.weights}
+
+    def _tier(self, tier: Optional[str]) -> str:
+        return tier if tier in self.weights else DEFAULT_TIER
+
+    def retry_after(self, tier: str) -> int:
+        """Rough seconds until a new request in this tier would be admitted"""
+        service = sum(self._service) / len(self._service) if self._service else 10.0
+        ahead = len(self._queues[self._tier(tier)]) + 1
+        return max(1, math.ceil(service * ahead / max(self.max_concurrency, 1)))
+
+    def check_admission(self, tier: Optional[str]):
+        """Raise LLMOverloaded now if this tier's queue is already full"""
+        tier = self._tier(tier)
+        if len(self._queues[tier]) >= self.max_queue:
+            self._counters[tier]['rejected'] += 1
+            raise LLMOverloaded(
+                "The AI service is busy right now. Please try again shortly.",
+                self.retry_after(tier),
+            )
+
+    async def acquire(self, tier: Optional[str], timeout: Optional[float] = None) -> float:
+        """
+        Wait for a slot. Returns the time spent queued in seconds.
+
+        Raises:
+            LLMOverloaded: queue saturated, or the queue deadline passed
+        """
+        tier = self._tier(tier)
+        started = time.monotonic()
+
+        with self._lock:
+            if self.active < self.max_concurrency and not any(self._queues.values()):
+                self.active += 1
+                self._admitted(tier, 0.0)
+                return 0.0
+            self.check_admission(tier)
+            if not self._queues[tier]:
+                # Re-entering tier starts at the current minimum pass
+                busy = [self._pass[t] for t, q in self._queues.items() if q]
+                if busy:
+                    self._pass[tier] = max(self._pass[tier], min(busy))
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues[tier].append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout or LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as the deadline hit - keep the slot
+                    pass
+                else:
+                    waiter.cancel()
+                    self._remove(tier, waiter)
+                    self._counters[tier]['timed_out'] += 1
+                    raise LLMOverloaded(
+                        "The AI service is busy right now. Please try again shortly.",
+                        self.retry_after(tier),
+                    )
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_locked()
+                else:
+                    waiter.cancel()
+                    self._remove(tier, waiter)
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._admitted(tier, waited)
+        return waited
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free right now and nobody is queued"""
+        with self._lock:
+            if self.active < self.max_concurrency and not any(self._queues.values()):
+                self.active += 1
+                return True
+            return False
+
+    def release(self, service_seconds: Optional[float] = None):
+        with self._lock:
+            if service_seconds is not None:
+                self._service.append(service_seconds)
+            self._release_locked()
+
+    @asynccontextmanager
+    async def slot(self, tier: Optional[str], timeout: Optional[float] = None):
+        await self.acquire(tier, timeout)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def _admitted(self, tier: str, waited: float):
+        self._counters[tier]['admitted'] += 1
+        self._waits[tier].append(waited)
+
+    def _remove(self, tier: str, waiter):
+        try:
+            self._queues[tier].remove(waiter)
+        except ValueError:
+            pass
+
+    def _release_locked(self):
+        self.active -= 1
+        while self.active < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                break
+            self.active += 1
+            # Waiters may belong to another loop thread in tests; grant safely
+            waiter.get_loop().call_soon_threadsafe(self._grant, waiter)
+
+    def _grant(self, waiter):
+        if waiter.cancelled():
+            # Gave up after being picked - hand the slot on
+            self.release()
+        else:
+            waiter.set_result(True)
+
+    def _next_waiter(self):
+        candidates = [tier for tier, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+        tier = min(candidates, key=lambda t: (self._pass[t], -self.weights[t]))
+        self._pass[tier] += 1.0 / self.weights[tier]
+        return self._queues[tier].popleft()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'workers': LLM_WORKERS,
+            'active': self.active,
+            'avg_service_seconds': round(sum(self._service) / len(self._service), 3) if self._service else None,
+            'tiers': {
+                tier: {
+                    'weight': self.weights[tier],
+                    'queue_depth': len(self._queues[tier]),
+                    'wait_p50': _percentile(self._waits[tier], 50),
+                    'wait_p95': _percentile(self._waits[tier], 95),
+                    **self._counters[tier],
+                }
+                for tier in self.weights
+            },
+        }
+
+
+scheduler = LLMScheduler()
@@ -0,0 +1,357 @@
+"""
+Metrics - In-process Prometheus metrics in the text exposition format
+Request latency and in-flight requests per route template (ASGI
+middleware), DB query count/time per request and pool usage (SQLAlchemy
+events), LLM latency and token usage per endpoint and model, and latency of
+external calls (Stripe, Resend). Served at /metrics.
+
+Metrics are per process; with several workers, scrape each one or
+aggregate at the collector
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# When set, /metrics requires ?token= or 'Authorization: Bearer <token>'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0, 120.0, 180.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collect_hooks: List[Callable[[], None]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def on_collect(self, hook: Callable[[], None]):
+        """Run before every scrape - for gauges read from elsewhere (pool stats)"""
+        self._collect_hooks.append(hook)
+
+    def render(self) -> str:
+        for hook in self._collect_hooks:
+            try:
+                hook()
+            except Exception as e:
+                logger.warning(f"Metrics collect hook failed: {e}")
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+# ==================== METRIC DEFINITIONS ====================
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests by route template and status', ('method', 'route', 'status')))
+HTTP_DURATION = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route template', ('method', 'route')))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served'))
+
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'db_query_duration_seconds', 'Duration of individual SQL statements', ('engine',), DB_LATENCY_BUCKETS))
+DB_QUERIES_PER_REQUEST = REGISTRY.register(Histogram(
+    'db_queries_per_request', 'SQL statements executed while serving one request', ('route',), QUERY_COUNT_BUCKETS))
+DB_TIME_PER_REQUEST = REGISTRY.register(Histogram(
+    'db_time_per_request_seconds', 'Total SQL time while serving one request', ('route',), LATENCY_BUCKETS))
+DB_POOL = REGISTRY.register(Gauge(
+    'db_pool_connections', 'Connection pool usage by state', ('engine', 'state')))
+
+LLM_DURATION = REGISTRY.register(Histogram(
+    'llm_request_duration_seconds', 'Model call latency after admission, retries included', ('endpoint', 'model', 'outcome'), LLM_BUCKETS))
+LLM_TOKENS = REGISTRY.register(Counter(
+    'llm_tokens_total', 'Model tokens by type (input, output, cache_read, cache_write)', ('endpoint', 'model', 'type')))
+
+EXTERNAL_DURATION = REGISTRY.register(Histogram(
+    'external_request_duration_seconds', 'Latency of calls to external services', ('service', 'operation', 'outcome')))
+
+PASSWORD_HASH_DURATION = REGISTRY.register(Histogram(
+    'password_hash_duration_seconds', 'bcrypt hash/verify time, pool queue wait included', ('operation',)))
+
+RATE_LIMITED = REGISTRY.register(Counter(
+    'rate_limited_requests_total', 'Requests rejected with 429 by rate-limit policy', ('policy',)))
+
+
+# ==================== HTTP ====================
+
+def route_template(scope: Dict[str, Any], status: int) -> str:
+    """Matched route path ('/api/protocols/{protocol_id}') - never the raw URL, to bound cardinality"""
+    route = scope.get('route')
+    path = getattr(route, 'path', None)
+    if path:
+        return path
+    if status != 404 and scope.get('root_path'):
+        # Mounted sub-app (static files)
+        return scope['root_path'] + '/{path}'
+    return 'unmatched'
+
+
+class _DbUsage:
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+_request_db: ContextVar[Optional[_DbUsage]] = ContextVar('request_db_usage', default=None)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses are timed to their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        usage = _DbUsage()
+        token = _request_db.set(usage)
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            _request_db.reset(token)
+            route = route_template(scope, status)
+            method = scope.get('method', '')
+            HTTP_REQUESTS.inc(method=method, route=route, status=status)
+            HTTP_DURATION.observe(elapsed, method=method, route=route)
+            DB_QUERIES_PER_REQUEST.observe(usage.count, route=route)
+            DB_TIME_PER_REQUEST.observe(usage.seconds, route=route)
+
+
+# ==================== DATABASE ====================
+
+def instrument_engine(engine, name: str):
+    """Time every statement on `engine` and export its pool usage"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        DB_QUERY_DURATION.observe(elapsed, engine=name)
+        usage = _request_db.get()
+        if usage is not None:
+            usage.count += 1
+            usage.seconds += elapsed
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        # A failed statement never reaches after_cursor_execute
+        starts = context.connection.info.get('metrics_query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+    def _collect_pool():
+        pool = engine.pool
+        for state, reader in (('size', 'size'), ('checked_in', 'checkedin'), ('checked_out', 'checkedout'), ('overflow', 'overflow')):
+            read = getattr(pool, reader, None)
+            if callable(read):
+                # QueuePool.overflow() counts up from -pool_size
+                DB_POOL.set(max(0, read()), engine=name, state=state)
+
+    REGISTRY.on_collect(_collect_pool)
+
+
+# ==================== LLM ====================
+
+def observe_llm(endpoint: str, model: Optional[str], seconds: float, outcome: str, usage: Any = None):
+    """Record one model call; `usage` is the SDK usage object or a dict with the same fields"""
+    model = model or 'unknown'
+    LLM_DURATION.observe(seconds, endpoint=endpoint, model=model, outcome=outcome)
+    if usage is None:
+        return
+    for field, kind in (
+        ('input_tokens', 'input'),
+        ('output_tokens', 'output'),
+        ('cache_read_input_tokens', 'cache_read'),
+        ('cache_creation_input_tokens', 'cache_write'),
+    ):
+        value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+        if value:
+            LLM_TOKENS.inc(value, endpoint=endpoint, model=model, type=kind)
+
+
+# ==================== EXTERNAL SERVICES ====================
+
+@contextmanager
+def track_external(service: str, operation: str):
+    """Time a blocking call to Stripe/Resend/etc.; exceptions are recorded and re-raised"""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        EXTERNAL_DURATION.observe(time.perf_counter() - started, service=service, operation=operation, outcome=outcome)
@@ -0,0 +1,382 @@
+"""
+Rate Limit - Token-bucket limits per user, per IP and per portal token
+Every request spends a token from its principal's bucket (the user id when
+the bearer token is valid, otherwise the client IP), sized by
+RATE_LIMIT_PER_MINUTE / RATE_LIMIT_PER_HOUR. Costly or guessable routes also
+spend from a stricter bucket of their own: model calls per user, login and
+password reset per IP, and the unauthenticated /client-view/{token} pages
+per portal token.
+
+Buckets live in Redis (REDIS_URL) so limits hold across workers, or in
+process when Redis is absent or failing. All of a request's buckets are
+checked and charged in one Lua call, off the event loop, all-or-nothing:
+a refused request spends no tokens.
+Responses carry RateLimit-Limit / -Remaining / -Reset / -Policy headers for
+the bucket closest to empty, and 429s a Retry-After.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+from app.auth import decode_token, user_id_from_claims
+from app.services import metrics
+from app.services.cache import get_redis, mark_redis_failed
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '60'))
+RATE_LIMIT_PER_HOUR = int(os.getenv('RATE_LIMIT_PER_HOUR', '1000'))
+RATE_LIMIT_LLM_PER_MINUTE = int(os.getenv('RATE_LIMIT_LLM_PER_MINUTE', '10'))
+RATE_LIMIT_LLM_PER_HOUR = int(os.getenv('RATE_LIMIT_LLM_PER_HOUR', '200'))
+RATE_LIMIT_AUTH_PER_MINUTE = int(os.getenv('RATE_LIMIT_AUTH_PER_MINUTE', '10'))
+RATE_LIMIT_AUTH_PER_HOUR = int(os.getenv('RATE_LIMIT_AUTH_PER_HOUR', '100'))
+RATE_LIMIT_PORTAL_PER_MINUTE = int(os.getenv('RATE_LIMIT_PORTAL_PER_MINUTE', '30'))
+RATE_LIMIT_PORTAL_PER_HOUR = int(os.getenv('RATE_LIMIT_PORTAL_PER_HOUR', '300'))
+# 'redis' (falls back to memory when Redis is unavailable) or 'memory'
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'redis').lower()
+# Buckets kept per worker by the in-process backend; the least recently used go first
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+# Proxies in front of the app that append to X-Forwarded-For (Railway's edge is one);
+# 0 uses the socket peer address
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+
+REDIS_PREFIX = 'tol:rl:'
+
+EXEMPT_PREFIXES = ('/health', '/metrics', '/static', '/docs', '/redoc', '/openapi.json')
+
+
+class Limit:
+    """`count` requests per `window` seconds, refilled continuously, bursts up to `count`"""
+    __slots__ = ('count', 'window', 'rate')
+
+    def __init__(self, count: int, window: int):
+        self.count = count
+        self.window = window
+        self.rate = count / window
+
+
+class Policy:
+    def __init__(self, name: str, limits: List[Limit]):
+        self.name = name
+        self.limits = [limit for limit in limits if limit.count > 0]
+        self.header = ', '.join(f"{limit.count};w={limit.window}" for limit in self.limits)
+
+
+DEFAULT_POLICY = Policy('default', [Limit(RATE_LIMIT_PER_MINUTE, 60), Limit(RATE_LIMIT_PER_HOUR, 3600)])
+LLM_POLICY = Policy('llm', [Limit(RATE_LIMIT_LLM_PER_MINUTE, 60), Limit(RATE_LIMIT_LLM_PER_HOUR, 3600)])
+AUTH_POLICY = Policy('auth', [Limit(RATE_LIMIT_AUTH_PER_MINUTE, 60), Limit(RATE_LIMIT_AUTH_PER_HOUR, 3600)])
+PORTAL_POLICY = Policy('portal', [Limit(RATE_LIMIT_PORTAL_PER_MINUTE, 60), Limit(RATE_LIMIT_PORTAL_PER_HOUR, 3600)])
+
+# (methods, path pattern, policy, bucket key) - first match wins. Keys:
+# 'principal' = user id or IP, 'ip' = always the IP, 'token' = portal token (group 1)
+RULES = [
+    (frozenset({'POST'}), re.compile(r'^/api/auth/(?:login|register|request-password-reset|reset-password)$'), AUTH_POLICY, 'ip'),
+    (frozenset({'POST'}), re.compile(
+        r'^/api/(?:chat/conversations(?:/[^/]+/messages)?|health/ai-analysis(?:/stream)?|health/explain-value|lab-results/upload)$'
+    ), LLM_POLICY, 'principal'),
+    (frozenset({'GET', 'POST'}), re.compile(r'^/api/client(?:-view|/view)/(?!generate$)([^/]+)'), PORTAL_POLICY, 'token'),
+]
+
+
+# ==================== BACKENDS ====================
+
+class MemoryBackend:
+    """Buckets in this worker only; touched from the event loop thread"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # bucket key -> [tokens, last refill time]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def hit(self, buckets: List[Tuple[str, Limit]], now: float) -> Tuple[bool, List[float]]:
+        """Spend one token from every bucket, or from none if any is empty"""
+        states = []
+        for key, limit in buckets:
+            state = self._buckets.get(key)
+            if state is None:
+                state = [float(limit.count), now]
+                self._buckets[key] = state
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                state[0] = min(limit.count, state[0] + (now - state[1]) * limit.rate)
+                state[1] = now
+            states.append(state)
+
+        allowed = all(state[0] >= 1 for state in states)
+        if allowed:
+            for state in states:
+                state[0] -= 1
+        return allowed, [state[0] for state in states]
+
+    def reset(self):
+        self._buckets.clear()
+
+
+# KEYS: one hash per bucket (every policy the request falls under).
+# ARGV: count, window for each bucket. All-or-nothing: a request is only
+# charged if every bucket has a token. Server time keeps workers on one clock.
+_TOKEN_BUCKET_LUA = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = {}
+local allowed = 1
+for i = 1, #KEYS do
+    local count = tonumber(ARGV[2 * i - 1])
+    local rate = count / tonumber(ARGV[2 * i])
+    local state = redis.call('HMGET', KEYS[i], 't', 'ts')
+    local available = tonumber(state[1])
+    if available == nil then
+        available = count
+    else
+        available = math.min(count, available + math.max(0, now - tonumber(state[2])) * rate)
+    end
+    tokens[i] = available
+    if available < 1 then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i = 1, #KEYS do
+    if allowed == 1 then
+        tokens[i] = tokens[i] - 1
+    end
+    redis.call('HSET', KEYS[i], 't', tostring(tokens[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], tonumber(ARGV[2 * i]))
+    result[i + 1] = tostring(tokens[i])
+end
+return result
+"""
+
+
+class RedisBackend:
+    """
+    Buckets shared by every worker; None from hit() means 'use the fallback'.
+    One script call per request. The keys of one request span principals
+    (user, IP, portal token), so this needs a single Redis node, not Cluster.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._script = None
+
+    @staticmethod
+    def available() -> bool:
+        return get_redis() is not None
+
+    def hit(self, buckets: List[Tuple[str, Limit]]) -> Optional[Tuple[bool, List[float]]]:
+        """Blocking (network round trip) - call it from a worker thread"""
+        client = get_redis()
+        if client is None:
+            return None
+        if client is not self._client:
+            self._client = client
+            self._script = client.register_script(_TOKEN_BUCKET_LUA)
+        keys = [REDIS_PREFIX + key for key, _ in buckets]
+        args = []
+        for _, limit in buckets:
+            args += [limit.count, limit.window]
+        try:
+            result = self._script(keys=keys, args=args)
+        except Exception as e:
+            mark_redis_failed(e)
+            return None
+        return bool(int(result[0])), [float(value) for value in result[1:]]
+
+
+# ==================== DECISIONS ====================
+
+class Decision:
+    __slots__ = ('allowed', 'policy', 'limit', 'remaining', 'reset', 'retry_after')
+
+    def __init__(self, allowed: bool, policy: Policy, limits: List[Limit], tokens: List[float]):
+        self.allowed = allowed
+        self.policy = policy
+        # Report the bucket closest to empty
+        index = min(range(len(limits)), key=lambda i: tokens[i] / limits[i].count)
+        limit = limits[index]
+        available = max(tokens[index], 0.0)
+        self.limit = limit
+        self.remaining = int(available)
+        self.reset = math.ceil((limit.count - available) / limit.rate)
+        self.retry_after = 0 if allowed else max(1, math.ceil((1 - available) / limit.rate))
+
+    def headers(self) -> List[Tuple[bytes, bytes]]:
+        headers = [
+            (b'ratelimit-limit', str(self.limit.count).encode()),
+            (b'ratelimit-remaining', str(self.remaining).encode()),
+            (b'ratelimit-reset', str(self.reset).encode()),
+            (b'ratelimit-policy', self.policy.header.encode()),
+        ]
+        if not self.allowed:
+            headers.append((b'retry-after', str(self.retry_after).encode()))
+        return headers
+
+
+def client_ip(scope) -> str:
+    if TRUSTED_PROXY_HOPS > 0:
+        for name, value in scope.get('headers') or ():
+            if name == b'x-forwarded-for':
+                hops = [hop.strip() for hop in value.decode('latin-1').split(',') if hop.strip()]
+                if hops:
+                    # Entries left of the ones our proxies appended are client-controlled
+                    return hops[max(0, len(hops) - TRUSTED_PROXY_HOPS)]
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def _authenticated_user(scope) -> Optional[str]:
+    """Verified user id from the bearer token, shared with app.auth via request.state"""
+    state = scope.setdefault('state', {})
+    if 'user_id' in state:
+        return state['user_id']
+    for name, value in scope.get('headers') or ():
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            if scheme.lower() != 'bearer' or not token.strip():
+                return None
+            try:
+                claims = decode_token(token.strip())
+                user_id = user_id_from_claims(claims)
+            except Exception:
+                # Invalid tokens are limited by IP; the route itself answers 401
+                return None
+            state['token_claims'] = claims
+            state['user_id'] = user_id
+            return user_id
+    return None
+
+
+class RateLimiter:
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND, rules: Optional[list] = None, default_policy: Optional[Policy] = None):
+        self.memory = MemoryBackend()
+        self.redis = RedisBackend() if backend == 'redis' else None
+        self.rules = RULES if rules is None else rules
+        self.default_policy = default_policy or DEFAULT_POLICY
+
+    def checks(self, scope) -> List[Tuple[Policy, str]]:
+        """(policy, bucket key) pairs this request is charged against; empty when it isn't limited"""
+        path = scope.get('path', '')
+        method = scope.get('method', '')
+        if method == 'OPTIONS' or path.startswith(EXEMPT_PREFIXES):
+            return []
+
+        user_id = _authenticated_user(scope)
+        ip = None
+        if user_id:
+            principal = f"user:{user_id}"
+        else:
+            ip = client_ip(scope)
+            principal = f"ip:{ip}"
+
+        checks = []
+        for methods, pattern, policy, key in self.rules:
+            match = pattern.match(path) if method in methods else None
+            if match:
+                if key == 'token':
+                    # Portal tokens are credentials; keep only a digest as the key
+                    digest = hashlib.sha1(match.group(1).encode('utf-8')).hexdigest()[:16]
+                    checks.append((policy, f"token:{digest}"))
+                elif key == 'ip':
+                    checks.append((policy, f"ip:{ip or client_ip(scope)}"))
+                else:
+                    checks.append((policy, principal))
+                break
+        checks.append((self.default_policy, principal))
+        return [(policy, key) for policy, key in checks if policy.limits]
+
+    @staticmethod
+    def _buckets(checks: List[Tuple[Policy, str]]) -> List[Tuple[str, Limit]]:
+        return [
+            (f"{policy.name}:{key}:{limit.window}", limit)
+            for policy, key in checks for limit in policy.limits
+        ]
+
+    @staticmethod
+    def _decision(checks: List[Tuple[Policy, str]], allowed: bool, tokens: List[float]) -> Decision:
+        decision = None
+        offset = 0
+        for policy, _ in checks:
+            own = tokens[offset:offset + len(policy.limits)]
+            offset += len(policy.limits)
+            current = Decision(allowed, policy, policy.limits, own)
+            if not allowed and min(own) < 1:
+                # Report the policy that refused the request
+                return current
+            if decision is None or current.remaining < decision.remaining:
+                decision = current
+        return decision
+
+    def check_local(self, scope) -> Optional[Decision]:
+        """check() against the in-process buckets only; never blocks"""
+        checks = self.checks(scope)
+        if not checks:
+            return None
+        allowed, tokens = self.memory.hit(self._buckets(checks), time.monotonic())
+        return self._decision(checks, allowed, tokens)
+
+    async def check(self, scope) -> Optional[Decision]:
+        """Spend tokens for this request; None when it isn't rate limited"""
+        checks = self.checks(scope)
+        if not checks:
+            return None
+        buckets = self._buckets(checks)
+        result = None
+        if self.redis is not None and self.redis.available():
+            # The round trip runs off the event loop
+            result = await asyncio.to_thread(self.redis.hit, buckets)
+        if result is None:
+            result = self.memory.hit(buckets, time.monotonic())
+        return self._decision(checks, *result)
+
+    def reset(self):
+        self.memory.reset()
+
+
+limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware; install inside CORS so 429s still carry CORS headers"""
+
+    def __init__(self, app, limiter: RateLimiter = limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        decision = await self.limiter.check(scope)
+        if decision is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = decision.headers()
+        if not decision.allowed:
+            metrics.RATE_LIMITED.inc(policy=decision.policy.name)
+            response = JSONResponse(
+                {"detail": f"Too many requests. Try again in {decision.retry_after} seconds."},
+                status_code=429,
+            )
+            response.raw_headers.extend(headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = list(message.get('headers', [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,183 @@
+"""
+Slow Query Log - Aggregates statements slower than SLOW_QUERY_MS by fingerprint
+A SQLAlchemy event hook times every statement; slow ones are normalized
+(sql_fingerprint) and counted with their total/max time, so a raw text()
+query repeated across a request loop shows up as one line. With
+SLOW_QUERY_EXPLAIN on, the first slow occurrence of each SELECT is re-run
+under EXPLAIN (ANALYZE, BUFFERS) on a separate connection in the background.
+
+Served at /api/admin/slow-queries; `python -m tools.slow_queries` dumps it.
+Parameters are never stored, but EXPLAIN ANALYZE plans can show the filter
+values they were run with - treat captured plans as patient data
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+
+from app.services import tracing
+from app.services.sql_fingerprint import fingerprint, fingerprint_id
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'false').lower() in ('1', 'true', 'yes')
+# EXPLAIN ANALYZE runs the query again; bound how long that may take
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '10000'))
+# Distinct fingerprints kept; new ones past this are counted as overflow
+SLOW_QUERY_MAX_FINGERPRINTS = int(os.getenv('SLOW_QUERY_MAX_FINGERPRINTS', '500'))
+
+# ANALYZE executes the statement, so only plain reads are explained
+_EXPLAINABLE = re.compile(r'^\s*SELECT\b', re.I)
+_LOCKING = re.compile(r'\bFOR\s+(UPDATE|SHARE|NO\s+KEY\s+UPDATE|KEY\s+SHARE)\b', re.I)
+
+_lock = threading.Lock()
+_entries: Dict[str, Dict[str, Any]] = {}
+_overflow = 0
+_since = datetime.now(timezone.utc)
+_explainer: Optional[ThreadPoolExecutor] = None
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _record(engine, name: str, statement: str, parameters: Any, seconds: float):
+    global _overflow
+    fingerprinted = fingerprint(statement)
+    key = fingerprint_id(fingerprinted)
+    elapsed_ms = seconds * 1000
+    with _lock:
+        entry = _entries.get(key)
+        first = entry is None
+        if first:
+            if len(_entries) >= SLOW_QUERY_MAX_FINGERPRINTS:
+                _overflow += 1
+                return
+            entry = _entries[key] = {
+                'fingerprint': key,
+                'statement': fingerprinted,
+                'engine': name,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'first_seen': _now(),
+                'explain': None,
+                'explain_status': 'disabled',
+            }
+        entry['count'] += 1
+        entry['total_ms'] += elapsed_ms
+        entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+        entry['last_seen'] = _now()
+        entry['last_trace_id'] = tracing.current_trace_id()
+
+    if not first:
+        return
+    logger.warning(f"Slow query {key} ({elapsed_ms:.0f}ms on {name}): {fingerprinted[:300]}")
+    if SLOW_QUERY_EXPLAIN:
+        _schedule_explain(engine, entry, statement, parameters)
+
+
+def _schedule_explain(engine, entry: Dict[str, Any], statement: str, parameters: Any):
+    global _explainer
+    if engine.dialect.name != 'postgresql':
+        entry['explain_status'] = 'skipped: not PostgreSQL'
+        return
+    if not _EXPLAINABLE.match(statement) or _LOCKING.search(statement):
+        entry['explain_status'] = 'skipped: not a plain SELECT'
+        return
+    if isinstance(parameters, list):
+        # executemany - no single plan to capture
+        entry['explain_status'] = 'skipped: executemany'
+        return
+    entry['explain_status'] = 'pending'
+    with _lock:
+        if _explainer is None:
+            # One at a time: EXPLAIN ANALYZE re-runs an already slow query
+            _explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+    _explainer.submit(_explain, engine, entry, statement, parameters)
+
+
+def _explain(engine, entry: Dict[str, Any], statement: str, parameters: Any):
+    # A raw DBAPI connection: no cursor events, so this neither recurses nor counts
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        try:
+            cursor.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+            # Same statement and parameters as the driver received ('%%' escapes included)
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+            raw.rollback()
+        entry['explain'] = plan
+        entry['explain_status'] = 'captured'
+    except Exception as e:
+        entry['explain_status'] = f"failed: {type(e).__name__}: {str(e).strip()[:200]}"
+        logger.warning(f"EXPLAIN for slow query {entry['fingerprint']} failed: {e}")
+    finally:
+        raw.close()
+
+
+def instrument_engine(engine, name: str):
+    """Record statements on `engine` that take longer than SLOW_QUERY_MS"""
+    threshold = SLOW_QUERY_MS / 1000
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if elapsed >= threshold:
+            try:
+                _record(engine, name, statement, parameters, elapsed)
+            except Exception as e:
+                logger.warning(f"Slow query log failed: {e}")
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        starts = context.connection.info.get('slow_query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def report(sort: str = 'total_ms', limit: int = 50) -> Dict[str, Any]:
+    """Slow fingerprints, worst first; sort by total_ms, count, max_ms or mean_ms"""
+    with _lock:
+        entries = [dict(entry) for entry in _entries.values()]
+        overflow = _overflow
+    for entry in entries:
+        entry['total_ms'] = round(entry['total_ms'], 1)
+        entry['max_ms'] = round(entry['max_ms'], 1)
+        entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 1)
+    if sort not in ('total_ms', 'count', 'max_ms', 'mean_ms'):
+        sort = 'total_ms'
+    entries.sort(key=lambda entry: entry[sort], reverse=True)
+    return {
+        'threshold_ms': SLOW_QUERY_MS,
+        'explain_enabled': SLOW_QUERY_EXPLAIN,
+        'since': _since.isoformat(),
+        'fingerprints': len(entries),
+        'overflow': overflow,
+        'queries': entries[:limit],
+    }
+
+
+def reset():
+    global _overflow, _since
+    with _lock:
+        _entries.clear()
+        _overflow = 0
+        _since = datetime.now(timezone.utc)
@@ -0,0 +1,38 @@
+"""
+SQL Fingerprint - Normalize statements so repeats of one query group together
+Literals, bind parameters and IN-lists become '?' and whitespace collapses,
+so "WHERE id = 5" and "WHERE id = 7" share a fingerprint. Used by tracing
+span attributes and the slow-query log
+"""
+import hashlib
+import re
+from functools import lru_cache
+
+MAX_LENGTH = 2000
+
+_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+# psycopg2 (%(name)s, %s), SQLAlchemy text() (:name, not '::type' casts), asyncpg ($1)
+_PARAM = re.compile(r'%\(\w+\)s|%s|(?<![:\w]):\w+|\$\d+')
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.I)
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_LIST = re.compile(r'(VALUES\s*\([?.,\s]*\))(?:\s*,\s*\([?.,\s]*\))+', re.I)
+_SPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """'SELECT * FROM users WHERE id = %(id_1)s' -> 'SELECT * FROM users WHERE id = ?'"""
+    sql = _COMMENT.sub(' ', statement)
+    sql = _STRING.sub('?', sql)
+    sql = _PARAM.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(?...)', sql)
+    sql = _VALUES_LIST.sub(r'\1, ...', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    return sql[:MAX_LENGTH]
+
+
+def fingerprint_id(fingerprinted: str) -> str:
+    """Short stable id for a fingerprint - for file names, log lines and URLs"""
+    return hashlib.sha1(fingerprinted.encode()).hexdigest()[:12]
@@ -0,0 +1,458 @@
+"""
+Tracing - Per-request span trees for finding where a slow request spent its time
+A root span per HTTP request (ASGI middleware), a child span per SQL
+statement with its fingerprint (SQLAlchemy events), a span per ORM commit,
+LLM spans with queue wait and token counts, and explicit spans around
+application steps (`with tracing.span('chat.load_history'):`).
+
+Finished traces go to a pluggable exporter - JSON lines in TRACE_FILE by
+default, one trace per line. Read them with `python -m tools.trace_report`.
+Off unless TRACING_ENABLED is set; unsampled requests pay one ContextVar lookup
+per statement
+"""
+import importlib
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event
+
+from app.services.metrics import route_template
+from app.services.sql_fingerprint import fingerprint, fingerprint_id
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+# 'jsonl', 'log', 'none' or 'package.module:ExporterClass'
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'jsonl')
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_FILE_MAX_MB = float(os.getenv('TRACE_FILE_MAX_MB', '100'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1.0'))
+# Only export requests at least this slow (the fast ones are rarely interesting)
+TRACE_MIN_DURATION_MS = float(os.getenv('TRACE_MIN_DURATION_MS', '0'))
+# Bounds memory for N+1 loops; extra spans are counted, not kept
+TRACE_MAX_SPANS = int(os.getenv('TRACE_MAX_SPANS', '1000'))
+
+
+# ==================== SPANS ====================
+
+class _Trace:
+    __slots__ = ('trace_id', 'started_at', 'spans', 'dropped')
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.spans: List['Span'] = []
+        self.dropped = 0
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start', 'end', 'attributes', 'status')
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.status = 'ok'
+
+    def child(self, name: str, attributes: Optional[Dict[str, Any]] = None) -> 'Span':
+        trace = self.trace
+        if len(trace.spans) >= TRACE_MAX_SPANS:
+            trace.dropped += 1
+            return NOOP_SPAN
+        span = Span(trace, name, self.span_id, attributes or {})
+        # list.append is atomic - SQL spans may come from to_thread workers
+        trace.spans.append(span)
+        return span
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_usage(self, usage: Any):
+        """Token attributes from the SDK usage object or a dict with the same fields"""
+        if usage is None:
+            return
+        for field, key in (
+            ('input_tokens', 'llm.input_tokens'),
+            ('output_tokens', 'llm.output_tokens'),
+            ('cache_read_input_tokens', 'llm.cache_read_tokens'),
+            ('cache_creation_input_tokens', 'llm.cache_write_tokens'),
+        ):
+            value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+            if value is not None:
+                self.attributes[key] = value
+
+    def set_status(self, status: str):
+        self.status = status
+
+    def record_error(self, exc: BaseException):
+        self.status = 'error'
+        self.attributes['error'] = type(exc).__name__
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+
+
+class _NoopSpan:
+    """Returned when the request is not traced, so call sites never branch"""
+    span_id = None
+
+    def child(self, name, attributes=None):
+        return self
+
+    def set(self, key, value):
+        pass
+
+    def set_usage(self, usage):
+        pass
+
+    def set_status(self, status):
+        pass
+
+    def record_error(self, exc):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current.get()
+    return span.trace.trace_id if span is not None else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current one; nested spans and SQL inside it attach to it"""
+    parent = _current.get()
+    if parent is None:
+        yield NOOP_SPAN
+        return
+    child = parent.child(name, attributes)
+    if child is NOOP_SPAN:
+        yield child
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        child.finish()
+
+
+def start_span(name: str, **attributes):
+    """
+    Child span that is not made current - the caller must finish() it.
+    For async generators, which may resume in another task's context
+    """
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return parent.child(name, attributes)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator: run the function (sync or async) inside a span"""
+    def decorate(fn: Callable):
+        span_name = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# ==================== EXPORTERS ====================
+
+class Exporter:
+    """Receives one finished trace (a JSON-serializable dict) per request"""
+
+    def export(self, trace: Dict[str, Any]):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class NullExporter(Exporter):
+    def export(self, trace):
+        pass
+
+
+class LogExporter(Exporter):
+    """One summary line per trace - for platforms where only stdout is kept"""
+
+    def export(self, trace):
+        logger.info(
+            f"trace {trace['trace_id']} {trace['method']} {trace['route']} {trace['status']} "
+            f"{trace['duration_ms']}ms spans={len(trace['spans'])}"
+        )
+
+
+class JsonlExporter(Exporter):
+    """Appends one JSON line per trace from a background thread; rotates to <file>.1"""
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = int(TRACE_FILE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: 'queue.Queue[Optional[Dict[str, Any]]]' = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, trace):
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning("Trace export queue full - dropping trace")
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < 500:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._write(batch)
+                    return
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + '.1')
+            with open(self.path, 'a') as f:
+                for trace in batch:
+                    f.write(json.dumps(trace, default=str) + '\n')
+        except OSError as e:
+            logger.warning(f"Could not write traces to {self.path}: {e}")
+
+
+EXPORTERS: Dict[str, Callable[[], Exporter]] = {
+    'jsonl': JsonlExporter,
+    'log': LogExporter,
+    'none': NullExporter,
+}
+
+_exporter: Optional[Exporter] = None
+_exporter_lock = threading.Lock()
+
+
+def _load_exporter(spec: str) -> Exporter:
+    if spec in EXPORTERS:
+        return EXPORTERS[spec]()
+    module_name, _, attr = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+def get_exporter() -> Exporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                try:
+                    _exporter = _load_exporter(TRACE_EXPORTER)
+                except Exception as e:
+                    logger.error(f"Trace exporter {TRACE_EXPORTER!r} failed to load, traces disabled: {e}")
+                    _exporter = NullExporter()
+    return _exporter
+
+
+def shutdown():
+    """Flush queued traces - called on worker shutdown"""
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+def set_exporter(exporter: Exporter):
+    """Swap the exporter at runtime (e.g. an OTLP bridge or an in-memory list)"""
+    global _exporter
+    with _exporter_lock:
+        previous, _exporter = _exporter, exporter
+    if previous is not None:
+        previous.shutdown()
+
+
+def _serialize(root: Span) -> Dict[str, Any]:
+    trace = root.trace
+    origin = root.start
+    spans = []
+    for s in trace.spans:
+        if s.end is None:
+            continue
+        spans.append({
+            'span_id': s.span_id,
+            'parent_id': s.parent_id,
+            'name': s.name,
+            'start_ms': round((s.start - origin) * 1000, 3),
+            'duration_ms': round((s.end - s.start) * 1000, 3),
+            'status': s.status,
+            'attributes': s.attributes,
+        })
+    return {
+        'trace_id': trace.trace_id,
+        'started_at': trace.started_at,
+        'name': root.name,
+        'method': root.attributes.get('http.method'),
+        'route': root.attributes.get('http.route'),
+        'status': root.attributes.get('http.status'),
+        'duration_ms': round((root.end - root.start) * 1000, 3),
+        'dropped_spans': trace.dropped,
+        'spans': spans,
+    }
+
+
+# ==================== HTTP ====================
+
+class TracingMiddleware:
+    """Pure ASGI middleware; the root span covers streamed responses to their last byte"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope['type'] != 'http' or random.random() >= TRACE_SAMPLE_RATE:
+            await self.app(scope, receive, send)
+            return
+
+        trace = _Trace()
+        method = scope.get('method', '')
+        root = Span(trace, 'http.request', None, {'http.method': method, 'http.path': scope.get('path')})
+        trace.spans.append(root)
+        status = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = list(message.get('headers', []))
+                headers.append((b'x-trace-id', trace.trace_id.encode()))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        token = _current.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            root.finish()
+            root.set('http.route', route_template(scope, status))
+            root.set('http.status', status)
+            if status >= 500:
+                root.status = 'error'
+            if (root.end - root.start) * 1000 >= TRACE_MIN_DURATION_MS:
+                try:
+                    get_exporter().export(_serialize(root))
+                except Exception as e:
+                    logger.warning(f"Trace export failed: {e}")
+
+
+# ==================== DATABASE ====================
+
+def instrument_engine(engine, name: str):
+    """A child span per statement on `engine`, labelled with its fingerprint"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is None:
+            return
+        fingerprinted = fingerprint(statement)
+        child = parent.child('db.query', {
+            'db.engine': name,
+            'db.statement': fingerprinted,
+            'db.fingerprint': fingerprint_id(fingerprinted),
+        })
+        if executemany:
+            child.set('db.executemany', True)
+        conn.info.setdefault('trace_query_spans', []).append(child)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_query_spans')
+        if not spans:
+            return
+        child = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            child.set('db.rows', cursor.rowcount)
+        child.finish()
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        spans = context.connection.info.get('trace_query_spans') if context.connection is not None else None
+        if spans:
+            child = spans.pop()
+            child.record_error(context.original_exception)
+            child.finish()
+
+
+def instrument_sessions(session_factory):
+    """A span per ORM commit (flush + COMMIT), so separate commits in one request show up"""
+
+    @event.listens_for(session_factory, 'before_commit')
+    def _before_commit(session):
+        session.info['trace_commit_span'] = start_span('db.commit')
+
+    @event.listens_for(session_factory, 'after_commit')
+    def _after_commit(session):
+        child = session.info.pop('trace_commit_span', None)
+        if child is not None:
+            child.finish()
+
+    @event.listens_for(session_factory, 'after_rollback')
+    def _after_rollback(session):
+        # Only reached with a pending span when the commit itself failed
+        child = session.info.pop('trace_commit_span', None)
+        if child is not None:
+            child.set_status('error')
+            child.finish()
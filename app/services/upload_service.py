@@ -0,0 +1,179 @@
+"""
+Upload Service - Size-limited multipart uploads
+UploadLimitMiddleware caps the request body of the upload routes while it is
+received - by Content-Length up front, and by counting bytes for chunked
+bodies - so an oversized upload is refused before Starlette parses (and
+spools) the multipart body. Starlette keeps each file in a temp file that
+rolls over to disk past 1MB; spool_upload checks its size and hashes it in
+place, without a second copy.
+
+Turning an upload into base64 for a model call or the database is the one
+unavoidable in-memory copy: the text is 4/3 of the file size, built chunk by
+chunk from the file, and briefly about twice that while the parts are joined.
+"""
+import base64
+import hashlib
+import logging
+import re
+
+from fastapi import HTTPException, UploadFile
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024  # 64KB
+# Divisible by 3 so per-chunk base64 output never carries padding mid-stream
+B64_CHUNK_SIZE = 3 * 16 * 1024
+# Room for multipart boundaries and the other form fields in the body
+MULTIPART_OVERHEAD = 64 * 1024
+
+LAB_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+LAB_UPLOAD_TOO_LARGE = "File too large. Maximum size is 10MB."
+CLIENT_IMAGE_MAX_BYTES = 5 * 1024 * 1024
+CLIENT_IMAGE_TOO_LARGE = "Image too large (max 5MB)"
+
+# POST routes that accept uploads -> (max file size, error detail)
+UPLOAD_LIMITS = [
+    (re.compile(r'^/api/lab-results/upload$'), LAB_UPLOAD_MAX_BYTES, LAB_UPLOAD_TOO_LARGE),
+    (re.compile(r'^/api/client-view/[^/]+/send-message$'), CLIENT_IMAGE_MAX_BYTES, CLIENT_IMAGE_TOO_LARGE),
+]
+
+
+class SpooledUpload:
+    """An upload that has been size-checked and hashed; `file` is Starlette's own spooled temp file"""
+
+    def __init__(self, file, size: int, sha256: str, filename: str, content_type: str):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+        self.content_type = content_type
+
+    def read(self) -> bytes:
+        """Read the whole spooled body - only for callers that truly need bytes"""
+        self.file.seek(0)
+        return self.file.read()
+
+    def b64encode(self) -> str:
+        """Base64 of the file, encoded chunk by chunk - the raw bytes are never all in memory"""
+        self.file.seek(0)
+        parts = []
+        while True:
+            chunk = self.file.read(B64_CHUNK_SIZE)
+            if not chunk:
+                break
+            parts.append(base64.b64encode(chunk).decode('ascii'))
+        self.file.seek(0)
+        return ''.join(parts)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=detail)
+
+
+class UploadLimitMiddleware:
+    """Pure ASGI middleware; refuses an oversized upload body while it is being received"""
+
+    def __init__(self, app, limits=UPLOAD_LIMITS):
+        self.app = app
+        self.limits = limits
+
+    def _limit_for(self, scope):
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            return None
+        for pattern, max_bytes, detail in self.limits:
+            if pattern.match(scope['path']):
+                return max_bytes + MULTIPART_OVERHEAD, detail
+        return None
+
+    async def __call__(self, scope, receive, send):
+        limit = self._limit_for(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+        max_body, detail = limit
+
+        content_length = dict(scope['headers']).get(b'content-length', b'')
+        if content_length.isdigit() and int(content_length) > max_body:
+            await JSONResponse({"detail": detail}, status_code=400)(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > max_body:
+                    # Surfaces from the multipart parser as this 400 (FastAPI re-raises HTTPException)
+                    raise UploadTooLarge(detail)
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message['type'] == 'http.response.start':
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except UploadTooLarge:
+            # Raised outside a route's exception handling
+            if started:
+                raise
+            await JSONResponse({"detail": detail}, status_code=400)(scope, receive, send)
+
+
+async def spool_upload(
+    upload: UploadFile,
+    max_bytes: int,
+    detail: str,
+    chunk_size: int = CHUNK_SIZE,
+) -> SpooledUpload:
+    """
+    Size-check and hash an UploadFile in place, reading it in chunks.
+
+    Args:
+        upload: The incoming UploadFile (already spooled by Starlette)
+        max_bytes: Maximum accepted size; exceeding it raises HTTP 400
+        detail: Error message for the 400 response
+        chunk_size: Read size per iteration
+
+    Returns:
+        SpooledUpload over the same file, positioned at offset 0
+    """
+    hasher = hashlib.sha256()
+    size = 0
+
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=400, detail=detail)
+        hasher.update(chunk)
+
+    await upload.seek(0)
+    # File names often carry patient names - never log them
+    logger.info(f"Spooled upload ({upload.content_type or 'unknown type'}, {size} bytes, sha256 {hasher.hexdigest()[:12]})")
+
+    return SpooledUpload(
+        file=upload.file,
+        size=size,
+        sha256=hasher.hexdigest(),
+        filename=upload.filename or '',
+        content_type=upload.content_type or ''
+    )
@@ -4,8 +4,11 @@ Loads 1 specialized skill based on query keywords
 Western Medicine is always embedded in enhanced_system_prompt.py
 """
 
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Map of specialized skills with their trigger keywords
 SKILL_MAP = {
     'ayurveda': {
@@ -113,7 +116,7 @@ def get_specialized_knowledge(query: str) -> str:
     
     # Check if file exists
     if not os.path.exists(file_path):
-        print(f"⚠️ Skill file not found: {file_path}")
+        logger.warning(f"⚠️ Skill file not found: {file_path}")
         return ''
     
     # Load and return file content
@@ -121,13 +124,13 @@ def get_specialized_knowledge(query: str) -> str:
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        print(f"🎯 Loading specialized skill: {skill_name.replace('_', ' ').title()}")
+        logger.info(f"🎯 Loading specialized skill: {skill_name.replace('_', ' ').title()}", extra={'event': 'skill.loaded', 'skill': skill_name})
         
         # Wrap in clear delimiters for the system prompt
         return f"\n\n{'='*80}\nSPECIALIZED KNOWLEDGE: {skill_name.upper()}\n{'='*80}\n\n{content}\n\n{'='*80}\n"
     
     except Exception as e:
-        print(f"❌ Error loading skill file {skill_file}: {e}")
+        logger.error(f"❌ Error loading skill file {skill_file}: {e}")
         return ''
 
 
@@ -0,0 +1,157 @@
+"""
+Benchmark Fixtures - Representative inputs for the hot-path microbenchmarks
+Sized like real traffic: long chat messages, a ~4000-token AI analysis,
+lab uploads with full panels and protocols with 50 items
+"""
+import random
+from typing import Any, Dict, List, Tuple
+
+_rng = random.Random(7)
+
+SHORT_MESSAGE = "How can I improve my sleep?"
+
+NO_MATCH_MESSAGE = "Can you explain what my recent blood pressure readings of 132/85 might mean for my heart health?"
+
+_LONG_SENTENCES = [
+    "I've been dealing with low energy for about six months now and it gets worse in the afternoon.",
+    "My practitioner mentioned my dosha might be out of balance, possibly vata given the dry skin and poor sleep.",
+    "I wake up around 3am most nights and my mind starts racing about work.",
+    "I tried cutting out caffeine after noon but it hasn't made a big difference yet.",
+    "My last labs showed ferritin at 18 and vitamin D at 22, both flagged low.",
+    "I take magnesium glycinate before bed and a B-complex in the morning.",
+    "Digestion has been irregular too, with bloating after meals that include bread or dairy.",
+    "I walk most days and do yoga twice a week, but strength training feels exhausting right now.",
+    "Stress at work is high and I notice my shoulders and jaw are tense by the evening.",
+    "Would herbal options like ashwagandha or holy basil be appropriate alongside what I'm taking?",
+]
+
+
+def long_message(sentences: int = 60) -> str:
+    """A ~1500 word message touching several traditions"""
+    return ' '.join(_rng.choice(_LONG_SENTENCES) for _ in range(sentences))
+
+
+_SECTION_TITLES = [
+    "Overall Health Assessment", "Lab Results Analysis", "Metrics Trends", "Medication Review",
+    "Integrative Recommendations", "Lifestyle Suggestions", "Western Medicine Perspective",
+    "Clinical Nutrition", "Herbal Medicine", "Supplement Recommendations",
+    "Ayurvedic Perspective", "TCM Perspective", "Action Items",
+]
+
+_ANALYSIS_LINES = [
+    "Your fasting glucose of 102 mg/dL sits just above the optimal range and is worth tracking.",
+    "- Consider a 10-15 minute walk after your largest meal to blunt post-prandial spikes.",
+    "The medication review shows no major interactions, but timing levothyroxine away from iron matters.",
+    "- Magnesium glycinate 300mg at night supports sleep quality and muscle relaxation.",
+    "From an Ayurvedic view, warm cooked meals and a regular routine help pacify vata.",
+    "In TCM terms the pattern resembles Spleen Qi deficiency with some Liver Qi stagnation.",
+    "**Note:** discuss any new supplement with your prescribing physician first.",
+    "1. Recheck ferritin and vitamin D in 12 weeks.",
+]
+
+
+def analysis_text(target_tokens: int = 4000) -> str:
+    """Markdown analysis in the shape the model returns, roughly target_tokens long"""
+    per_section = max(1, target_tokens * 4 // len(_SECTION_TITLES))
+    parts = []
+    for title in _SECTION_TITLES:
+        parts.append(f"## {title}")
+        body = []
+        while sum(len(line) + 1 for line in body) < per_section:
+            body.append(_rng.choice(_ANALYSIS_LINES))
+        parts.append('\n'.join(body))
+        parts.append('')
+    return '\n'.join(parts)
+
+
+_LAB_PANEL = [
+    ('Glucose', 'mg/dL', '70-99'), ('Hemoglobin A1c', '%', '4.0-5.6'), ('Total Cholesterol', 'mg/dL', '125-200'),
+    ('LDL Cholesterol', 'mg/dL', '<100'), ('HDL Cholesterol', 'mg/dL', '>40'), ('Triglycerides', 'mg/dL', '<150'),
+    ('Creatinine', 'mg/dL', '0.6-1.3'), ('BUN', 'mg/dL', '7-20'), ('ALT', 'U/L', '7-56'), ('AST', 'U/L', '10-40'),
+    ('TSH', 'mIU/L', '0.4-4.0'), ('Free T4', 'ng/dL', '0.8-1.8'), ('Vitamin D, 25-Hydroxy', 'ng/mL', '30-100'),
+    ('Vitamin B12', 'pg/mL', '200-900'), ('Ferritin', 'ng/mL', '30-400'), ('Hemoglobin', 'g/dL', '12.0-17.5'),
+    ('WBC', '10^3/uL', '4.5-11.0'), ('Platelets', '10^3/uL', '150-400'), ('Sodium', 'mmol/L', '135-145'),
+    ('Potassium', 'mmol/L', '3.5-5.1'), ('Calcium', 'mg/dL', '8.5-10.5'), ('Albumin', 'g/dL', '3.5-5.0'),
+    ('Iron', 'ug/dL', '60-170'), ('Magnesium', 'mg/dL', '1.7-2.2'), ('CRP', 'mg/L', '<3.0'),
+]
+
+
+def lab_results(uploads: int = 3) -> List[Dict[str, Any]]:
+    """Lab uploads as posted in health_data['lab_results'] - full panels of 25 values"""
+    results = []
+    for i in range(uploads):
+        results.append({
+            'test_type': 'Comprehensive Metabolic Panel',
+            'test_date': f"2025-0{i + 1}-15T00:00:00",
+            'provider': 'Quest Diagnostics',
+            'results': [
+                {'name': name, 'value': str(round(_rng.uniform(1, 150), 1)), 'unit': unit, 'reference_range': ref}
+                for name, unit, ref in _LAB_PANEL
+            ],
+        })
+    return results
+
+
+def protocol_fields(items: int = 50) -> Dict[str, Any]:
+    """Protocol JSON columns with `items` entries spread across the categories"""
+    supplements = [
+        {
+            'name': f"Supplement {i}", 'dosage': f"{100 * (i % 5 + 1)}mg", 'frequency': 'Twice daily',
+            'timing': 'Morning', 'with_food': 'With food', 'instructions': 'Take with a full glass of water',
+            'notes': 'Reduce if stomach upset' if i % 3 == 0 else '', 'start_week': 1 + i % 4,
+        }
+        for i in range(items * 2 // 5)
+    ]
+    exercises = [
+        {'name': f"Exercise {i}", 'duration': 20 + i, 'frequency': str(1 + i % 5), 'intensity': 'Moderate',
+         'instructions': 'Keep a steady pace', 'start_week': 1 + i % 3}
+        for i in range(items // 5)
+    ]
+    lifestyle = [
+        {'title': f"Habit {i}", 'category': 'Sleep' if i % 2 else 'Stress', 'frequency': 'Daily',
+         'description': 'Small consistent change', 'start_week': 1 + i % 4}
+        for i in range(items // 5)
+    ] + ['Stress Management: box breathing before meals', 'No screens after 9pm']
+    remaining = items - len(supplements) - len(exercises) - len(lifestyle)
+    nutrition = {
+        'dietary_approach': 'Mediterranean, anti-inflammatory',
+        'foods_to_include': [f"Food {i}" for i in range(max(remaining, 1))],
+        'foods_to_avoid': 'Refined sugar, alcohol; fried foods\nultra-processed snacks',
+        'meal_timing': 'Three meals, last meal by 7pm',
+        'hydration': '2.5L water daily',
+        'daily_calories': '2000',
+    }
+    return {
+        'supplements': supplements,
+        'exercises': exercises,
+        'lifestyle_changes': lifestyle,
+        'nutrition': nutrition,
+        'sleep': {'bedtime': '22:30', 'target_hours': 8, 'notes': 'Dim lights after 9pm'},
+        'stress_management': 'Box breathing twice daily',
+        'weekly_notes': {f"Week {week}": f"Focus on habit stacking, phase {week}" for week in range(1, 13)},
+    }
+
+
+def protocol_row(items: int = 50) -> Tuple:
+    """A protocols row as selected by get_client_view_data"""
+    fields = protocol_fields(items)
+    return (
+        'Sleep & Stress Reset', 'Twelve week integrative protocol', 'Ayurveda, Western', 12,
+        fields['supplements'], fields['exercises'], fields['lifestyle_changes'], fields['nutrition'],
+        fields['sleep'], fields['stress_management'], fields['weekly_notes'],
+    )
+
+
+def compliance_data(items: int = 50) -> Dict[str, bool]:
+    """Client check-off map keyed the way the portal sends it (category-index)"""
+    fields = protocol_fields(items)
+    data = {}
+    for category in ('supplements', 'exercises', 'lifestyle'):
+        key = 'lifestyle_changes' if category == 'lifestyle' else category
+        for i in range(len(fields[key])):
+            data[f"{category}-{i}"] = _rng.random() < 0.7
+    for i in range(5):
+        data[f"nutrition-{i}"] = _rng.random() < 0.7
+    for i in range(12):
+        data[f"timeline-{i}"] = _rng.random() < 0.5
+    return data
@@ -0,0 +1,154 @@
+"""
+Benchmark Runner - ns/op and allocations for the hot-path cases
+Timing uses timeit's autorange and keeps the best of --repeat runs (least
+scheduler noise); memory is measured with tracemalloc on a single warm call.
+
+Run:
+    python -m benchmarks.run
+    python -m benchmarks.run --filter skill_ --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --threshold 15
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from benchmarks.cases import CASES
+
+
+def measure(fn: Callable[[], Any], repeat: int, min_time: float) -> Dict[str, Any]:
+    timer = timeit.Timer(fn)
+    loops, _ = timer.autorange()
+    # autorange targets 0.2s; scale up when asked for longer runs
+    loops = max(1, int(loops * max(1.0, min_time / 0.2)))
+    runs = timer.repeat(repeat=repeat, number=loops)
+    per_op = sorted(run / loops * 1e9 for run in runs)
+
+    fn()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return {
+        'ns_per_op': round(per_op[0], 1),
+        'median_ns': round(per_op[len(per_op) // 2], 1),
+        'loops': loops,
+        'repeat': repeat,
+        'peak_bytes': peak - before,
+        'retained_bytes': current - before,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(pattern: Optional[str], repeat: int, min_time: float) -> Dict[str, Any]:
+    selected = [name for name in CASES if not pattern or re.search(pattern, name)]
+    results = {}
+    for name in selected:
+        # Some hot paths print on every call; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn = CASES[name]()
+            results[name] = measure(fn, repeat, min_time)
+        stats = results[name]
+        print(f"{name:<34} {_ns(stats['ns_per_op']):>12}/op  peak {_bytes(stats['peak_bytes']):>9}  retained {_bytes(stats['retained_bytes']):>9}")
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cases': results,
+    }
+
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], threshold: float) -> int:
+    """Print per-case deltas; returns how many cases slowed down past threshold (%)"""
+    print(f"\nbase {base.get('commit')} -> head {head.get('commit')}")
+    print(f"{'case':<34} {'base':>12} {'head':>12} {'time':>8} {'peak mem':>9}")
+    regressions = 0
+    for name, new in head['cases'].items():
+        old = base['cases'].get(name)
+        if old is None:
+            print(f"{name:<34} {'-':>12} {_ns(new['ns_per_op']):>12}  (new)")
+            continue
+        change = (new['ns_per_op'] - old['ns_per_op']) / old['ns_per_op'] * 100
+        memory = (new['peak_bytes'] - old['peak_bytes']) / old['peak_bytes'] * 100 if old['peak_bytes'] else 0.0
+        flag = ''
+        if change > threshold:
+            regressions += 1
+            flag = '  ⚠️ slower'
+        print(f"{name:<34} {_ns(old['ns_per_op']):>12} {_ns(new['ns_per_op']):>12} {change:>+7.1f}% {memory:>+8.1f}%{flag}")
+    return regressions
+
+
+def _ns(value: float) -> str:
+    if value >= 1e6:
+        return f"{value / 1e6:.2f} ms"
+    if value >= 1e3:
+        return f"{value / 1e3:.2f} µs"
+    return f"{value:.0f} ns"
+
+
+def _bytes(value: int) -> str:
+    if abs(value) >= 1024:
+        return f"{value / 1024:.1f} KiB"
+    return f"{value} B"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for pure-Python hot paths")
+    parser.add_argument('--filter', help="Regex on case names")
+    parser.add_argument('--list', action='store_true', help="List cases and exit")
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2, help="Seconds per repeat (approx.)")
+    parser.add_argument('--save', help="Write results JSON here (e.g. a baseline)")
+    parser.add_argument('--compare', help="Baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=10.0, help="Slowdown (%%) that fails --compare")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in CASES:
+            print(name)
+        return
+
+    result = run(args.filter, args.repeat, args.min_time)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Saved {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.threshold)
+        if regressions:
+            print(f"\n❌ {regressions} case(s) slower than baseline by more than {args.threshold}%")
+            sys.exit(1)
+        print("\n✅ No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Gunicorn Config - Production launcher for the API
+Several uvicorn workers (one per available CPU, at least two) so a
+CPU-bound burst - bcrypt, a large JSON body, lab parsing - stalls one worker
+instead of the whole service. The app is imported once in the master
+(preload) and shared copy-on-write with the workers; the one-time schema
+work runs there too, before forking, so recycled workers never repeat it.
+
+SIGTERM drains: workers stop accepting connections, finish in-flight
+requests (LLM streams can take minutes) for up to GRACEFUL_TIMEOUT seconds,
+then run the lifespan shutdown. Give the platform at least that long before
+it sends SIGKILL (Railway: RAILWAY_DEPLOYMENT_DRAINING_SECONDS).
+
+Run:
+    gunicorn -c gunicorn.conf.py app.main:app
+"""
+import asyncio
+import math
+import os
+
+
+def _available_cpus() -> int:
+    """CPUs this container may use - cgroup quota first, then affinity"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Each worker has its own DB pools (main + client_messages, up to 15
+# connections each), so the cap keeps the total under Postgres max_connections
+MAX_WORKERS = int(os.getenv('GUNICORN_MAX_WORKERS', '4'))
+workers = int(os.getenv('WEB_CONCURRENCY') or min(max(2, _available_cpus()), MAX_WORKERS))
+# Read when the app is imported: LLM_MAX_CONCURRENCY is split across the workers
+os.environ['LLM_WORKERS'] = str(workers)
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Recycle workers to bound slow memory growth; jitter keeps them from restarting together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+# Longest LLM call is ai_analysis at 180s per attempt (llm_resilience)
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '180'))
+# Worker heartbeat; uvicorn workers notify every second even while requests are in flight
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+accesslog = None
+errorlog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
+
+
+def on_starting(server):
+    """Master, before any worker exists: schema work once per deploy, then warm imports"""
+    from app import main
+    from app.logging_config import shutdown_logging
+    from app.services import lazy_import
+
+    # Already set when a release step ran them
+    if os.getenv('STARTUP_TASKS_DONE') != '1':
+        asyncio.run(main.run_startup_tasks())
+        os.environ['STARTUP_TASKS_DONE'] = '1'
+    # Imported here, the SDKs' pages are shared by every worker
+    lazy_import.warm()
+    # Calibrated once so every worker hashes (and rehashes) at the same cost
+    main.bcrypt_rounds()
+    # Connections must not cross the fork
+    main.engine.dispose()
+    main.client_messages.engine.dispose()
+    server.log.info(f"Startup tasks done; forking {server.num_workers} workers")
+    # No threads across the fork either - each worker starts its own log writer
+    shutdown_logging()
+
+
+def post_fork(server, worker):
+    from app import main
+    from app.logging_config import after_fork
+
+    after_fork()
+    # Drop any pooled connections inherited from the master without closing them for it
+    main.engine.dispose(close=False)
+    main.client_messages.engine.dispose(close=False)
+
+
+def worker_int(worker):
+    worker.log.info(f"Worker {worker.pid} interrupted")
+
+
+def on_exit(server):
+    server.log.info("Gunicorn master exiting")
@@ -0,0 +1,61 @@
+from app.services import account_cache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.ops = []
+
+    def incr(self, key):
+        self.ops.append(lambda data: data.__setitem__(key, str(int(data.get(key) or 0) + 1)))
+
+    def delete(self, key):
+        self.ops.append(lambda data: data.pop(key, None))
+
+    def execute(self):
+        for op in self.ops:
+            op(self.redis_client.data)
+
+
+def test_fill_racing_an_invalidation_is_not_served(monkeypatch):
+    redis_client = FakeRedis()
+    monkeypatch.setattr(account_cache, 'get_redis', lambda: redis_client)
+    account_cache._local.clear()
+
+    tier = {'value': 'free'}
+
+    def load_account(engine, user_id):
+        account = {'user_id': user_id, 'tier': tier['value'], 'family_member_limit': 0}
+        # The subscription changes after this request read the old row
+        tier['value'] = 'premium'
+        account_cache.invalidate(user_id)
+        return account
+
+    monkeypatch.setattr(account_cache, 'load_account', load_account)
+    assert account_cache.get_account(None, 'u1')['tier'] == 'free'
+
+    account_cache._local.clear()
+    monkeypatch.setattr(account_cache, 'load_account', lambda engine, user_id: {
+        'user_id': user_id, 'tier': tier['value'], 'family_member_limit': 0,
+    })
+    assert account_cache.get_account(None, 'u1')['tier'] == 'premium'
@@ -0,0 +1,63 @@
+from app.services.analysis_parser import StreamingSectionParser, match_header, parse_sections
+
+ANALYSIS = """Intro before any header.
+## 1. Overall Assessment
+Generally healthy.
+## Integrative Recommendations
+- **Nutrition**: eat leafy greens daily
+- **Sleep**: keep a regular bedtime
+Consider these in order:
+1. Supplements
+2. Lifestyle
+**Supplement Recommendations**
+Vitamin D 2000 IU.
+### 13. Action Items
+1. Recheck labs in 3 months
+"""
+
+
+def test_markdown_headings_and_whole_bold_lines_are_headers():
+    assert match_header("## 3. Medication Review") == ("medication_review", "")
+    assert match_header("## 1. **Overall Assessment**") == ("overall_assessment", "")
+    assert match_header("**Supplement Recommendations**") == ("supplement_recommendations", "")
+    assert match_header("**9. Herbal Medicine:**") == ("herbal_medicine", "")
+    assert match_header("### Traditional Chinese Medicine (TCM) Perspective") == ("tcm_perspective", "")
+
+
+def test_bold_labels_and_numbered_items_are_body_text():
+    assert match_header("**Nutrition**: eat leafy greens daily") is None
+    assert match_header("- **Lifestyle**") is None
+    assert match_header("1. Supplements") is None
+    assert match_header("2. Lifestyle") is None
+    assert match_header("1. **Supplements**") is None
+
+
+def test_body_lines_stay_in_their_section():
+    sections = parse_sections(ANALYSIS)
+
+    assert sections["overall_assessment"] == "Intro before any header.\nGenerally healthy.\n"
+    integrative = sections["integrative_recommendations"]
+    assert "**Nutrition**: eat leafy greens daily" in integrative
+    assert "1. Supplements\n2. Lifestyle\n" in integrative
+    assert sections["clinical_nutrition"] == ""
+    assert sections["lifestyle_suggestions"] == ""
+    assert sections["supplement_recommendations"] == "Vitamin D 2000 IU.\n"
+    assert sections["action_items"] == "1. Recheck labs in 3 months\n"
+
+
+def test_chunk_split_stream_matches_one_shot_parse():
+    parser = StreamingSectionParser()
+    events = []
+    # Chunks split headers, bold markers and newlines mid-token
+    for start in range(0, len(ANALYSIS), 7):
+        events.extend(parser.feed(ANALYSIS[start:start + 7]))
+    events.extend(parser.finish())
+
+    assert parser.sections == parse_sections(ANALYSIS)
+    assert [event["section"] for event in events] == [
+        "overall_assessment",
+        "integrative_recommendations",
+        "supplement_recommendations",
+        "action_items",
+    ]
+    assert events[1]["content"] == parser.sections["integrative_recommendations"]
@@ -0,0 +1,31 @@
+from app.services.lab_reference import canonical_range, flag_results, normalize_unit, parse_reference_range
+from app.services.lab_values import build_lab_value_rows
+
+
+def test_untyped_reference_ranges_are_not_an_error():
+    assert parse_reference_range(5) == ('unknown', None, None, None)
+    assert parse_reference_range(['3.5', '5.0']) == ('unknown', None, None, None)
+    assert parse_reference_range({'low': 3.5}) == ('unknown', None, None, None)
+    assert parse_reference_range('3.5-5.0') == ('between', 3.5, 5.0, None)
+
+
+def test_untyped_fields_flow_through_flagging_and_row_building():
+    results = [
+        {'name': 'Glucose', 'value': 90, 'unit': 'mg/dL', 'reference_range': 5},
+        {'name': 'Potassium', 'value': '4.1', 'unit': 7, 'reference_range': ['3.5', '5.0']},
+    ]
+
+    flagged = flag_results(results)
+    assert [entry['status'] for entry in flagged] == ['unknown', 'unknown']
+    assert normalize_unit(7) == '7'
+
+    rows = build_lab_value_rows(1, 'u1', None, results)
+    assert [row['status'] for row in rows] == ['unknown', 'unknown']
+
+
+def test_canonical_range_keeps_distinct_ranges_apart():
+    assert canonical_range('≥40') == canonical_range('>=40') == '≥40'
+    assert canonical_range('≤40') == '≤40'
+    assert canonical_range('3.5–5.0') == canonical_range('3.5 - 5') == '3.5–5'
+    assert canonical_range('<1:40') != canonical_range('<1:80')
+    assert canonical_range('≥40') != canonical_range('≤40')
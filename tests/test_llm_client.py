@@ -0,0 +1,200 @@
+"""llm_client retries, breaker and hedging against tools/mock_anthropic.py served on a local port"""
+import asyncio
+import socket
+import threading
+import time
+from collections import deque
+
+import httpx
+import pytest
+import uvicorn
+
+from app.services import llm_client, llm_resilience
+from app.services.llm_resilience import CircuitBreaker, LLMUnavailable
+from app.services.llm_scheduler import scheduler
+from tools import mock_anthropic
+
+ENDPOINT = 'mock_test'
+PARAMS = {'model': 'mock-model', 'max_tokens': 64, 'messages': [{'role': 'user', 'content': 'Hello'}]}
+
+
+@pytest.fixture(scope='module')
+def mock_url():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(mock_anthropic.app, log_level='warning', ws='none'))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "mock server did not start"
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+@pytest.fixture
+def mock(mock_url, monkeypatch):
+    """Fast, deterministic mock; the app's client, breaker and counters start fresh"""
+    monkeypatch.setitem(mock_anthropic.CONFIG, 'ttft_ms', 10)
+    monkeypatch.setitem(mock_anthropic.CONFIG, 'jitter', 0)
+    monkeypatch.setitem(mock_anthropic.CONFIG, 'tokens_per_sec', 100000)
+    monkeypatch.setitem(mock_anthropic.CONFIG, 'output_tokens', 10)
+    monkeypatch.setitem(mock_anthropic.CONFIG, 'errors', {})
+    httpx.post(f"{mock_url}/mock/reset")
+
+    monkeypatch.setattr(llm_client, 'ANTHROPIC_BASE_URL', mock_url)
+    monkeypatch.setattr(llm_client, 'ANTHROPIC_API_KEY', 'mock')
+    monkeypatch.setattr(llm_client, '_client', None)
+    monkeypatch.setattr(llm_client, '_async_client', None)
+    monkeypatch.setattr(llm_resilience, 'breaker', CircuitBreaker(threshold=2, cooldown=0.3))
+    monkeypatch.setattr(llm_resilience, '_latencies', {})
+    monkeypatch.setattr(llm_resilience, '_counters', {})
+    # Retry-After from the mock is 1s; keep it, but cap any longer waits
+    monkeypatch.setitem(llm_resilience.ENDPOINT_POLICIES, ENDPOINT, {'max_retries': 2, 'base_delay': 0.01, 'max_delay': 2.0, 'timeout': 10.0})
+
+    def script(*steps):
+        httpx.post(f"{mock_url}/mock/script", json={'requests': list(steps)}).raise_for_status()
+
+    def stats():
+        return httpx.get(f"{mock_url}/mock/stats").json()
+
+    return script, stats
+
+
+def _create():
+    return asyncio.run(llm_client.create_message(dict(PARAMS), endpoint=ENDPOINT))
+
+
+def test_overloaded_and_rate_limited_calls_are_retried_to_success(mock):
+    script, stats = mock
+    script({'error': 529}, {'error': 429})
+
+    started = time.monotonic()
+    response = _create()
+    elapsed = time.monotonic() - started
+
+    assert response.content[0].text
+    assert stats()['requests'] == 3
+    assert stats()['errors'] == {'529': 1, '429': 1}
+    assert llm_resilience.stats()['endpoints'][ENDPOINT]['retries'] == 2
+    # Both failures carried Retry-After: 1, which the backoff never undercuts
+    assert elapsed >= 2.0
+    assert llm_resilience.breaker.state == 'closed'
+
+
+def test_exhausted_retries_raise_503_with_retry_after(mock):
+    script, stats = mock
+    script({'error': 529}, {'error': 529}, {'error': 529})
+
+    with pytest.raises(LLMUnavailable) as raised:
+        _create()
+
+    assert raised.value.status_code == 503
+    assert raised.value.headers['Retry-After'] == '1'
+    assert stats()['requests'] == 3
+
+
+def test_non_retryable_error_is_not_retried(mock):
+    script, stats = mock
+    script({'error': 400})
+
+    with pytest.raises(Exception) as raised:
+        _create()
+
+    assert getattr(raised.value, 'status_code', None) == 400
+    assert stats()['requests'] == 1
+    assert llm_resilience.breaker.state == 'closed'
+
+
+def test_breaker_opens_fails_fast_then_half_open_probe_closes_it(mock, monkeypatch):
+    script, stats = mock
+    monkeypatch.setitem(llm_resilience.ENDPOINT_POLICIES, ENDPOINT, {'max_retries': 0, 'timeout': 10.0})
+    script({'error': 500}, {'error': 500})
+
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            _create()
+    assert llm_resilience.breaker.state == 'open'
+
+    # Open: rejected without reaching the provider
+    with pytest.raises(LLMUnavailable):
+        _create()
+    assert stats()['requests'] == 2
+
+    time.sleep(0.35)
+    response = _create()
+
+    assert response.content[0].text
+    assert stats()['requests'] == 3
+    assert llm_resilience.breaker.state == 'closed'
+
+
+def test_failed_half_open_probe_reopens_breaker(mock, monkeypatch):
+    script, stats = mock
+    monkeypatch.setitem(llm_resilience.ENDPOINT_POLICIES, ENDPOINT, {'max_retries': 0, 'timeout': 10.0})
+    script({'error': 529}, {'error': 529}, {'error': 529})
+
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            _create()
+    time.sleep(0.35)
+    with pytest.raises(LLMUnavailable):
+        _create()
+
+    assert stats()['requests'] == 3
+    assert llm_resilience.breaker.state == 'open'
+
+
+def test_hedge_wins_against_slow_primary_and_frees_its_slot_after_the_loser(mock, monkeypatch):
+    script, stats = mock
+    monkeypatch.setattr(llm_resilience, 'HEDGE_ENDPOINTS', {ENDPOINT})
+    # Recent calls took 50ms, so a hedge goes out once the primary passes that
+    llm_resilience._latencies[ENDPOINT] = deque([0.05] * 20, maxlen=200)
+    script({'latency_ms': 800}, {'latency_ms': 10})
+    baseline = scheduler.active
+
+    async def scenario():
+        response = await llm_client.create_message(dict(PARAMS), endpoint=ENDPOINT)
+        # The hedge's slot is still held by the primary, which is still running
+        held_after_return = scheduler.active - baseline
+        await asyncio.sleep(1.2)
+        return response, held_after_return
+
+    response, held_after_return = asyncio.run(scenario())
+    counters = llm_resilience.stats()['endpoints'][ENDPOINT]
+
+    assert response.content[0].text
+    assert stats()['requests'] == 2
+    assert counters['hedges'] == 1
+    assert counters['hedge_wins'] == 1
+    assert held_after_return == 1
+    assert scheduler.active == baseline
+    assert counters['hedge_wasted_tokens'] > 0
+
+
+def test_no_hedge_without_latency_history(mock, monkeypatch):
+    script, stats = mock
+    monkeypatch.setattr(llm_resilience, 'HEDGE_ENDPOINTS', {ENDPOINT})
+    script({'latency_ms': 200})
+
+    _create()
+
+    assert stats()['requests'] == 1
+    assert llm_resilience.stats()['endpoints'][ENDPOINT]['hedges'] == 0
+
+
+def test_stream_open_is_retried_then_streams_text(mock):
+    script, stats = mock
+    script({'error': 529})
+
+    async def scenario():
+        return ''.join([delta async for delta in llm_client.stream_text(dict(PARAMS), endpoint=ENDPOINT)])
+
+    text = asyncio.run(scenario())
+
+    assert text
+    assert stats()['requests'] == 2
+    assert stats()['streams'] == 1
+    assert llm_resilience.stats()['endpoints'][ENDPOINT]['retries'] == 1
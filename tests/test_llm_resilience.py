@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from app.services import llm_resilience
+from app.services.llm_resilience import CircuitBreaker
+
+
+def _half_open_breaker(monkeypatch) -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=1, cooldown=30)
+    breaker.state = 'open'
+    breaker.opened_at = time.monotonic() - 60
+    monkeypatch.setattr(llm_resilience, 'breaker', breaker)
+    return breaker
+
+
+def test_cancelled_probe_releases_half_open_breaker(monkeypatch):
+    breaker = _half_open_breaker(monkeypatch)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hanging_call():
+            started.set()
+            await asyncio.sleep(3600)
+
+        probe = asyncio.create_task(llm_resilience.call_with_resilience(hanging_call, 'test', hedge=False))
+        await started.wait()
+        assert breaker.state == 'half-open'
+        probe.cancel()
+        try:
+            await probe
+        except asyncio.CancelledError:
+            pass
+
+        async def ok_call():
+            return 'ok'
+
+        # The next call is let through as the new probe and closes the breaker
+        return await llm_resilience.call_with_resilience(ok_call, 'test', hedge=False)
+
+    assert asyncio.run(scenario()) == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_hedge_slot_released_when_losing_request_finishes(monkeypatch):
+    slots = {'held': 0}
+
+    def try_acquire():
+        slots['held'] += 1
+        return True
+
+    def release():
+        slots['held'] -= 1
+
+    monkeypatch.setattr(llm_resilience.scheduler, 'try_acquire', try_acquire)
+    monkeypatch.setattr(llm_resilience.scheduler, 'release', release)
+    monkeypatch.setattr(llm_resilience, '_hedge_after', lambda endpoint, policy: 0.01)
+
+    async def scenario():
+        calls = []
+        loser_done = asyncio.Event()
+
+        async def call():
+            calls.append(None)
+            if len(calls) == 1:
+                # Primary: slow, outlives the hedge
+                await asyncio.sleep(0.2)
+                loser_done.set()
+                return 'primary'
+            return 'hedge'
+
+        result = await llm_resilience._attempt(call, 'test', llm_resilience.get_policy('test'), hedge=True)
+        held_after_return = slots['held']
+        await loser_done.wait()
+        await asyncio.sleep(0)
+        return result, held_after_return
+
+    result, held_after_return = asyncio.run(scenario())
+    assert result == 'hedge'
+    assert held_after_return == 1
+    assert slots['held'] == 0
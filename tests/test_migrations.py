@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault('DATABASE_URL', 'postgresql://x:y@127.0.0.1:1/x')
+
+from app import main  # noqa: E402
+
+
+class FakeConnection:
+    def __init__(self, engine):
+        self.engine = engine
+        self.pending = []
+
+    def execute(self, statement):
+        sql = str(statement)
+        if 'client_protocols' in sql:
+            raise RuntimeError('relation "client_protocols" does not exist')
+        self.pending.append(sql)
+
+    def commit(self):
+        self.engine.committed.extend(self.pending)
+        self.pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeEngine:
+    def __init__(self):
+        self.committed = []
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+def test_failing_group_does_not_hold_back_the_others(monkeypatch):
+    engine = FakeEngine()
+    monkeypatch.setattr(main, 'engine', engine)
+
+    main.run_migrations()
+
+    assert not any('weekly_checkins' in sql for sql in engine.committed)
+    assert any('CREATE TABLE IF NOT EXISTS lab_results' in sql for sql in engine.committed)
+    assert any('CREATE TABLE IF NOT EXISTS lab_values' in sql for sql in engine.committed)
+    assert any('CREATE TABLE IF NOT EXISTS ai_analyses' in sql for sql in engine.committed)
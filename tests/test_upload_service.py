@@ -0,0 +1,79 @@
+import asyncio
+import json
+import re
+
+from fastapi import FastAPI, File, UploadFile
+from fastapi.testclient import TestClient
+
+from app.services.upload_service import MULTIPART_OVERHEAD, UploadLimitMiddleware, spool_upload
+
+MAX_BYTES = 1024
+LIMITS = [(re.compile(r'^/upload$'), MAX_BYTES, "File too large")]
+
+
+def _app(calls):
+    app = FastAPI()
+    app.add_middleware(UploadLimitMiddleware, limits=LIMITS)
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        calls.append(file.filename)
+        spooled = await spool_upload(file, MAX_BYTES, "File too large")
+        return {"size": spooled.size, "same_file": spooled.file is file.file, "b64": spooled.b64encode()}
+
+    return app
+
+
+def test_upload_under_the_limit_is_hashed_in_place():
+    calls = []
+    client = TestClient(_app(calls))
+
+    response = client.post("/upload", files={"file": ("lab.png", b"abc", "image/png")})
+
+    assert response.status_code == 200
+    assert response.json() == {"size": 3, "same_file": True, "b64": "YWJj"}
+
+
+def test_oversized_content_length_is_refused_before_the_route():
+    calls = []
+    client = TestClient(_app(calls))
+
+    response = client.post("/upload", files={"file": ("lab.png", b"x" * (MAX_BYTES + MULTIPART_OVERHEAD + 1), "image/png")})
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "File too large"}
+    assert calls == []
+
+
+def test_chunked_body_is_cut_off_once_it_crosses_the_limit():
+    calls = []
+    app = _app(calls)
+    chunk = b"x" * 16 * 1024
+    total_chunks = 64
+    consumed = []
+    sent = []
+
+    head = b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="lab.png"\r\nContent-Type: image/png\r\n\r\n'
+
+    async def receive():
+        consumed.append(None)
+        more = len(consumed) < total_chunks
+        return {"type": "http.request", "body": head + chunk if len(consumed) == 1 else chunk, "more_body": more}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload", "raw_path": b"/upload", "query_string": b"",
+        "root_path": "", "server": ("test", 80), "client": ("test", 1),
+        # No Content-Length: a chunked upload
+        "headers": [(b"content-type", b"multipart/form-data; boundary=xyz")],
+    }
+    asyncio.run(app(scope, receive, send))
+
+    assert sent[0]["status"] == 400
+    assert json.loads(sent[1]["body"]) == {"detail": "File too large"}
+    assert calls == []
+    # Stopped just past MAX_BYTES + MULTIPART_OVERHEAD instead of reading all 1MB
+    assert len(consumed) == (MAX_BYTES + MULTIPART_OVERHEAD) // len(chunk) + 1 < total_chunks
@@ -0,0 +1,441 @@
+"""
+Load Test - Scripted end-to-end scenarios against a running API
+Virtual users loop over weighted scenarios (a chat session, a practitioner
+dashboard refresh, a client portal visit, a compliance submit) for a fixed
+duration and the run reports p50/p95/p99 latency and throughput per route
+template, saved as JSON so runs can be compared across commits.
+
+Typical local setup (Postgres from docker-compose, LLM calls to the mock):
+    python -m tools.mock_anthropic --port 8089
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=mock \\
+        SUBSCRIPTION_ADMIN_PASSWORD=local uvicorn app.main:app --port 8000
+
+Run (provisions synthetic tenants through the API, or reuses a tenants file):
+    python -m tools.loadtest run --base-url http://127.0.0.1:8000 --admin-password local \\
+        --tenants 5 --users 20 --duration 60 --out loadtest-results/$(git rev-parse --short HEAD).json
+    python -m tools.loadtest run --tenants-file tenants.json --mix dashboard=3,portal=3
+
+Compare two runs (exit code 1 when a route's p95 regressed past --threshold):
+    python -m tools.loadtest compare loadtest-results/base.json loadtest-results/head.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+DEFAULT_MIX = 'chat=1,dashboard=3,portal=4,compliance=2'
+
+CHAT_OPENERS = [
+    "I've been waking up at 3am most nights and can't get back to sleep. What could be going on?",
+    "My digestion has been off for weeks - bloating after most meals, especially bread and dairy.",
+    "What does Ayurveda say about managing stress and anxiety through diet?",
+    "My last blood test showed ferritin of 14 ng/mL. Is that something to worry about?",
+]
+CHAT_FOLLOW_UPS = [
+    "Which of those would you try first?",
+    "Are there any herbs that could help with that?",
+    "How long before I should expect to see a difference?",
+]
+
+PROTOCOL_ITEMS = {
+    'supplements': [
+        {'name': 'Magnesium glycinate', 'dosage': '300mg', 'frequency': 'Nightly'},
+        {'name': 'Vitamin D3', 'dosage': '2000 IU', 'frequency': 'Daily with food'},
+        {'name': 'Ashwagandha', 'dosage': '600mg', 'frequency': 'Morning'},
+    ],
+    'exercises': [{'name': 'Brisk walk', 'frequency': '30 min daily'}, {'name': 'Yoga', 'frequency': '3x weekly'}],
+    'lifestyle_changes': ['No screens after 9pm', 'Morning sunlight within 30 minutes of waking'],
+    'nutrition': {'add': ['Leafy greens', 'Fermented foods'], 'avoid': ['Refined sugar', 'Alcohol']},
+}
+
+
+# ==================== RESULTS ====================
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    """Latency samples and status codes per route template"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.scenarios: Dict[str, int] = defaultdict(int)
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record(self, route: str, seconds: float, status: str):
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = (self.finished or time.monotonic()) - self.started
+        routes = {}
+        for route in sorted(self.latencies):
+            samples = [s * 1000 for s in self.latencies[route]]
+            statuses = dict(self.statuses[route])
+            errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+            routes[route] = {
+                'count': len(samples),
+                'errors': errors,
+                'statuses': statuses,
+                'rps': round(len(samples) / elapsed, 2) if elapsed else None,
+                'mean_ms': round(sum(samples) / len(samples), 1),
+                'p50_ms': round(percentile(samples, 50), 1),
+                'p95_ms': round(percentile(samples, 95), 1),
+                'p99_ms': round(percentile(samples, 99), 1),
+                'max_ms': round(max(samples), 1),
+            }
+        total = sum(route['count'] for route in routes.values())
+        return {
+            'duration_seconds': round(elapsed, 1),
+            'requests': total,
+            'errors': sum(route['errors'] for route in routes.values()),
+            'rps': round(total / elapsed, 2) if elapsed else None,
+            'scenarios': dict(self.scenarios),
+            'routes': routes,
+        }
+
+
+async def timed(recorder: Recorder, route: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+    started = time.monotonic()
+    try:
+        response = await request
+    except httpx.HTTPError as e:
+        recorder.record(route, time.monotonic() - started, e.__class__.__name__)
+        return None
+    recorder.record(route, time.monotonic() - started, str(response.status_code))
+    return response
+
+
+# ==================== TENANTS ====================
+
+async def provision_tenants(
+    http: httpx.AsyncClient,
+    count: int,
+    clients_per_tenant: int,
+    admin_password: str,
+) -> List[Dict[str, Any]]:
+    """
+    Register practitioners through the API, upgrade them to pro (client and
+    message limits), and give each a protocol assigned to a few clients with
+    active client-view links.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    tenants = []
+    for i in range(count):
+        email = f"loadtest-{run_id}-{i}@example.com"
+        password = f"lt-{run_id}-pass"
+        response = await http.post('/api/auth/register', json={'email': email, 'password': password, 'name': f"Load Test {i}"})
+        response.raise_for_status()
+        token = response.json()['token']
+
+        response = await http.post('/api/admin/activate-subscription', json={
+            'admin_password': admin_password, 'email': email, 'tier': 'pro',
+        })
+        response.raise_for_status()
+
+        headers = {'Authorization': f"Bearer {token}"}
+        response = await http.post('/api/protocols', headers=headers, json={
+            'name': 'Sleep & Stress Reset',
+            'traditions': 'Ayurveda, Western',
+            'description': 'Load test protocol',
+            'duration_weeks': 8,
+            **PROTOCOL_ITEMS,
+        })
+        response.raise_for_status()
+        protocol_id = response.json()['id']
+
+        clients = []
+        for j in range(clients_per_tenant):
+            response = await http.post('/api/family/members', headers=headers, json={
+                'name': f"Client {i}-{j}", 'relationship': 'client', 'age': 30 + j,
+            })
+            response.raise_for_status()
+            client_id = response.json()['id']
+
+            response = await http.post(f"/api/protocols/{protocol_id}/assign", headers=headers, json={
+                'client_id': client_id, 'start_date': date.today().isoformat(),
+            })
+            response.raise_for_status()
+
+            response = await http.post('/api/client-view/generate', headers=headers, json={'family_member_id': client_id})
+            response.raise_for_status()
+            clients.append({'id': client_id, 'view_token': response.json()['token']})
+
+        tenants.append({'email': email, 'password': password, 'token': token, 'clients': clients})
+        print(f"👥 Provisioned tenant {i + 1}/{count} ({clients_per_tenant} clients)")
+    return tenants
+
+
+def write_json(path: str, data: Any):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def load_tenants(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        tenants = json.load(f)
+    if not tenants:
+        raise SystemExit(f"No tenants in {path}")
+    return tenants
+
+
+async def refresh_tokens(http: httpx.AsyncClient, tenants: List[Dict[str, Any]]):
+    """Tenants files outlive JWTs - log in again before the run"""
+    for tenant in tenants:
+        response = await http.post('/api/auth/login', json={'email': tenant['email'], 'password': tenant['password']})
+        response.raise_for_status()
+        tenant['token'] = response.json()['token']
+
+
+# ==================== SCENARIOS ====================
+
+async def chat_session(http: httpx.AsyncClient, recorder: Recorder, tenant: Dict[str, Any], rng: random.Random):
+    """Open a conversation and send two follow-ups"""
+    headers = {'Authorization': f"Bearer {tenant['token']}"}
+    response = await timed(recorder, 'POST /api/chat/conversations', http.post(
+        '/api/chat/conversations', headers=headers, json={'initial_message': rng.choice(CHAT_OPENERS)},
+    ))
+    if response is None or response.status_code != 200:
+        return
+    conversation_id = response.json()['conversation']['id']
+    for message in rng.sample(CHAT_FOLLOW_UPS, 2):
+        await timed(recorder, 'POST /api/chat/conversations/{conversation_id}/messages', http.post(
+            f"/api/chat/conversations/{conversation_id}/messages", headers=headers, json={'message': message},
+        ))
+
+
+async def dashboard_refresh(http: httpx.AsyncClient, recorder: Recorder, tenant: Dict[str, Any], rng: random.Random):
+    """The practitioner dashboard loads its three panels in parallel"""
+    headers = {'Authorization': f"Bearer {tenant['token']}"}
+    await asyncio.gather(*[
+        timed(recorder, f"GET {path}", http.get(path, headers=headers))
+        for path in ('/api/pro/statistics', '/api/pro/client-activity', '/api/outcomes/summary')
+    ])
+
+
+async def portal_visit(http: httpx.AsyncClient, recorder: Recorder, tenant: Dict[str, Any], rng: random.Random):
+    """A client opens their link: protocol view, check-in status, message thread"""
+    token = rng.choice(tenant['clients'])['view_token']
+    await timed(recorder, 'GET /api/client-view/{token}', http.get(f"/api/client-view/{token}"))
+    await asyncio.gather(
+        timed(recorder, 'GET /api/client-view/{token}/checkin-status', http.get(f"/api/client-view/{token}/checkin-status")),
+        timed(recorder, 'GET /api/client-view/{token}/messages', http.get(f"/api/client-view/{token}/messages")),
+    )
+
+
+async def compliance_submit(http: httpx.AsyncClient, recorder: Recorder, tenant: Dict[str, Any], rng: random.Random):
+    """A client ticks off this week's protocol items"""
+    token = rng.choice(tenant['clients'])['view_token']
+    items = [s['name'] for s in PROTOCOL_ITEMS['supplements']] + PROTOCOL_ITEMS['lifestyle_changes']
+    completed = [item for item in items if rng.random() < 0.75]
+    await timed(recorder, 'POST /api/client-view/{token}/compliance', http.post(
+        f"/api/client-view/{token}/compliance",
+        json={
+            'compliance_score': round(100 * len(completed) / len(items)),
+            'completed_items': completed,
+            'incomplete_items': [item for item in items if item not in completed],
+            'total_items': len(items),
+        },
+    ))
+
+
+SCENARIOS: Dict[str, Callable] = {
+    'chat': chat_session,
+    'dashboard': dashboard_refresh,
+    'portal': portal_visit,
+    'compliance': compliance_submit,
+}
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """'chat=1,dashboard=3' -> {'chat': 1.0, 'dashboard': 3.0}"""
+    mix = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ==================== RUNNER ====================
+
+async def virtual_user(
+    http: httpx.AsyncClient,
+    recorder: Recorder,
+    tenants: List[Dict[str, Any]],
+    mix: Dict[str, float],
+    deadline: float,
+    think_time: float,
+    seed: int,
+):
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        recorder.scenarios[name] += 1
+        await SCENARIOS[name](http, recorder, rng.choice(tenants), rng)
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.users * 3, max_keepalive_connections=args.users * 3)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as http:
+        if args.tenants_file:
+            tenants = load_tenants(args.tenants_file)
+            await refresh_tokens(http, tenants)
+        else:
+            if not args.admin_password:
+                raise SystemExit("--admin-password is required to provision tenants (or pass --tenants-file)")
+            tenants = await provision_tenants(http, args.tenants, args.clients_per_tenant, args.admin_password)
+            if args.save_tenants:
+                write_json(args.save_tenants, tenants)
+
+        if args.warmup:
+            warmup = Recorder()
+            await asyncio.gather(*[
+                virtual_user(http, warmup, tenants, mix, time.monotonic() + args.warmup, args.think_time, args.seed + i)
+                for i in range(args.users)
+            ])
+
+        print(f"🚀 {args.users} users for {args.duration}s, mix {mix}")
+        recorder = Recorder()
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*[
+            virtual_user(http, recorder, tenants, mix, deadline, args.think_time, args.seed + 1000 + i)
+            for i in range(args.users)
+        ])
+        recorder.finished = time.monotonic()
+
+    return {
+        'commit': git_commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'config': {
+            'base_url': args.base_url,
+            'users': args.users,
+            'duration': args.duration,
+            'think_time': args.think_time,
+            'mix': mix,
+            'tenants': len(tenants),
+            'clients': sum(len(t['clients']) for t in tenants),
+        },
+        **recorder.summary(),
+    }
+
+
+def print_summary(result: Dict[str, Any]):
+    print(f"\n{'route':<58} {'count':>7} {'err':>5} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, stats in result['routes'].items():
+        print(
+            f"{route:<58} {stats['count']:>7} {stats['errors']:>5} {stats['rps']:>7} "
+            f"{stats['p50_ms']:>8} {stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+        )
+    print(f"\n{result['requests']} requests, {result['errors']} errors, {result['rps']} req/s over {result['duration_seconds']}s")
+
+
+# ==================== COMPARE ====================
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], threshold: float) -> List[str]:
+    """Print per-route latency deltas; returns the routes whose p95 regressed past threshold (%)"""
+    regressions = []
+    print(f"base {base.get('commit')} -> head {head.get('commit')}\n")
+    print(f"{'route':<58} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'rps':>14}")
+    for route in sorted(set(base['routes']) | set(head['routes'])):
+        old, new = base['routes'].get(route), head['routes'].get(route)
+        if old is None or new is None:
+            print(f"{route:<58} {'(only in ' + ('head' if old is None else 'base') + ')':>16}")
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            cells.append(f"{new[key]:>8} {change:>+6.1f}%")
+        flag = ''
+        if old['p95_ms'] and (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100 > threshold:
+            regressions.append(route)
+            flag = '  ⚠️'
+        print(f"{route:<58} " + ' '.join(cells) + flag)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test for the Tree of Life API")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the scenarios and save per-route latency")
+    run_parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    run_parser.add_argument('--users', type=int, default=10, help="Concurrent virtual users")
+    run_parser.add_argument('--duration', type=float, default=60, help="Measured seconds")
+    run_parser.add_argument('--warmup', type=float, default=5, help="Unmeasured seconds before the run")
+    run_parser.add_argument('--think-time', type=float, default=0.0, help="Mean pause between scenarios (s)")
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help="Scenario weights, e.g. chat=1,portal=4")
+    run_parser.add_argument('--timeout', type=float, default=120)
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--tenants', type=int, default=3, help="Practitioners to provision")
+    run_parser.add_argument('--clients-per-tenant', type=int, default=5)
+    run_parser.add_argument('--admin-password', help="SUBSCRIPTION_ADMIN_PASSWORD, used to upgrade tenants to pro")
+    run_parser.add_argument('--tenants-file', help="Reuse tenants instead of provisioning")
+    run_parser.add_argument('--save-tenants', help="Write provisioned tenants here for later runs")
+    run_parser.add_argument('--out', help="Save the result JSON here")
+
+    compare_parser = commands.add_parser('compare', help="Compare two saved runs")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help="p95 regression (%%) that fails")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.head) as f:
+            head = json.load(f)
+        regressions = compare(base, head, args.threshold)
+        if regressions:
+            print(f"\n❌ p95 regressed more than {args.threshold}% on {len(regressions)} route(s)")
+            sys.exit(1)
+        print("\n✅ No p95 regressions")
+        return
+
+    result = asyncio.run(run(args))
+    print_summary(result)
+    if args.out:
+        write_json(args.out, result)
+        print(f"💾 Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Mock Anthropic Server - Local fake of the Messages API for load and regression testing
+Serves POST /v1/messages (streaming and non-streaming) with configurable
+time-to-first-token, token rate, latency jitter and error injection, and
+does prompt-cache accounting for cache_control blocks so cache hit rates
+can be measured without spending tokens.
+
+Run:
+    python -m tools.mock_anthropic --port 8089 --tokens-per-sec 80 --errors 529:0.02,429:0.01
+
+Point the app at it:
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=mock uvicorn app.main:app
+
+Per-request overrides (headers): x-mock-latency-ms, x-mock-error (status code),
+x-mock-output-tokens. Counters: GET /mock/stats, reset with POST /mock/reset.
+
+Scripted faults for regression tests: POST /mock/script with
+{"requests": [{"error": 529}, {"latency_ms": 1500}, {}]} makes the next
+requests, in arrival order, fail or slow down as listed; once the script is
+used up the configured behaviour applies again.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Rough chars-per-token, same heuristic the app uses for budgets
+CHARS_PER_TOKEN = 4
+# Prefixes shorter than this are never cached (Sonnet minimum)
+MIN_CACHEABLE_TOKENS = 1024
+CACHE_TTL = 300
+
+ERROR_TYPES = {
+    400: 'invalid_request_error',
+    401: 'authentication_error',
+    429: 'rate_limit_error',
+    500: 'api_error',
+    503: 'api_error',
+    529: 'overloaded_error',
+}
+
+CONFIG: Dict[str, Any] = {
+    'ttft_ms': float(os.getenv('MOCK_TTFT_MS', '400')),
+    'jitter': float(os.getenv('MOCK_JITTER', '0.25')),           # +/- fraction of latency
+    'tokens_per_sec': float(os.getenv('MOCK_TOKENS_PER_SEC', '80')),
+    'output_tokens': int(os.getenv('MOCK_OUTPUT_TOKENS', '0')),  # 0 = derived from the prompt
+    'errors': {},                                                # status -> probability
+    'stream_error_rate': float(os.getenv('MOCK_STREAM_ERROR_RATE', '0')),
+    'seed': int(os.getenv('MOCK_SEED', '1234')),
+}
+
+_rng = random.Random(CONFIG['seed'])
+_cache: Dict[str, float] = {}
+# Per-request overrides queued by POST /mock/script, consumed in arrival order
+_script: List[Dict[str, Any]] = []
+_stats: Dict[str, Any] = {}
+
+
+def reset_stats():
+    _stats.clear()
+    _stats.update({
+        'requests': 0,
+        'streams': 0,
+        'errors': {},
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'cache_creation_input_tokens': 0,
+        'cache_read_input_tokens': 0,
+        'cache_hits': 0,
+        'cache_writes': 0,
+    })
+
+
+reset_stats()
+
+
+def parse_error_spec(spec: str) -> Dict[int, float]:
+    """'529:0.02,429:0.01' -> {529: 0.02, 429: 0.01}"""
+    errors = {}
+    for part in (spec or '').split(','):
+        if ':' in part:
+            status, probability = part.split(':', 1)
+            errors[int(status)] = float(probability)
+    return errors
+
+
+CONFIG['errors'] = parse_error_spec(os.getenv('MOCK_ERRORS', ''))
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def _block_text(block: Any) -> str:
+    if isinstance(block, str):
+        return block
+    if block.get('type') == 'text':
+        return block.get('text', '')
+    if block.get('type') in ('image', 'document'):
+        # Images/PDFs bill by size; ~1 token per 750 base64 chars is close enough
+        data = block.get('source', {}).get('data', '')
+        return 'x' * (len(data) // 750 * CHARS_PER_TOKEN)
+    return json.dumps(block)
+
+
+def _flatten(body: Dict[str, Any]) -> List[Tuple[str, bool]]:
+    """Prompt blocks in cache order (tools, system, messages) as (text, has_cache_control)"""
+    blocks = []
+    for tool in body.get('tools') or []:
+        blocks.append((json.dumps(tool), bool(tool.get('cache_control'))))
+    system = body.get('system')
+    if isinstance(system, str):
+        blocks.append((system, False))
+    for block in system if isinstance(system, list) else []:
+        blocks.append((_block_text(block), bool(block.get('cache_control'))))
+    for message in body.get('messages') or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            blocks.append((content, False))
+            continue
+        for block in content or []:
+            blocks.append((_block_text(block), isinstance(block, dict) and bool(block.get('cache_control'))))
+    return blocks
+
+
+def cache_accounting(body: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Usage split the way the real API reports it: the longest prefix ending at a
+    cache_control breakpoint is read from cache if seen within CACHE_TTL,
+    otherwise written; everything after the last breakpoint is plain input.
+    """
+    blocks = _flatten(body)
+    now = time.monotonic()
+    usage = {'input_tokens': 0, 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+
+    last_breakpoint = max((i for i, (_, cached) in enumerate(blocks) if cached), default=-1)
+    prefix = ''.join(text for text, _ in blocks[:last_breakpoint + 1])
+    rest = ''.join(text for text, _ in blocks[last_breakpoint + 1:])
+    prefix_tokens = _tokens(prefix)
+
+    if last_breakpoint < 0 or prefix_tokens < MIN_CACHEABLE_TOKENS:
+        usage['input_tokens'] = prefix_tokens + _tokens(rest)
+        return usage
+
+    key = hashlib.sha256((body.get('model', '') + prefix).encode('utf-8')).hexdigest()
+    if _cache.get(key, 0) > now:
+        usage['cache_read_input_tokens'] = prefix_tokens
+        _stats['cache_hits'] += 1
+    else:
+        usage['cache_creation_input_tokens'] = prefix_tokens
+        _stats['cache_writes'] += 1
+    # Reads refresh the TTL, like the real cache
+    _cache[key] = now + CACHE_TTL
+    usage['input_tokens'] = _tokens(rest)
+    return usage
+
+
+_SECTION_TITLE = re.compile(r'^\d+\.\s+\*\*(.+?)\*\*', re.MULTILINE)
+_WORDS = (
+    "balance inflammation nutrient absorption circulation digestion recovery rhythm "
+    "support baseline marker evidence gentle consistent hydration fiber magnesium "
+    "sleep stress movement clinician follow-up trend range steady"
+).split()
+
+
+def _last_user_text(body: Dict[str, Any]) -> str:
+    for message in reversed(body.get('messages') or []):
+        if message.get('role') != 'user':
+            continue
+        content = message.get('content')
+        if isinstance(content, str):
+            return content
+        return '\n'.join(b.get('text', '') for b in content or [] if isinstance(b, dict) and b.get('type') == 'text')
+    return ''
+
+
+def _prose(rng: random.Random, tokens: int) -> str:
+    words = [rng.choice(_WORDS) for _ in range(max(tokens, 1))]
+    sentences = [' '.join(words[i:i + 12]).capitalize() + '.' for i in range(0, len(words), 12)]
+    return ' '.join(sentences)
+
+
+def generate_text(body: Dict[str, Any], rng: random.Random, output_tokens: Optional[int]) -> str:
+    """
+    Deterministic, shape-correct output: lab extraction gets JSON, section
+    prompts get '## Title' sections, everything else gets prose
+    """
+    prompt = _last_user_text(body)
+    budget = min(output_tokens or max(150, body.get('max_tokens', 1024) // 3), body.get('max_tokens', 1024))
+
+    if 'REQUIRED JSON FORMAT' in prompt:
+        analytes = [('Glucose', 'mg/dL', '70-99'), ('Hemoglobin A1c', '%', '4.0-5.6'),
+                    ('TSH', 'mIU/L', '0.4-4.5'), ('Vitamin D, 25-Hydroxy', 'ng/mL', '30-100'),
+                    ('LDL Cholesterol', 'mg/dL', '<100'), ('Ferritin', 'ng/mL', '30-400')]
+        results = [{'name': name, 'value': str(round(rng.uniform(0.5, 1.3) * (float(re.findall(r'[\d.]+', ref)[-1]) or 1), 1)),
+                    'unit': unit, 'reference_range': ref} for name, unit, ref in analytes]
+        return json.dumps({'test_type': 'Comprehensive Panel', 'results': results}, indent=2)
+
+    titles = _SECTION_TITLE.findall(prompt)
+    if titles:
+        per_section = max(20, budget // len(titles))
+        return '\n\n'.join(f"## {title}\n{_prose(rng, per_section)}" for title in titles)
+
+    return _prose(rng, budget)
+
+
+def _error_response(status: int) -> JSONResponse:
+    _stats['errors'][str(status)] = _stats['errors'].get(str(status), 0) + 1
+    headers = {'retry-after': '1'} if status in (429, 529) else {}
+    return JSONResponse(
+        status_code=status,
+        content={'type': 'error', 'error': {'type': ERROR_TYPES.get(status, 'api_error'), 'message': f'Mock injected {status}'}},
+        headers=headers,
+    )
+
+
+def _jittered(seconds: float, rng: random.Random) -> float:
+    jitter = CONFIG['jitter']
+    return max(0.0, seconds * rng.uniform(1 - jitter, 1 + jitter))
+
+
+def _chunks(text: str, chars: int = CHARS_PER_TOKEN * 3):
+    for i in range(0, len(text), chars):
+        yield text[i:i + chars]
+
+
+app = FastAPI(title="Mock Anthropic Messages API")
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    body = await request.json()
+    _stats['requests'] += 1
+
+    # Seeded per request content so runs are reproducible for the same traffic
+    seed = f"{CONFIG['seed']}:{_stats['requests']}:{json.dumps(body.get('messages'), sort_keys=True)[:512]}"
+    rng = random.Random(seed)
+
+    step = _script.pop(0) if _script else {}
+    forced_error = request.headers.get('x-mock-error') or step.get('error')
+    if forced_error:
+        return _error_response(int(forced_error))
+    roll = _rng.random()
+    for status, probability in CONFIG['errors'].items():
+        if roll < probability:
+            return _error_response(status)
+        roll -= probability
+
+    ttft = float(request.headers.get('x-mock-latency-ms') or step.get('latency_ms') or CONFIG['ttft_ms']) / 1000
+    output_override = request.headers.get('x-mock-output-tokens')
+    text = generate_text(body, rng, int(output_override) if output_override else CONFIG['output_tokens'] or None)
+    # Hard stop at max_tokens, like the real API
+    text = text[:body.get('max_tokens', 1024) * CHARS_PER_TOKEN]
+    output_tokens = _tokens(text)
+    usage = cache_accounting(body)
+    usage['output_tokens'] = output_tokens
+
+    for key in ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'):
+        _stats[key] += usage[key]
+
+    message_id = f"msg_mock_{uuid.uuid4().hex[:20]}"
+    model = body.get('model', 'mock-model')
+    stop_reason = 'max_tokens' if output_tokens >= body.get('max_tokens', 1024) else 'end_turn'
+
+    if not body.get('stream'):
+        await asyncio.sleep(_jittered(ttft + output_tokens / CONFIG['tokens_per_sec'], rng))
+        return {
+            'id': message_id,
+            'type': 'message',
+            'role': 'assistant',
+            'model': model,
+            'content': [{'type': 'text', 'text': text}],
+            'stop_reason': stop_reason,
+            'stop_sequence': None,
+            'usage': usage,
+        }
+
+    _stats['streams'] += 1
+    fail_midstream = _rng.random() < CONFIG['stream_error_rate']
+
+    async def events():
+        def sse(event: str, data: Dict[str, Any]) -> str:
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+        await asyncio.sleep(_jittered(ttft, rng))
+        yield sse('message_start', {'type': 'message_start', 'message': {
+            'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model, 'content': [],
+            'stop_reason': None, 'stop_sequence': None, 'usage': dict(usage, output_tokens=1),
+        }})
+        yield sse('content_block_start', {'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        yield sse('ping', {'type': 'ping'})
+
+        chunks = list(_chunks(text))
+        delay = 3 / CONFIG['tokens_per_sec']
+        for index, chunk in enumerate(chunks):
+            if fail_midstream and index == len(chunks) // 2:
+                _stats['errors']['stream'] = _stats['errors'].get('stream', 0) + 1
+                yield sse('error', {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Mock injected mid-stream error'}})
+                return
+            await asyncio.sleep(delay)
+            yield sse('content_block_delta', {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}})
+
+        yield sse('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        yield sse('message_delta', {'type': 'message_delta', 'delta': {'stop_reason': stop_reason, 'stop_sequence': None}, 'usage': {'output_tokens': output_tokens}})
+        yield sse('message_stop', {'type': 'message_stop'})
+
+    return StreamingResponse(events(), media_type='text/event-stream')
+
+
+@app.get("/mock/stats")
+async def mock_stats():
+    total_prompt = _stats['input_tokens'] + _stats['cache_creation_input_tokens'] + _stats['cache_read_input_tokens']
+    return dict(
+        _stats,
+        config=dict(CONFIG, errors={str(k): v for k, v in CONFIG['errors'].items()}),
+        cache_read_ratio=round(_stats['cache_read_input_tokens'] / total_prompt, 3) if total_prompt else None,
+    )
+
+
+@app.post("/mock/script")
+async def mock_script(request: Request):
+    """Replace the queue of per-request overrides ({"error": status, "latency_ms": ms})"""
+    body = await request.json()
+    _script[:] = body.get('requests') or []
+    return {'success': True, 'queued': len(_script)}
+
+
+@app.post("/mock/reset")
+async def mock_reset():
+    reset_stats()
+    _cache.clear()
+    _script.clear()
+    return {'success': True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local mock of the Anthropic Messages API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--ttft-ms', type=float, default=CONFIG['ttft_ms'], help="Time to first token")
+    parser.add_argument('--jitter', type=float, default=CONFIG['jitter'], help="Latency jitter as a fraction (0.25 = +/-25%%)")
+    parser.add_argument('--tokens-per-sec', type=float, default=CONFIG['tokens_per_sec'])
+    parser.add_argument('--output-tokens', type=int, default=CONFIG['output_tokens'], help="Fixed output length (0 = derived)")
+    parser.add_argument('--errors', default='', help="Error mix, e.g. 529:0.02,429:0.01,500:0.005")
+    parser.add_argument('--stream-error-rate', type=float, default=CONFIG['stream_error_rate'])
+    parser.add_argument('--seed', type=int, default=CONFIG['seed'])
+    args = parser.parse_args()
+
+    CONFIG.update({
+        'ttft_ms': args.ttft_ms,
+        'jitter': args.jitter,
+        'tokens_per_sec': args.tokens_per_sec,
+        'output_tokens': args.output_tokens,
+        'errors': parse_error_spec(args.errors) or CONFIG['errors'],
+        'stream_error_rate': args.stream_error_rate,
+        'seed': args.seed,
+    })
+    _rng.seed(args.seed)
+
+    print(f"🧪 Mock Anthropic API on http://{args.host}:{args.port} (ttft {args.ttft_ms}ms, {args.tokens_per_sec} tok/s, errors {args.errors or 'none'})")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
@@ -0,0 +1,106 @@
+"""
+Slow Queries - Dump the API's slow-query log
+Fetches /api/admin/slow-queries from a running server (or reads a saved
+JSON dump) and prints one line per fingerprint, worst first, with the
+captured EXPLAIN plans underneath when --plans is given.
+
+Run:
+    python -m tools.slow_queries --base-url http://127.0.0.1:8000 --admin-password local
+    python -m tools.slow_queries --admin-password local --sort count --save slow-queries.json
+    python -m tools.slow_queries --file slow-queries.json --plans
+    python -m tools.slow_queries --admin-password local --reset
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict
+
+import httpx
+
+STATEMENT_WIDTH = 90
+
+
+def fetch(base_url: str, admin_password: str, sort: str, limit: int) -> Dict[str, Any]:
+    response = httpx.get(
+        f"{base_url.rstrip('/')}/api/admin/slow-queries",
+        params={'admin_password': admin_password, 'sort': sort, 'limit': limit},
+        timeout=30,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def reset(base_url: str, admin_password: str):
+    response = httpx.post(
+        f"{base_url.rstrip('/')}/api/admin/slow-queries/reset",
+        json={'admin_password': admin_password},
+        timeout=30,
+    )
+    response.raise_for_status()
+
+
+def print_report(report: Dict[str, Any], plans: bool):
+    queries = report.get('queries', [])
+    print(f"🐢 {report.get('fingerprints', len(queries))} slow fingerprints (>= {report.get('threshold_ms')}ms) since {report.get('since')}")
+    if report.get('overflow'):
+        print(f"⚠️  {report['overflow']} slow statements not tracked (SLOW_QUERY_MAX_FINGERPRINTS reached)")
+    if not queries:
+        return
+    print(f"\n{'id':<12} {'count':>6} {'total':>10} {'mean':>9} {'max':>9}  {'explain':<9} statement")
+    for query in queries:
+        status = query.get('explain_status', '')
+        print(
+            f"{query['fingerprint']:<12} {query['count']:>6} {query['total_ms']:>8.0f}ms {query['mean_ms']:>7.0f}ms "
+            f"{query['max_ms']:>7.0f}ms  {status.split(':')[0]:<9} {query['statement'][:STATEMENT_WIDTH]}"
+        )
+    if not plans:
+        return
+    for query in queries:
+        if query.get('explain'):
+            print(f"\n── {query['fingerprint']} ── {query['statement'][:STATEMENT_WIDTH]}")
+            print(query['explain'])
+        elif query.get('explain_status', '').startswith(('failed', 'skipped')):
+            print(f"\n── {query['fingerprint']} ── {query['explain_status']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dump the slow-query log of a running API")
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--admin-password', default=os.getenv('SUBSCRIPTION_ADMIN_PASSWORD'))
+    parser.add_argument('--file', help="Read a saved dump instead of the server")
+    parser.add_argument('--sort', default='total_ms', choices=['total_ms', 'count', 'max_ms', 'mean_ms'])
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--plans', action='store_true', help="Print captured EXPLAIN plans")
+    parser.add_argument('--save', help="Write the raw JSON here")
+    parser.add_argument('--reset', action='store_true', help="Clear the server's log after dumping it")
+    args = parser.parse_args(argv)
+
+    if args.file:
+        with open(args.file) as f:
+            report = json.load(f)
+    else:
+        if not args.admin_password:
+            print("❌ --admin-password (or SUBSCRIPTION_ADMIN_PASSWORD) is required")
+            sys.exit(1)
+        try:
+            report = fetch(args.base_url, args.admin_password, args.sort, args.limit)
+        except httpx.HTTPError as e:
+            print(f"❌ Could not fetch the slow-query log: {e}")
+            sys.exit(1)
+
+    print_report(report, args.plans)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Saved {args.save}")
+
+    if args.reset and not args.file:
+        reset(args.base_url, args.admin_password)
+        print("🧹 Slow-query log reset")
+
+
+if __name__ == "__main__":
+    main()
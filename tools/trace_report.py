@@ -0,0 +1,194 @@
+"""
+Trace Report - Flame-style breakdown of the slowest traced requests
+Reads the JSON-lines traces written by app/services/tracing.py and prints,
+for the slowest N requests, the span tree on a shared timeline with
+self time per span. Repeated sibling statements (N+1 loops) collapse into
+one "×count" line. Ends with the statements that cost the most time overall.
+
+Run:
+    TRACING_ENABLED=true uvicorn app.main:app    # writes traces.jsonl
+    python -m tools.trace_report traces.jsonl --slowest 5
+    python -m tools.trace_report traces.jsonl --route '/messages$' --width 60
+    python -m tools.trace_report traces.jsonl --trace 4422638d96364f7ea82db511ff2d51cf
+"""
+import argparse
+import json
+import re
+import sys
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+LABEL_WIDTH = 72
+
+
+def load_traces(paths: List[str]) -> List[Dict[str, Any]]:
+    traces = []
+    for path in paths:
+        with open(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    traces.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"⚠️  {path}:{number} is not valid JSON, skipped", file=sys.stderr)
+    return traces
+
+
+def label(span: Dict[str, Any]) -> str:
+    attrs = span.get('attributes') or {}
+    name = span['name']
+    if name == 'db.query':
+        text = f"SQL {attrs.get('db.statement', '')}"
+        if 'db.rows' in attrs:
+            text += f" [{attrs['db.rows']} rows]"
+    elif name.startswith('llm.'):
+        parts = [name, attrs.get('llm.endpoint') or '', attrs.get('llm.model') or '']
+        if 'llm.queue_wait_ms' in attrs:
+            parts.append(f"queue={attrs['llm.queue_wait_ms']:.0f}ms")
+        for key, short in (('llm.input_tokens', 'in'), ('llm.output_tokens', 'out'),
+                           ('llm.cache_read_tokens', 'cache_read'), ('llm.cache_write_tokens', 'cache_write')):
+            if attrs.get(key):
+                parts.append(f"{short}={attrs[key]}")
+        text = ' '.join(part for part in parts if part)
+    else:
+        extras = ' '.join(f"{key}={value}" for key, value in attrs.items() if not key.startswith('http.'))
+        text = f"{name} {extras}".strip()
+    if span.get('status') == 'error':
+        text = f"❌ {text}"
+    return text
+
+
+def build_tree(trace: Dict[str, Any]):
+    children = defaultdict(list)
+    root = None
+    for span in trace['spans']:
+        if span.get('parent_id') is None:
+            root = span
+        else:
+            children[span['parent_id']].append(span)
+    for spans in children.values():
+        spans.sort(key=lambda s: s['start_ms'])
+    return root, children
+
+
+def group_siblings(spans: List[Dict[str, Any]], children) -> List[Dict[str, Any]]:
+    """Merge leaf siblings with the same label (in first-seen order); spans with children stay separate"""
+    groups: List[Dict[str, Any]] = []
+    by_label: Dict[str, Dict[str, Any]] = {}
+    for span in spans:
+        text = label(span)
+        if children.get(span['span_id']):
+            groups.append({'label': text, 'spans': [span]})
+            continue
+        group = by_label.get(text)
+        if group is None:
+            group = by_label[text] = {'label': text, 'spans': []}
+            groups.append(group)
+        group['spans'].append(span)
+    return groups
+
+
+def bar(start_ms: float, end_ms: float, total_ms: float, width: int, fill: str) -> str:
+    if total_ms <= 0:
+        return ' ' * width
+    left = min(width - 1, int(start_ms / total_ms * width))
+    right = max(left + 1, min(width, round(end_ms / total_ms * width)))
+    return ' ' * left + fill * (right - left) + ' ' * (width - right)
+
+
+def print_trace(trace: Dict[str, Any], rank: int, width: int):
+    root, children = build_tree(trace)
+    total = trace['duration_ms']
+    print(f"\n{rank}. {trace.get('method')} {trace.get('route')} → {trace.get('status')}  "
+          f"{total:.1f} ms  ({len(trace['spans'])} spans, trace {trace['trace_id']})")
+    if trace.get('dropped_spans'):
+        print(f"   ⚠️  {trace['dropped_spans']} spans dropped (TRACE_MAX_SPANS)")
+    if root is None:
+        print("   (no root span)")
+        return
+    print(f"   {'':<{width}}  {'total':>9} {'self':>9}  span")
+
+    def walk(span_list, depth):
+        for group in group_siblings(span_list, children):
+            spans = group['spans']
+            start = min(s['start_ms'] for s in spans)
+            end = max(s['start_ms'] + s['duration_ms'] for s in spans)
+            duration = sum(s['duration_ms'] for s in spans)
+            nested = [child for s in spans for child in children.get(s['span_id'], [])]
+            self_ms = max(0.0, duration - sum(child['duration_ms'] for child in nested))
+            text = group['label']
+            if len(spans) > 1:
+                text = f"×{len(spans)} {text}"
+            text = ('  ' * depth + text)[:LABEL_WIDTH]
+            fill = '▓' if len(spans) > 1 else '█'
+            print(f"   {bar(start, end, total, width, fill)}  {duration:>7.1f}ms {self_ms:>7.1f}ms  {text}")
+            if nested:
+                walk(sorted(nested, key=lambda s: s['start_ms']), depth + 1)
+
+    walk([root], 0)
+    print(f"   {breakdown(trace)}")
+
+
+def breakdown(trace: Dict[str, Any]) -> str:
+    """Where the request's wall time went, by span kind"""
+    queries = [s for s in trace['spans'] if s['name'] == 'db.query']
+    commits = [s for s in trace['spans'] if s['name'] == 'db.commit']
+    llm = [s for s in trace['spans'] if s['name'].startswith('llm.')]
+    parts = [
+        f"db {sum(s['duration_ms'] for s in queries):.1f}ms ({len(queries)} queries)",
+        f"commits {len(commits)} ({sum(s['duration_ms'] for s in commits):.1f}ms incl. flush)",
+        f"llm {sum(s['duration_ms'] for s in llm):.1f}ms ({len(llm)} calls)",
+    ]
+    return '→ ' + ', '.join(parts)
+
+
+def top_statements(traces: List[Dict[str, Any]], limit: int):
+    totals: Dict[str, List[float]] = defaultdict(list)
+    for trace in traces:
+        for span in trace['spans']:
+            if span['name'] == 'db.query':
+                totals[(span.get('attributes') or {}).get('db.statement', '?')].append(span['duration_ms'])
+    if not totals:
+        return
+    ranked = sorted(totals.items(), key=lambda item: sum(item[1]), reverse=True)[:limit]
+    print(f"\nTop statements across these {len(traces)} traces:")
+    print(f"   {'total':>9} {'calls':>6} {'mean':>8}  statement")
+    for statement, durations in ranked:
+        print(f"   {sum(durations):>7.1f}ms {len(durations):>6} {sum(durations) / len(durations):>6.2f}ms  {statement[:LABEL_WIDTH + 20]}")
+
+
+def select(traces: List[Dict[str, Any]], route: Optional[str], trace_id: Optional[str], slowest: int):
+    if trace_id:
+        return [t for t in traces if t.get('trace_id', '').startswith(trace_id)]
+    if route:
+        pattern = re.compile(route)
+        traces = [t for t in traces if pattern.search(t.get('route') or '')]
+    return sorted(traces, key=lambda t: t.get('duration_ms', 0), reverse=True)[:slowest]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Flame-style breakdown of the slowest traced requests")
+    parser.add_argument('files', nargs='*', default=['traces.jsonl'], help="Trace files (JSON lines)")
+    parser.add_argument('--slowest', type=int, default=10, help="How many requests to show")
+    parser.add_argument('--route', help="Regex on the route template")
+    parser.add_argument('--trace', help="Show one trace by id (prefix is enough)")
+    parser.add_argument('--width', type=int, default=40, help="Timeline width in characters")
+    parser.add_argument('--top-statements', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.files)
+    if not traces:
+        print("No traces found - is TRACING_ENABLED set on the server?")
+        sys.exit(1)
+
+    selected = select(traces, args.route, args.trace, args.slowest)
+    print(f"📊 {len(traces)} traces loaded, showing {len(selected)}")
+    for rank, trace in enumerate(selected, 1):
+        print_trace(trace, rank, args.width)
+    top_statements(selected, args.top_statements)
+
+
+if __name__ == "__main__":
+    main()